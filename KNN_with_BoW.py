@@ -6,204 +6,97 @@ import scipy
 import itertools
 import matplotlib
 import matplotlib.pyplot as plt
-from scipy.spatial.distance import cdist
-from collections import Counter
-from random import choice
-
-# Storing the training and test datasets into their respective dataframes
-trained = pd.read_csv('./train.csv')
-test = pd.read_csv('./test.csv')
+from knn_sentiment import BoWKNNClassifier, HashingKNNClassifier, TfidfKNNClassifier, Vocabulary, compare_dtypes, confusion_counts, encode_labels, load_corpus, macro_scores, majority_vote, sweep_k
 
 """# **Preprocessing**"""
 
-trained['Tweet'] = trained['Tweet'].str.lower() # Ensuring all words in the Tweet column of training data are lowercased
-test['Tweet'] = test['Tweet'].str.lower() # Ensuring all words in the Tweet column of test data are lowercased
-
-# Parsing the stop_words.txt file and storing all the words in a list.
-stopwords = []
-with open('stop_words.txt','r') as file:    
-    for line in file:         
-        for word in line.split():            
-            stopwords.append(word)
-
-# Removing all stopwords from all the tweets in training data.
-trained["Tweet"] = trained["Tweet"].apply(lambda func: ' '.join(sw 
-                                          for sw in func.split() 
-                                          if sw not in stopwords))
-
-# Removing all stopwords from all the tweets in test data.
-test["Tweet"] = test["Tweet"].apply(lambda func: ' '.join(sw 
-                                          for sw in func.split() 
-                                          if sw not in stopwords))
-trained.head()
-
-#List of all special characters that are to be removed.
-special_chars = ["!",'"',"%","&","amp","'","(",")", "*","+",",","-",".",
-                 "/",":",";","<","=",">","?","[","\\","]","^","_",
-                 "`","{","|","}","~","–","@","#","$"]
-
-#Training Data
-trained['Tweet'] = trained['Tweet'].str.replace(r'http?://[^\s<>"]+|www\.[^\s<>"]+', '') # Removing hyperlinks from all the tweets. They are not needed for classification.
-trained['Tweet'] = trained['Tweet'].str.replace('@[A-Za-z0-9]+', '') # Removing usernames from all the tweets.
-trained['Tweet'] = trained['Tweet'].str.replace(r'\B#\w*[a-zA-Z]+\w*', '') # Removing hashtags, including the text, from all the tweets. Hashtags are useless since their words cannot be splitted with spaces.
-trained['Tweet'] = trained['Tweet'].str.replace('\d+', '') # Removing numbers from all the tweets. They will not assist in any way to improve the classification process.
-
-for c in special_chars:
-    trained['Tweet'] = trained['Tweet'].str.replace(c,'') # Removing all special characters from all the tweets
-
-#Test Data
-test['Tweet'] = test['Tweet'].str.replace(r'http?://[^\s<>"]+|www\.[^\s<>"]+', '') # Removing hyperlinks from all the tweets
-test['Tweet'] = test['Tweet'].str.replace('@[A-Za-z0-9]+', '') # Removing usernames from all the tweets.
-test['Tweet'] = test['Tweet'].str.replace(r'\B#\w*[a-zA-Z]+\w*', '') # Removing hashtags, including the text, from all the tweets
-test['Tweet'] = test['Tweet'].str.replace('\d+', '') # Removing numbers from all the tweets
-
-for c in special_chars:
-    test['Tweet'] = test['Tweet'].str.replace(c,'') # Removing all special characters from all the tweets
+# Storing the preprocessed training and test datasets into their respective dataframes.
+# Every tweet is lowercased, and stopwords (stop_words.txt), hyperlinks, usernames, hashtags (including the text), numbers and all special characters are removed.
+# Hashtags are useless since their words cannot be splitted with spaces, and numbers will not assist in any way to improve the classification process.
+# The preprocessed tweets are cached on disk, keyed by the hash of the CSV, stop_words.txt and the normalizer version, so later runs skip this step.
+trained = load_corpus('./train.csv', 'stop_words.txt').to_frame()
+test = load_corpus('./test.csv', 'stop_words.txt').to_frame()
 
 trained.head()
 
 test.head()
 
+#Fitting the KNN classifier on the training data. It counts every word in the training data's Tweet column in a single pass and maps every unique word to a column index
+#(most frequent words first, ties in alphabetical order, so the columns are the same on every run),
+#extracts the training features into a sparse CSR matrix and indexes it by word, so a test tweet is only compared with the training tweets it shares a word with.
+#The tweets are already preprocessed, hence normalize=False.
+knn_model = BoWKNNClassifier(normalize=False).fit(trained['Tweet'], trained['Sentiment'])
+
 #Training Data
-train_unique = (list(set(trained['Tweet'].str.findall("\w+").sum()))) # Finding all the unique words in training data's Tweet column
-train_unique_words = len(train_unique)
+train_vocab = knn_model.vocabulary
+train_unique_words = len(train_vocab)
 
 #Test Data
-test_unique = (list(set(test['Tweet'].str.findall("\w+").sum()))) # Finding all the unique words in test data's Tweet column
-test_unique_words = len(test_unique)
+test_unique_words = len(Vocabulary().fit(test['Tweet'])) # Counting all the unique words in test data's Tweet column
 
 print("Unique words in Training Data: {}".format(train_unique_words))
 print("Unique words in Test Data: {}".format(test_unique_words))
 
 """## **Feature Extraction**"""
 
-#Training Data
-train_matrix = [] # Forming a 2D matrix to store all training feature vectors
+#The training features are the classifier's CSR matrix. The test set reuses the training vocabulary so both share the same columns.
+train_matrix = knn_model.X
+test_matrix = knn_model.transform(test['Tweet'])
 
-#Test Data
-test_matrix = [] # Forming a 2D matrix to store all test feature vectors
-
-#Training Data: Extracting features and storing them into the training feature matrix
-for sentence in trained['Tweet']:
-    train_featurevec = []
-    word = sentence.split()
-    for w in train_unique:
-        train_featurevec.append(word.count(w))
-    train_matrix.append(train_featurevec)
-
-#Test Data: Extracting features and storing them into the test feature matrix
-for sentence in test['Tweet']:
-    test_featurevec = []
-    word = sentence.split()
-    for w in train_unique:
-        test_featurevec.append(word.count(w))
-    test_matrix.append(test_featurevec)
-
-print("Shape of Training Matrix: ({0} , {1})".format(len(train_matrix),len(train_matrix[0])))
-print("Shape of Test Matrix: ({0} , {1})".format(len(test_matrix),len(test_matrix[0])))
+print("Shape of Training Matrix: ({0} , {1})".format(*train_matrix.shape))
+print("Shape of Test Matrix: ({0} , {1})".format(*test_matrix.shape))
 
 """# **Part 1**"""
 
-#Calculating distances between every test instance with all the train instances. This returns a 2D distances vector.
-dists = cdist(test_matrix,train_matrix,'euclidean')
-
 #Making an empty column in our test data for predicted labels.
 test['Predicted Label'] = ''
-dists.shape
-
-#Function that takes a list and returns the mode of the list. If there are more than one modes, it randomly selects any of them.
-def get_mode(l):
-    counting = Counter(l)
-    max_count = max(counting.values())
-    return choice([ks for ks in counting if counting[ks] == max_count])
 
 """## **K Nearest Neighbors & Performance Measures**"""
 
+#Encoding the labels as integer codes. The test labels reuse the training classes so both share the same codes.
+classes, train_codes = encode_labels(trained['Sentiment'])
+classes, test_codes = encode_labels(test['Sentiment'], classes)
+
+#Order of the classes in the printed confusion matrix
+cmatrix_order = encode_labels(['positive','neutral','negative'], classes)[1]
+
 # Making a general structure of our confusion matrix
 cmatrix = pd.DataFrame({'Gold Positive': '', 'Gold Neutral': '', 'Gold Negative': ''},
                        index = ['Predicted Positive','Predicted Neutral','Predicted Negative'])
 
+# Values of k to evaluate
+k_list = [1,3,5,7,10]
+
 # Lists that will later store respective values for plotting
 accuracy_list = []
 recall_list = []
 precision_list = []
 F1_list = []
 
-def cmatrix_measures(k,dists,test,cmatrix):
-
-  row_count = 0
-  first_max = 0
-  second_max = 0
-  check_tie = False
-
-  for ls in dists:
-    sorted_distances_indices = np.argsort(ls) #Getting a sorted list of indices of all distances in ls with the smallest distance's index at 0th position
-    knn_indices = []
-    knn_indices = list(itertools.islice(sorted_distances_indices,k)) #Extracting the indices of the k-smallest distances
-
-    knn_labels = []
-    for i in knn_indices:
-      label = trained['Sentiment'][i] #Extracting the label of the instance by indexing it through the DataFrame.
-      knn_labels.append(label) #Appending the label to our labels list.
-
-    max_class = get_mode(knn_labels)
-    first_max = max_class
-    second_max = max(knn_labels)
-    if first_max == second_max:
-      check_tie = True
-    predicted_label = max_class
-    test['Predicted Label'][row_count] = predicted_label
-
-    row_count += 1
-
-  #Creating a frequency DataFrame that will store value counts for each tuple of instances. E.g (positive,positive = 309) and so on for all other seven instances.
-  testfreqdf = test.groupby(["Sentiment", "Predicted Label"]).size().reset_index(name="Frequency")
-  testfreqdf
-
-  #Extracting values from the Frequency DataFrame and assigning to specific cells in the confusion matrix.
-  cmatrix['Gold Positive']['Predicted Positive'] = testfreqdf['Frequency'][8]
-  cmatrix['Gold Neutral']['Predicted Positive'] = testfreqdf['Frequency'][5]
-  cmatrix['Gold Negative']['Predicted Positive'] = testfreqdf['Frequency'][2]
-  cmatrix['Gold Positive']['Predicted Neutral'] = testfreqdf['Frequency'][7]
-  cmatrix['Gold Neutral']['Predicted Neutral'] = testfreqdf['Frequency'][4]
-  cmatrix['Gold Negative']['Predicted Neutral'] = testfreqdf['Frequency'][1]
-  cmatrix['Gold Positive']['Predicted Negative'] = testfreqdf['Frequency'][6]
-  cmatrix['Gold Neutral']['Predicted Negative'] = testfreqdf['Frequency'][3]
-  cmatrix['Gold Negative']['Predicted Negative'] = testfreqdf['Frequency'][0]
-
-  #Extracting all three True Positives from the matrix to measure accuracy.
-  TP = cmatrix['Gold Positive']['Predicted Positive']
-  TNT = cmatrix['Gold Neutral']['Predicted Neutral']
-  TN = cmatrix['Gold Negative']['Predicted Negative']
-  total = testfreqdf['Frequency'].sum()
-  accuracy = ((TP+TNT+TN)/total)*100
-  accuracy = round(accuracy,2)
+def cmatrix_measures(k,knn_codes_all,test,cmatrix):
+
+  #Majority vote of the k nearest training instances of every test instance. Ties are broken at random with a fixed seed.
+  predicted_codes = majority_vote(knn_codes_all[:, :k], len(classes))
+  test['Predicted Label'] = classes[predicted_codes]
+
+  #Counting every (gold, predicted) pair in one go. Rows of counts are gold classes and columns are predicted classes; missing pairs are 0.
+  counts = confusion_counts(test_codes, predicted_codes, len(classes))
+  cmatrix = pd.DataFrame(counts[np.ix_(cmatrix_order, cmatrix_order)].T, index=cmatrix.index, columns=cmatrix.columns)
+
+  #Measuring accuracy and the macroaveraged precision, recall and F1-score from the confusion matrix.
+  scores = macro_scores(counts)
+
+  accuracy = round(scores['accuracy']*100,2)
   accuracy_list.append(accuracy)
 
-  #Extracting all recalls from the matrix to measure macroaveraged recall.
-  recall_pos = cmatrix['Gold Positive']['Predicted Positive']/cmatrix['Gold Positive'].sum()
-  recall_neut = cmatrix['Gold Neutral']['Predicted Neutral']/cmatrix['Gold Neutral'].sum()
-  recall_neg = cmatrix['Gold Negative']['Predicted Negative']/cmatrix['Gold Negative'].sum()
-  macroaveraged_recall = ((recall_pos+recall_neut+recall_neg)/3)*100
-  macroaveraged_recall = round(macroaveraged_recall,2)
+  macroaveraged_recall = round(scores['recall']*100,2)
   recall_list.append(macroaveraged_recall)
 
-  #Extracting all precisions from the matrix to measure macroaveraged precision.
-  precision_pos = cmatrix['Gold Positive']['Predicted Positive']/(cmatrix.iloc[0,0:3].sum())
-  precision_neut = cmatrix['Gold Neutral']['Predicted Neutral']/(cmatrix.iloc[1,0:3].sum())
-  precision_neg = cmatrix['Gold Negative']['Predicted Negative']/(cmatrix.iloc[2,0:3].sum())
-  macroaveraged_precision = ((precision_pos+precision_neut+precision_neg)/3)*100
-  macroaveraged_precision = round(macroaveraged_precision,2)
+  macroaveraged_precision = round(scores['precision']*100,2)
   precision_list.append(macroaveraged_precision)
 
-  #Extracting all F1_scores from the matrix to measure macroaveraged F1_score.
-  F1_pos = (2*precision_pos*recall_pos)/(precision_pos+recall_pos)
-  F1_neut = (2*precision_neut*recall_neut)/(precision_neut+recall_neut)
-  F1_neg = (2*precision_neg*recall_neg)/(precision_neg+recall_neg)
-  F1_score = ((F1_pos + F1_neut + F1_neg)/3)*100  
-  F1_score = round(F1_score,2)
+  F1_score = round(scores['f1']*100,2)
   F1_list.append(F1_score)
-  
 
   print("\n\nConfusion Matrix with k = {}:\n".format(k))
   print(cmatrix)
@@ -212,17 +105,46 @@ def cmatrix_measures(k,dists,test,cmatrix):
   print("Macroaveraged Recall with k = {0}: {1}%".format(k,macroaveraged_recall))
   print("Macroaveraged F1-score with k = {0}: {1}%".format(k,F1_score))
 
+#Finding the neighbours once for the largest k. The neighbours for every smaller k are the first k columns of the same result.
+knn_dists, knn_indices = knn_model.kneighbors(test['Tweet'], max(k_list))
+knn_codes_all = knn_model.label_codes[knn_indices]
+
 #Calling the function for each individual k
-cmatrix_measures(1,dists,test,cmatrix)
-cmatrix_measures(3,dists,test,cmatrix)
-cmatrix_measures(5,dists,test,cmatrix)
-cmatrix_measures(7,dists,test,cmatrix)
-cmatrix_measures(10,dists,test,cmatrix)
+for k in k_list:
+  cmatrix_measures(k,knn_codes_all,test,cmatrix)
+
+"""# **Compact Feature Storage**"""
+
+#Refitting the classifier with the training word counts stored as uint16 and uint8 (2 and 1 bytes per count) instead of float64, and measuring what that costs in accuracy.
+storage_report = compare_dtypes(lambda dtype: BoWKNNClassifier(normalize=False, dtype=dtype), trained['Tweet'], trained['Sentiment'], test['Tweet'], test['Sentiment'], BoWKNNClassifier.dtypes)
+for row in storage_report:
+  print("{0}: {1:.2f} MB of training features, accuracy {2:.2f}% ({3:+.2f} points against float64), {4:.2f}% of the predictions unchanged".format(
+      row['dtype'], row['nbytes']/1e6, row['accuracy']*100, row['accuracy_change']*100, row['agreement']*100))
+
+"""# **TF-IDF Features**"""
+
+#Refitting on TF-IDF weights instead of raw counts: every count is multiplied by the word's inverse document frequency, computed once from the training vocabulary,
+#and every row is scaled to unit length, so long tweets no longer dominate. On unit rows the cosine distance is 1 minus a sparse dot product.
+tfidf_model = TfidfKNNClassifier(normalize=False).fit(trained['Tweet'], trained['Sentiment'])
+tfidf_dists, tfidf_indices = tfidf_model.kneighbors(test['Tweet'], max(k_list))
+tfidf_classes, tfidf_test_codes = encode_labels(test['Sentiment'], tfidf_model.classes)
+for k, k_codes in sweep_k(tfidf_model.label_codes[tfidf_indices], k_list):
+  tfidf_scores = macro_scores(confusion_counts(tfidf_test_codes, majority_vote(k_codes, len(tfidf_classes)), len(tfidf_classes)))
+  print("TF-IDF with cosine distance, k = {0}: accuracy {1:.2f}%, macroaveraged F1-score {2:.2f}%".format(
+      k, tfidf_scores['accuracy']*100, tfidf_scores['f1']*100))
+
+"""# **Feature Hashing**"""
+
+#Instead of a vocabulary, every word is mapped to one of a fixed number of columns by its crc32 hash, with a hashed sign so that words sharing a column cancel out on average.
+#The matrix width no longer grows with the corpus, and test words that never occur in training still count. Fewer columns save memory but merge more words.
+for n_buckets in [2**10, 2**14, 2**18]:
+  hashing_model = HashingKNNClassifier(normalize=False, n_buckets=n_buckets).fit(trained['Tweet'], trained['Sentiment'])
+  hashing_predicted = hashing_model.predict(test['Tweet'])
+  print("{0} hashed columns: accuracy with k = 10: {1:.2f}%, {2:.2f}% of the predictions equal to the vocabulary's".format(
+      n_buckets, np.mean(hashing_predicted == test['Sentiment'].values)*100, np.mean(hashing_predicted == knn_model.predict(test['Tweet']))*100))
 
 """# **Plotting (Part-1)**"""
 
-k_list = [1,3,5,7,10] 
-
 fig = plt.figure(figsize=(12,8))
 
 plt.subplot(2,2,1)
@@ -275,11 +197,16 @@ def classifying(trainfeatures,testfeatures):
   y_train = trained.iloc[:,0].values #trained['Sentiment]
   y_test = test.iloc[:,0].values #test['Sentiment]
 
-  for k in [1,3,5,7,10]:
+  classes, y_train_codes = encode_labels(y_train) #Encoding the training labels as integers 0..n_classes-1
+
+  classifier = KNeighborsClassifier(n_neighbors=max(k_list),algorithm='brute') #Using brute-force algorithm for quicker computation.
+  classifier.fit(X_train, y_train) #Fitting the built-in sklearn classifier on our training data once
+  knn_indices = classifier.kneighbors(X_test, return_distance=False) #Finding the neighbours of the test data once, for the largest k
+  knn_codes = y_train_codes[knn_indices]
+
+  for k, k_codes in sweep_k(knn_codes, k_list):
 
-    classifier = KNeighborsClassifier(n_neighbors=k,algorithm='brute') #Using brute-force algorithm for quicker computation.
-    classifier.fit(X_train, y_train) #Fitting the built-in sklearn classifier on our training data
-    predicted_label = classifier.predict(X_test) #Making the classifier to predict on the previously unseen test data.
+    predicted_label = classes[majority_vote(k_codes, len(classes), seed=None)] #Majority vote of the k nearest neighbours. Ties go to the smallest label, like KNeighborsClassifier.predict
 
     accuracy_score = (metrics.accuracy_score(y_test,predicted_label))
     accuracy_score = (round(accuracy_score,2))*100
@@ -313,7 +240,7 @@ classifying(train_matrix,test_matrix)
 
 """# **Plotting (Part-2)**"""
 
-k_ls = [1,3,5,7,10] 
+k_ls = k_list
 
 fig = plt.figure(figsize=(12,8))
 
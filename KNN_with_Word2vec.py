@@ -1,4 +1,5 @@
 
+import os
 import pandas as pd
 import re
 import numpy as np
@@ -6,70 +7,27 @@ import scipy
 import itertools
 import matplotlib
 import matplotlib.pyplot as plt
-import gensim
-from gensim.models import KeyedVectors
 from smart_open import open
-from scipy.spatial.distance import cdist
-from collections import Counter
-from random import choice
+from knn_sentiment import BruteForceIndex, EmbeddingStore, IVFIndex, Vocabulary, Word2vecKNNClassifier, compare_dtypes, compare_indexes, confusion_counts, convert_word2vec, corpus_words, drop_empty, embed_tweets, encode_labels, load_corpus, macro_scores, majority_vote, sweep_k
 
 """# **Preprocessing**"""
 
-#Storing the training and test datasets into their respective dataframes
-trained = pd.read_csv('./train.csv')
-test = pd.read_csv('./test.csv')
-
 #Creating a function that takes care of all the preprocessing stuff.
 def preprocess():
+  global trained, test
 
-  trained['Tweet'] = trained['Tweet'].str.lower() # Ensuring all words in the Tweet column of training data are lowercased
-  test['Tweet'] = test['Tweet'].str.lower() # Ensuring all words in the Tweet column of test data are lowercased
-
-  # Parsing the stop_words.txt file and storing all the words in a list.
-  stopwords = []
-  with open('stop_words.txt','r') as file:    
-      for line in file:         
-          for word in line.split():            
-              stopwords.append(word)
-
-  # Removing all stopwords from all the tweets in training data.
-  trained["Tweet"] = trained["Tweet"].apply(lambda func: ' '.join(sw 
-                                            for sw in func.split() 
-                                            if sw not in stopwords))
-
-  # Removing all stopwords from all the tweets in test data.
-  test["Tweet"] = test["Tweet"].apply(lambda func: ' '.join(sw 
-                                            for sw in func.split() 
-                                            if sw not in stopwords))
-
-  special_chars = ["!",'"',"%","&","amp","'","(",")", "*","+",",","-",".",
-                  "/",":",";","<","=",">","?","[","\\","]","^","_",
-                  "`","{","|","}","~","–","@","#","$"]
+  # Storing the preprocessed training and test datasets into their respective dataframes.
+  # Every tweet is lowercased, and stopwords, hyperlinks, usernames, hashtags, numbers and all special characters are removed.
+  # The preprocessed tweets are cached on disk, keyed by the hash of the CSV, stop_words.txt and the normalizer version, so only the first run pays for this.
+  trained = load_corpus('./train.csv', 'stop_words.txt').to_frame()
+  test = load_corpus('./test.csv', 'stop_words.txt').to_frame()
 
   #Training Data
-  trained['Tweet'] = trained['Tweet'].str.replace(r'http?://[^\s<>"]+|www\.[^\s<>"]+', '') # Removing hyperlinks from all the tweets
-  trained['Tweet'] = trained['Tweet'].str.replace('@[A-Za-z0-9]+', '') # Removing usernames from all the tweets.
-  trained['Tweet'] = trained['Tweet'].str.replace(r'\B#\w*[a-zA-Z]+\w*', '') # Removing hashtags, including the text, from all the tweets
-  trained['Tweet'] = trained['Tweet'].str.replace('\d+', '') # Removing numbers from all the tweets
-
-  for c in special_chars:
-      trained['Tweet'] = trained['Tweet'].str.replace(c,'') # Removing all special characters from all the tweets
-
-  #Test Data
-  test['Tweet'] = test['Tweet'].str.replace(r'http?://[^\s<>"]+|www\.[^\s<>"]+', '') # Removing hyperlinks from all the tweets
-  test['Tweet'] = test['Tweet'].str.replace('@[A-Za-z0-9]+', '') # Removing usernames from all the tweets.
-  test['Tweet'] = test['Tweet'].str.replace(r'\B#\w*[a-zA-Z]+\w*', '') # Removing hashtags, including the text, from all the tweets
-  test['Tweet'] = test['Tweet'].str.replace('\d+', '') # Removing numbers from all the tweets
-
-  for c in special_chars:
-      test['Tweet'] = test['Tweet'].str.replace(c,'') # Removing all special characters from all the tweets
-
-  #Training Data
-  train_unique = (list(set(trained['Tweet'].str.findall("\w+").sum()))) # Finding all the unique words in training data's Tweet column
+  train_unique = Vocabulary().fit(trained['Tweet']) # Counting all the unique words in training data's Tweet column in a single pass
   train_unique_words = len(train_unique)
 
   #Test Data
-  test_unique = (list(set(test['Tweet'].str.findall("\w+").sum()))) # Finding all the unique words in test data's Tweet column
+  test_unique = Vocabulary().fit(test['Tweet']) # Counting all the unique words in test data's Tweet column in a single pass
   test_unique_words = len(test_unique)
 
   # Making an empty column in our test data for predicted labels.
@@ -86,135 +44,73 @@ test.head()
 
 
 
-word2vec = KeyedVectors.load_word2vec_format("./GoogleNews-vectors-negative300.bin.gz", binary=True)
+#Loading the pre-trained word2vec vectors from a memory-mapped store. The first run converts the GoogleNews file into the store,
+#keeping only the words that appear in our datasets; later runs load it in well under a second. The same conversion can be done with
+#  python -m knn_sentiment convert-word2vec GoogleNews-vectors-negative300.bin.gz word2vec_store --prune train.csv test.csv
+if not os.path.exists('./word2vec_store'):
+  convert_word2vec("./GoogleNews-vectors-negative300.bin.gz", './word2vec_store', keep=corpus_words('./train.csv', './test.csv'))
+word2vec = EmbeddingStore.load('./word2vec_store')
 
 """# **Repeating Part 1 with Word2Vec**"""
 
-def extract_features(sentence):
-  words = [word for word in sentence.split() if word in word2vec.key_to_index]
-  if words == []:
-    return []
-  else:
-    return np.mean(word2vec[words],axis=0)
-
-train_embeddings = []
-
-for sentence in trained['Tweet']:
-  words = extract_features(sentence)
-  if words == []:
-    trained = trained.drop(trained[trained.Tweet == sentence].index)
-  else:  
-    train_embeddings.append(words)
-
-trained = trained.reset_index()
-
-test_embeddings = []
+#Fitting the KNN classifier on the training data. It averages the word2vec vectors of the words in every tweet, all tweets in one batch,
+#and leaves out the tweets without any known word. The tweets are already preprocessed, hence normalize=False.
+knn_model = Word2vecKNNClassifier(word2vec, normalize=False).fit(trained['Tweet'], trained['Sentiment'])
+train_embeddings = knn_model.X
 
-for sentence in test['Tweet']:
-  words = extract_features(sentence)
-  if len(words) == 0:
+#Embedding the test tweets the same way; keep is False for tweets without any known word.
+test_embeddings, test_keep = embed_tweets(test['Tweet'], word2vec)
 
-    test = test.drop(test[test.Tweet == sentence].index)
-  else:  
-    test_embeddings.append(words)
-
-test = test.reset_index()
+#Dropping the test tweets that have no embedding. The embeddings and the dataset are filtered with the same mask, so their rows stay aligned.
+test_embeddings, test = drop_empty(test_embeddings, test_keep, test)
 
 print("Shape of Training Matrix: ({0} , {1})".format(len(train_embeddings),len(train_embeddings[0])))
 print("Shape of Test Matrix: ({0} , {1})".format(len(test_embeddings),len(test_embeddings[0])))
 
-#Calculating distances between every test instance with all the train instances. This returns a 2D distances vector.
-dists = cdist(test_embeddings,train_embeddings,'euclidean')
+#Encoding the test labels as integer codes. They reuse the classifier's classes so both share the same codes.
+classes = knn_model.classes
+classes, test_codes = encode_labels(test['Sentiment'], classes)
+
+#Order of the classes in the printed confusion matrix
+cmatrix_order = encode_labels(['positive','neutral','negative'], classes)[1]
 
 # Making a general structure of our confusion matrix
 cmatrix = pd.DataFrame({'Gold Positive': '', 'Gold Neutral': '', 'Gold Negative': ''},
                        index = ['Predicted Positive','Predicted Neutral','Predicted Negative'])
 
+# Values of k to evaluate
+k_list = [1,3,5,7,10]
+
 # Lists that will later store respective values for plotting
 accuracy_list = []
 recall_list = []
 precision_list = []
 F1_list = []
 
-#Function that takes a list and returns the mode of the list. If there are more than one modes, it randomly selects any of them.
-def get_mode(l):
-    counting = Counter(l)
-    max_count = max(counting.values())
-    return choice([ks for ks in counting if counting[ks] == max_count])
-
-def cmatrix_measures(k,dists,test,cmatrix):
-
-  row_count = 0
-  first_max = 0
-  second_max = 0
-  check_tie = False
-
-  for ls in dists:
-    sorted_distances_indices = np.argsort(ls) #Getting a sorted list of indices of all distances in ls with the smallest distance's index at 0th position
-    knn_indices = []
-    knn_indices = list(itertools.islice(sorted_distances_indices,k)) #Extracting the indices of the k-smallest distances
-
-    knn_labels = []
-    for i in knn_indices:
-      label = trained['Sentiment'][i] #Extracting the label of the instance by indexing it through the DataFrame.
-      knn_labels.append(label) #Appending the label to our labels list.
-
-    max_class = get_mode(knn_labels)
-    first_max = max_class
-    second_max = max(knn_labels)
-    if first_max == second_max:
-      check_tie = True
-    predicted_label = max_class
-    test.at[row_count, 'Predicted Label'] = predicted_label
-
-
-    row_count += 1
-
-  #Creating a frequency DataFrame that will store value counts for each tuple of instances. E.g (positive,positive = 309) and so on for all other seven instances.
-  testfreqdf = test.groupby(["Sentiment", "Predicted Label"]).size().reset_index(name="Frequency")
-  testfreqdf
-
-  #Extracting values from the Frequency DataFrame and assigning to specific cells in the confusion matrix.
-  cmatrix['Gold Positive']['Predicted Positive'] = testfreqdf['Frequency'][8]
-  cmatrix['Gold Neutral']['Predicted Positive'] = testfreqdf['Frequency'][5]
-  cmatrix['Gold Negative']['Predicted Positive'] = testfreqdf['Frequency'][2]
-  cmatrix['Gold Positive']['Predicted Neutral'] = testfreqdf['Frequency'][7]
-  cmatrix['Gold Neutral']['Predicted Neutral'] = testfreqdf['Frequency'][4]
-  cmatrix['Gold Negative']['Predicted Neutral'] = testfreqdf['Frequency'][1]
-  cmatrix['Gold Positive']['Predicted Negative'] = testfreqdf['Frequency'][6]
-  cmatrix['Gold Neutral']['Predicted Negative'] = testfreqdf['Frequency'][3]
-  cmatrix['Gold Negative']['Predicted Negative'] = testfreqdf['Frequency'][0]
-
-  #Extracting all three True Positives from the matrix to measure accuracy.
-  TP = cmatrix['Gold Positive']['Predicted Positive']
-  TNT = cmatrix['Gold Neutral']['Predicted Neutral']
-  TN = cmatrix['Gold Negative']['Predicted Negative']
-  total = testfreqdf['Frequency'].sum()
-  accuracy = ((TP+TNT+TN)/total)*100
-  accuracy = round(accuracy,2)
+def cmatrix_measures(k,knn_codes_all,test,cmatrix):
+
+  #Majority vote of the k nearest training instances of every test instance. Ties are broken at random with a fixed seed.
+  predicted_codes = majority_vote(knn_codes_all[:, :k], len(classes))
+  test['Predicted Label'] = classes[predicted_codes]
+
+  #Counting every (gold, predicted) pair in one go. Rows of counts are gold classes and columns are predicted classes; missing pairs are 0.
+  counts = confusion_counts(test_codes, predicted_codes, len(classes))
+  cmatrix = pd.DataFrame(counts[np.ix_(cmatrix_order, cmatrix_order)].T, index=cmatrix.index, columns=cmatrix.columns)
+
+  #Measuring accuracy and the macroaveraged precision, recall and F1-score from the confusion matrix.
+  scores = macro_scores(counts)
+
+  accuracy = round(scores['accuracy']*100,2)
   accuracy_list.append(accuracy)
 
-  recall_pos = cmatrix['Gold Positive']['Predicted Positive']/cmatrix['Gold Positive'].sum()
-  recall_neut = cmatrix['Gold Neutral']['Predicted Neutral']/cmatrix['Gold Neutral'].sum()
-  recall_neg = cmatrix['Gold Negative']['Predicted Negative']/cmatrix['Gold Negative'].sum()
-  macroaveraged_recall = ((recall_pos+recall_neut+recall_neg)/3)*100
-  macroaveraged_recall = round(macroaveraged_recall,2)
+  macroaveraged_recall = round(scores['recall']*100,2)
   recall_list.append(macroaveraged_recall)
 
-  precision_pos = cmatrix['Gold Positive']['Predicted Positive']/(cmatrix.iloc[0,0:3].sum())
-  precision_neut = cmatrix['Gold Neutral']['Predicted Neutral']/(cmatrix.iloc[1,0:3].sum())
-  precision_neg = cmatrix['Gold Negative']['Predicted Negative']/(cmatrix.iloc[2,0:3].sum())
-  macroaveraged_precision = ((precision_pos+precision_neut+precision_neg)/3)*100
-  macroaveraged_precision = round(macroaveraged_precision,2)
+  macroaveraged_precision = round(scores['precision']*100,2)
   precision_list.append(macroaveraged_precision)
 
-  F1_pos = (2*precision_pos*recall_pos)/(precision_pos+recall_pos)
-  F1_neut = (2*precision_neut*recall_neut)/(precision_neut+recall_neut)
-  F1_neg = (2*precision_neg*recall_neg)/(precision_neg+recall_neg)
-  F1_score = ((F1_pos + F1_neut + F1_neg)/3)*100  
-  F1_score = round(F1_score,2)
+  F1_score = round(scores['f1']*100,2)
   F1_list.append(F1_score)
-  
 
   print("\n\nConfusion Matrix with k = {}:\n".format(k))
   print(cmatrix)
@@ -223,15 +119,39 @@ def cmatrix_measures(k,dists,test,cmatrix):
   print("Macroaveraged Recall with k = {0}: {1}%".format(k,macroaveraged_recall))
   print("Macroaveraged F1-score with k = {0}: {1}%\n".format(k,F1_score))
 
-cmatrix_measures(1,dists,test,cmatrix)
-cmatrix_measures(3,dists,test,cmatrix)
-cmatrix_measures(5,dists,test,cmatrix)
-cmatrix_measures(7,dists,test,cmatrix)
-cmatrix_measures(10,dists,test,cmatrix)
+#Finding the neighbours once for the largest k. The neighbours for every smaller k are the first k columns of the same result.
+knn_dists, knn_indices = knn_model.kneighbors(test['Tweet'], max(k_list))
+knn_codes_all = knn_model.label_codes[knn_indices]
 
-"""# **Plotting Part 1 Results with Word2Vec**"""
+#Calling the function for each individual k
+for k in k_list:
+  cmatrix_measures(k,knn_codes_all,test,cmatrix)
+
+"""# **Approximate Nearest Neighbors**"""
+
+#Comparing an approximate inverted-file (IVF) index with the exact search used above. Recall is the fraction of the exact nearest neighbours that the index finds.
+exact_index = BruteForceIndex().build(train_embeddings)
+ivf_index = IVFIndex(n_lists=64, n_probe=8).build(train_embeddings)
+ann_report = compare_indexes(ivf_index, exact_index, test_embeddings, max(k_list))
+print("IVF recall with k = {0}: {1:.3f}".format(max(k_list), ann_report['recall']))
+print("IVF query time: {0:.3f} ms, exact query time: {1:.3f} ms".format(ann_report['ms_per_query'], ann_report['reference_ms_per_query']))
+
+#The classifier can search the same kind of index: its predictions are approximate, so they are compared with the exact ones.
+ivf_model = Word2vecKNNClassifier(word2vec, normalize=False, index_type='ivf', index_params={'n_lists': 64, 'n_probe': 8}).fit(trained['Tweet'], trained['Sentiment'])
+exact_predicted = knn_model.predict(test['Tweet'])
+ivf_predicted = ivf_model.predict(test['Tweet'])
+print("IVF classifier accuracy with k = 10: {0:.2f}% (exact: {1:.2f}%), {2:.2f}% of the predictions unchanged".format(
+    (ivf_predicted == test['Sentiment']).mean()*100, (exact_predicted == test['Sentiment']).mean()*100, (ivf_predicted == exact_predicted).mean()*100))
+
+"""# **Compact Feature Storage**"""
+
+#Refitting the classifier with the training vectors stored as float32 and int8 (scalar-quantized with one scale per tweet) instead of float64, and measuring what that costs in accuracy.
+storage_report = compare_dtypes(lambda dtype: Word2vecKNNClassifier(word2vec, normalize=False, dtype=dtype), trained['Tweet'], trained['Sentiment'], test['Tweet'], test['Sentiment'], Word2vecKNNClassifier.dtypes)
+for row in storage_report:
+  print("{0}: {1:.2f} MB of training features, accuracy {2:.2f}% ({3:+.2f} points against float64), {4:.2f}% of the predictions unchanged".format(
+      row['dtype'], row['nbytes']/1e6, row['accuracy']*100, row['accuracy_change']*100, row['agreement']*100))
 
-k_list = [1,3,5,7,10] 
+"""# **Plotting Part 1 Results with Word2Vec**"""
 
 fig = plt.figure(figsize=(12,8))
 
@@ -265,43 +185,16 @@ plt.show
 
 """#**Repeating Part 2 with Word2Vec**"""
 
-# Storing the training and test datasets into their respective dataframes
-
-trained = pd.read_csv('train.csv')
-test = pd.read_csv('test.csv')
-
 """# **Preprocessing**"""
 
-#Storing the training and test datasets into their respective dataframes
-trained = pd.read_csv('train.csv')
-test = pd.read_csv('test.csv')
+#Loading fresh copies of the preprocessed datasets. They come from the cache written by the first preprocess() call.
 preprocess()
 
-def extract_features(sentence):
-  words = [word for word in sentence.split() if word in word2vec.index_to_key]
-  if words == []:
-    return []
-  else:
-    return np.mean(word2vec[words],axis=0)
-
-train_embeddings = []
-
-for sentence in trained['Tweet']:
-  words = extract_features(sentence)
-  if len(words) == 0:
+train_embeddings, train_keep = embed_tweets(trained['Tweet'], word2vec)
+test_embeddings, test_keep = embed_tweets(test['Tweet'], word2vec)
 
-    trained = trained.drop(trained[trained.Tweet == sentence].index)
-  else:  
-    train_embeddings.append(words)
-
-test_embeddings = []
-
-for sentence in test['Tweet']:
-  words = extract_features(sentence)
-  if words == []:
-    test = test.drop(test[test.Tweet == sentence].index)
-  else:  
-    test_embeddings.append(words)
+train_embeddings, trained = drop_empty(train_embeddings, train_keep, trained)
+test_embeddings, test = drop_empty(test_embeddings, test_keep, test)
 
 from sklearn.preprocessing import StandardScaler
 from sklearn.neighbors import KNeighborsClassifier
@@ -320,11 +213,16 @@ def classifying(trainfeatures,testfeatures):
   y_train = trained.iloc[:,0].values
   y_test = test.iloc[:,0].values
 
-  for k in [1,3,5,7,10]:
+  classes, y_train_codes = encode_labels(y_train) #Encoding the training labels as integers 0..n_classes-1
+
+  classifier = KNeighborsClassifier(n_neighbors=max(k_list),algorithm='brute') #Using brute-force algorithm for quicker computation.
+  classifier.fit(X_train, y_train) #Fitting the built-in sklearn classifier on our training data once
+  knn_indices = classifier.kneighbors(X_test, return_distance=False) #Finding the neighbours of the test data once, for the largest k
+  knn_codes = y_train_codes[knn_indices]
+
+  for k, k_codes in sweep_k(knn_codes, k_list):
 
-    classifier = KNeighborsClassifier(n_neighbors=k,algorithm='brute')
-    classifier.fit(X_train, y_train)
-    predicted_label = classifier.predict(X_test)
+    predicted_label = classes[majority_vote(k_codes, len(classes), seed=None)] #Majority vote of the k nearest neighbours. Ties go to the smallest label, like KNeighborsClassifier.predict
 
     accuracy_score = (metrics.accuracy_score(y_test,predicted_label))
     accuracy_score = (round(accuracy_score,2))*100
@@ -358,7 +256,7 @@ classifying(train_embeddings,test_embeddings)
 
 """# **Plotting Part 2 Results with Word2Vec**"""
 
-k_ls = [1,3,5,7,10] 
+k_ls = k_list
 
 fig = plt.figure(figsize=(12,8))
 
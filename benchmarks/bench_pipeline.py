@@ -0,0 +1,304 @@
+"""Benchmark of the KNN pipeline stages on the real and scaled-up corpora.
+
+Run from the repository root::
+
+    python benchmarks/bench_pipeline.py                       # scales 1, 10 and 100
+    python benchmarks/bench_pipeline.py --scales 1 10 --modes bow --baseline old.json
+
+Every (mode, scale) case runs in a fresh process and times the stages of
+KNN_with_BoW.py / KNN_with_Word2vec.py in order:
+
+* ``preprocess``  -- ``TweetNormalizer.clean_many`` on the raw train and test tweets
+  (what ``preprocess()`` does, without the on-disk cache),
+* ``vocabulary``  -- ``Vocabulary().fit`` on the cleaned training tweets,
+* ``features``    -- ``bow_matrix`` or ``embed_tweets`` for train and test,
+* ``index``       -- building the model's neighbour index,
+* ``neighbours``  -- the k nearest training tweets of every query (the old ``cdist``),
+* ``voting``      -- majority votes and measures for every k (``cmatrix_measures``),
+* ``classifying`` -- the scikit-learn KNN of part 2 (``classifying``).
+
+Scale 1 is train.csv / test.csv. Scale s has s times as many train and
+test tweets: the originals plus s - 1 copies with the words of every
+tweet shuffled and a fraction of them turned into new words, so the
+vocabulary keeps growing with the corpus. The generator is seeded, so
+every run sees the same corpora. The query stages use at most
+``--max-queries`` test tweets, because their cost grows with train x test,
+and search as many queries at a time as fit in ``--max-block-mb`` of
+distances (``chunk_size * n_train`` floats).
+
+For every stage the JSON report has the wall time (best of ``--repeat``),
+the throughput in items (tweets or queries) per second and the peak RSS
+during the stage. The peak is reset before each stage through
+/proc/self/clear_refs; where that is not available it is the peak of the
+whole process so far. ``--baseline`` prints the speed-up of every stage
+against an earlier report, e.g. one written at another commit.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import scipy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from knn_sentiment import (BruteForceIndex, EmbeddingStore, InvertedIndex, TweetNormalizer,
+                           Vocabulary, bow_matrix, confusion_counts, embed_tweets, encode_labels,
+                           load_stopwords, macro_scores, majority_vote, sweep_k)
+from knn_sentiment.corpus import LABEL_COLUMN, TEXT_COLUMN
+from knn_sentiment.search import DEFAULT_CHUNK_SIZE
+
+K_LIST = [1, 3, 5, 7, 10]
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_MAX_QUERIES = 3000
+DEFAULT_MAX_BLOCK_MB = 256
+NOVEL_FRACTION = 0.1
+
+
+def _suffix(copy):
+    # Letters only, so the normalizer keeps them: 1 -> "xb", 2 -> "xc", 27 -> "xbb"
+    letters = ""
+    while copy:
+        copy, digit = divmod(copy, 26)
+        letters = "abcdefghijklmnopqrstuvwxyz"[digit] + letters
+    return "x" + letters
+
+
+def scale_frame(frame, scale, seed=0, novel_fraction=NOVEL_FRACTION):
+    """The tweets of ``frame`` followed by ``scale - 1`` shuffled copies of them.
+
+    In copy c, every tweet's words are shuffled and each word is replaced,
+    with probability ``novel_fraction``, by the word plus a suffix unique
+    to c, i.e. a word no other copy has.
+    """
+    if scale <= 1:
+        return frame.reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    texts = frame[TEXT_COLUMN].astype(str).tolist()
+    token_lists = [text.split() for text in texts]
+    out = list(texts)
+    for copy in range(1, scale):
+        suffix = _suffix(copy)
+        for tokens in token_lists:
+            order = rng.permutation(len(tokens))
+            novel = rng.random(len(tokens)) < novel_fraction
+            out.append(" ".join(tokens[i] + suffix if n else tokens[i] for i, n in zip(order, novel)))
+    labels = np.tile(frame[LABEL_COLUMN].to_numpy(), scale)
+    return pd.DataFrame({LABEL_COLUMN: labels, TEXT_COLUMN: out})
+
+
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+    """Runs the stages of one case and collects their measurements."""
+
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, stage, items, func, *args):
+        """Time ``func(*args)`` (best of ``repeat``) and return its result."""
+        per_stage_peak = _reset_peak_rss()
+        best = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.results.append({"stage": stage, "seconds": round(best, 6), "items": items,
+                             "items_per_s": round(items / best, 1) if best else None,
+                             "peak_rss_mb": round(_peak_rss_mb(), 1), "per_stage_peak": per_stage_peak})
+        return result
+
+
+def _vote_all(codes, test_codes, n_classes):
+    # cmatrix_measures for every k: votes, confusion matrix and macro measures.
+    scores = {}
+    for k, k_codes in sweep_k(codes, K_LIST):
+        predicted = majority_vote(k_codes, n_classes)
+        scores[k] = macro_scores(confusion_counts(test_codes, predicted, n_classes))
+    return scores
+
+
+def _classifying(X_train, y_train, X_test):
+    from sklearn.neighbors import KNeighborsClassifier
+
+    classes, y_codes = encode_labels(y_train)
+    classifier = KNeighborsClassifier(n_neighbors=max(K_LIST), algorithm="brute").fit(X_train, y_train)
+    codes = y_codes[classifier.kneighbors(X_test, return_distance=False)]
+    return [classes[majority_vote(k_codes, len(classes), seed=None)] for _, k_codes in sweep_k(codes, K_LIST)]
+
+
+def run_case(mode, scale, args):
+    """Measure every stage for one mode and scale; returns the case's report dict."""
+    train = scale_frame(pd.read_csv(args.train), scale, seed=args.seed)
+    test = scale_frame(pd.read_csv(args.test), scale, seed=args.seed + 1)
+    raw = train[TEXT_COLUMN].astype(str).tolist() + test[TEXT_COLUMN].astype(str).tolist()
+    timer = StageTimer(args.repeat)
+
+    normalizer = TweetNormalizer(load_stopwords())
+    cleaned = timer.run("preprocess", len(raw), normalizer.clean_many, raw)
+    train_texts, test_texts = cleaned[:len(train)], cleaned[len(train):]
+    train_labels, test_labels = train[LABEL_COLUMN].to_numpy(), test[LABEL_COLUMN].to_numpy()
+    vocabulary = timer.run("vocabulary", len(train_texts), Vocabulary().fit, train_texts)
+
+    if mode == "bow":
+        def featurize():
+            return bow_matrix(train_texts, vocabulary), bow_matrix(test_texts, vocabulary)
+        X, Q = timer.run("features", len(cleaned), featurize)
+        index_type = InvertedIndex
+    else:
+        store = EmbeddingStore.load(args.store)
+
+        def featurize():
+            (X, train_keep), (Q, test_keep) = embed_tweets(train_texts, store), embed_tweets(test_texts, store)
+            return X[train_keep], train_keep, Q[test_keep], test_keep
+        X, train_keep, Q, test_keep = timer.run("features", len(cleaned), featurize)
+        train_labels, test_labels = train_labels[train_keep], test_labels[test_keep]
+        index_type = BruteForceIndex
+
+    Q, test_labels = Q[:args.max_queries], test_labels[:args.max_queries]
+    n_queries = Q.shape[0]
+    chunk_size = max(1, min(DEFAULT_CHUNK_SIZE, args.max_block_mb * 2 ** 20 // (8 * X.shape[0])))
+    index = index_type(chunk_size=chunk_size)
+    timer.run("index", X.shape[0], index.build, X)
+    _, indices = timer.run("neighbours", n_queries, index.query, Q, max(K_LIST))
+    classes, train_codes = encode_labels(train_labels)
+    _, test_codes = encode_labels(test_labels, classes)
+    scores = timer.run("voting", n_queries * len(K_LIST), _vote_all, train_codes[indices], test_codes, len(classes))
+    if not args.skip_sklearn:
+        timer.run("classifying", n_queries, _classifying, X, train_labels, Q)
+
+    return {"mode": mode, "scale": scale, "n_train": int(X.shape[0]), "n_test": len(test_texts),
+            "n_queries": int(n_queries), "n_features": int(X.shape[1]), "chunk_size": int(chunk_size),
+            "accuracy": {str(k): round(float(s["accuracy"]), 6) for k, s in scores.items()},
+            "stages": timer.results}
+
+
+def _git(*command):
+    try:
+        return subprocess.run(("git",) + command, cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """Where and on what the benchmark ran, for comparing reports."""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": _git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(),
+            "numpy": np.__version__, "scipy": scipy.__version__, "pandas": pd.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def compare(baseline, report):
+    """Rows of (mode, scale, stage, old seconds, new seconds, speed-up) for the stages both reports have."""
+    old = {(c["mode"], c["scale"], s["stage"]): s["seconds"] for c in baseline["cases"] for s in c["stages"]}
+    rows = []
+    for case in report["cases"]:
+        for stage in case["stages"]:
+            key = (case["mode"], case["scale"], stage["stage"])
+            if key in old:
+                rows.append(key + (old[key], stage["seconds"],
+                                   old[key] / stage["seconds"] if stage["seconds"] else float("inf")))
+    return rows
+
+
+def _print_case(case):
+    print("\n{} x{}: {} train / {} queries, {} features".format(
+        case["mode"], case["scale"], case["n_train"], case["n_queries"], case["n_features"]), file=sys.stderr)
+    for stage in case["stages"]:
+        print("  {:<12} {:>10.3f} s {:>14} items/s {:>10.1f} MB peak RSS".format(
+            stage["stage"], stage["seconds"], stage["items_per_s"], stage["peak_rss_mb"]), file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Time the KNN pipeline stages on scaled-up corpora.")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--modes", nargs="+", choices=("bow", "word2vec"), default=["bow", "word2vec"])
+    parser.add_argument("--train", default=os.path.join(ROOT, "train.csv"))
+    parser.add_argument("--test", default=os.path.join(ROOT, "test.csv"))
+    parser.add_argument("--store", default=os.path.join(ROOT, "word2vec_store"),
+                        help="EmbeddingStore directory; word2vec mode is skipped if it is missing")
+    parser.add_argument("--max-queries", type=int, default=DEFAULT_MAX_QUERIES,
+                        help="test tweets used by the neighbour, voting and classifying stages")
+    parser.add_argument("--max-block-mb", type=int, default=DEFAULT_MAX_BLOCK_MB,
+                        help="memory for the distances of one chunk of queries")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage; the best time is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpora")
+    parser.add_argument("--skip-sklearn", action="store_true", help="leave out the classifying stage")
+    parser.add_argument("--output", help="JSON report (default: benchmarks/results/bench_pipeline-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare the stage times with")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    modes = list(args.modes)
+    if "word2vec" in modes and not os.path.isdir(args.store):
+        print("No EmbeddingStore at {}, skipping word2vec".format(args.store), file=sys.stderr)
+        modes.remove("word2vec")
+    report = {"benchmark": "bench_pipeline", "environment": environment(),
+              "settings": {"scales": args.scales, "modes": modes, "k_list": K_LIST,
+                           "max_queries": args.max_queries, "max_block_mb": args.max_block_mb, "repeat": args.repeat, "seed": args.seed,
+                           "novel_fraction": NOVEL_FRACTION},
+              "cases": []}
+    # A fresh process per case, so one case's memory does not count towards the next one's peak.
+    context = multiprocessing.get_context("spawn")
+    for mode in modes:
+        for scale in args.scales:
+            with context.Pool(1) as pool:
+                case = pool.apply(run_case, (mode, scale, args))
+            _print_case(case)
+            report["cases"].append(case)
+
+    output = args.output
+    if output is None:
+        commit = (report["environment"]["commit"] or "unknown")[:10]
+        output = os.path.join(ROOT, "benchmarks", "results", "bench_pipeline-{}.json".format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print("\nWrote {}".format(output), file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print("\nSpeed-up against {} ({}):".format(args.baseline, baseline["environment"]["commit"]),
+              file=sys.stderr)
+        for mode, scale, stage, old, new, speedup in compare(baseline, report):
+            print("  {} x{} {:<12} {:>10.3f} s -> {:>10.3f} s  {:>6.2f}x".format(
+                mode, scale, stage, old, new, speedup), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Reusable building blocks for the KNN sentiment analysis scripts."""
+
+from . import instrument
+from .buffers import QuantizedRowBuffer, RowBuffer, SparseRowBuffer
+from .cli import read_chunks, score_file
+from .corpus import Corpus, load_corpus
+from .distance import as_rows, pairwise_distances, row_norms_sq, sparse_dot
+from .embeddings import EmbeddingStore, convert_word2vec, corpus_words, drop_empty, embed_tokens, embed_tweets
+from .evaluation import compare_dtypes, feature_nbytes, knn_label_matrix, sweep_k
+from .features import Vocabulary, bow_matrix, hash_matrix, idf_weights, normalize_rows, tfidf_matrix
+from .index import BruteForceIndex, IVFIndex, IncrementalIndex, InvertedIndex, NeighbourIndex, compare_indexes, recall_at_k
+from .loadgen import run_load
+from .model import BoWKNNClassifier, HashingKNNClassifier, KNNClassifier, TfidfKNNClassifier, Word2vecKNNClassifier
+from .parallel import ParallelScorer, load_shared_model, share_model
+from .quantization import QuantizedMatrix
+from .scoring import confusion_counts, distance_weights, encode_labels, macro_scores, majority_vote, vote_counts
+from .search import check_k, kneighbors, top_k
+from .selection import format_grid, grid_search, stratified_folds
+from .server import MicroBatcher, PredictionServer, ServingMetrics, serve
+from .stopwords import load_stopwords, remove_stopwords, remove_stopwords_many
+from .text import TweetNormalizer
+
+__all__ = [
+    "BoWKNNClassifier",
+    "BruteForceIndex",
+    "Corpus",
+    "EmbeddingStore",
+    "HashingKNNClassifier",
+    "IVFIndex",
+    "IncrementalIndex",
+    "InvertedIndex",
+    "KNNClassifier",
+    "MicroBatcher",
+    "NeighbourIndex",
+    "ParallelScorer",
+    "PredictionServer",
+    "QuantizedMatrix",
+    "QuantizedRowBuffer",
+    "RowBuffer",
+    "ServingMetrics",
+    "SparseRowBuffer",
+    "TfidfKNNClassifier",
+    "TweetNormalizer",
+    "Vocabulary",
+    "Word2vecKNNClassifier",
+    "as_rows",
+    "bow_matrix",
+    "check_k",
+    "compare_dtypes",
+    "compare_indexes",
+    "confusion_counts",
+    "convert_word2vec",
+    "corpus_words",
+    "distance_weights",
+    "drop_empty",
+    "embed_tokens",
+    "embed_tweets",
+    "encode_labels",
+    "feature_nbytes",
+    "format_grid",
+    "grid_search",
+    "hash_matrix",
+    "idf_weights",
+    "instrument",
+    "kneighbors",
+    "knn_label_matrix",
+    "load_corpus",
+    "load_shared_model",
+    "load_stopwords",
+    "macro_scores",
+    "majority_vote",
+    "normalize_rows",
+    "pairwise_distances",
+    "read_chunks",
+    "recall_at_k",
+    "remove_stopwords",
+    "remove_stopwords_many",
+    "row_norms_sq",
+    "run_load",
+    "score_file",
+    "serve",
+    "share_model",
+    "sparse_dot",
+    "stratified_folds",
+    "sweep_k",
+    "tfidf_matrix",
+    "top_k",
+    "vote_counts",
+]
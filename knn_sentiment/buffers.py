@@ -0,0 +1,83 @@
+"""Growable arrays for appending training rows in place.
+
+Every buffer over-allocates and doubles its capacity when full, so
+appending m rows costs amortized O(m) instead of copying everything that
+is already stored, the way ``np.concatenate`` would on every append.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from .quantization import QuantizedMatrix
+
+
+class RowBuffer:
+    """An array that grows along its first axis; ``view`` is the filled part."""
+
+    def __init__(self, initial):
+        initial = np.asarray(initial)
+        self._data = np.array(initial, copy=True)
+        self._size = len(initial)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def view(self):
+        return self._data[:self._size]
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self._data.dtype)
+        end = self._size + len(rows)
+        if end > len(self._data):
+            grown = np.empty((max(end, 2 * len(self._data), 16),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = rows
+        self._size = end
+
+
+class SparseRowBuffer:
+    """A CSR matrix that grows by rows (and columns); ``matrix`` is a CSR view."""
+
+    def __init__(self, n_columns, dtype=np.float64):
+        self.n_columns = n_columns
+        self._data = RowBuffer(np.empty(0, dtype=dtype))
+        self._indices = RowBuffer(np.empty(0, dtype=np.int32))
+        self._indptr = RowBuffer(np.zeros(1, dtype=np.int64))
+
+    def __len__(self):
+        return len(self._indptr) - 1
+
+    @property
+    def matrix(self):
+        return sp.csr_matrix((self._data.view, self._indices.view, self._indptr.view),
+                             shape=(len(self), self.n_columns))
+
+    def extend(self, rows):
+        rows = sp.csr_matrix(rows)
+        self.n_columns = max(self.n_columns, rows.shape[1])
+        self._indptr.extend(rows.indptr[1:] + len(self._data))
+        self._data.extend(rows.data)
+        self._indices.extend(rows.indices)
+
+
+class QuantizedRowBuffer:
+    """A ``QuantizedMatrix`` that grows by rows; ``view`` is the filled part."""
+
+    def __init__(self, n_columns):
+        self._codes = RowBuffer(np.empty((0, n_columns), dtype=np.int8))
+        self._scales = RowBuffer(np.empty(0, dtype=np.float32))
+
+    def __len__(self):
+        return len(self._scales)
+
+    @property
+    def view(self):
+        return QuantizedMatrix(self._codes.view, self._scales.view)
+
+    def extend(self, rows):
+        if not isinstance(rows, QuantizedMatrix):
+            rows = QuantizedMatrix.from_array(rows)
+        self._codes.extend(rows.codes)
+        self._scales.extend(rows.scales)
@@ -0,0 +1,317 @@
+"""Command line interface: ``python -m knn_sentiment COMMAND``.
+
+* ``fit`` -- fit a BoW, TF-IDF, hashing or word2vec classifier on a labelled CSV and save it,
+* ``score`` -- stream a CSV or JSONL file of tweets through a saved model,
+* ``serve`` -- answer predictions over HTTP with micro-batching,
+* ``loadgen`` -- send concurrent requests to a running server,
+* ``convert-word2vec`` -- turn a word2vec file into an ``EmbeddingStore``,
+* ``select`` -- cross-validate k, the metric, the vote weighting and the features.
+
+``score`` reads ``--chunk-size`` rows at a time, predicts them and appends
+the predictions to the output before reading the next chunk, so memory is
+bounded by the chunk size (plus the model), not by the size of the input.
+With ``--jobs`` every chunk is split over worker processes that share the
+model through memory-mapped files (see ``knn_sentiment.parallel``). It
+reports the throughput in tweets/sec on stderr when done.
+
+The global ``--stats`` option prints the time spent in every pipeline stage
+(see ``knn_sentiment.instrument``) on stderr when the command ends;
+``--profile DIR`` also writes cProfile and tracemalloc reports to DIR.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from . import instrument
+from .corpus import LABEL_COLUMN, TEXT_COLUMN
+from .distance import METRICS
+from .embeddings import EmbeddingStore, convert_word2vec, corpus_words
+from .features import DEFAULT_BUCKETS
+from .index import IVFIndex
+from .model import MODEL_TYPES, BoWKNNClassifier, HashingKNNClassifier, KNNClassifier, TfidfKNNClassifier, Word2vecKNNClassifier
+from .loadgen import run_load
+from .parallel import ParallelScorer
+from .selection import DEFAULT_KS, FEATURES, WEIGHTS, format_grid, grid_search
+from .server import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT, serve
+
+DEFAULT_SCORE_CHUNK_SIZE = 2000
+PREDICTION_COLUMN = "Predicted Label"
+FORMATS = ("csv", "jsonl")
+
+
+def _format(path, fmt):
+    if fmt is not None:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".json", ".ndjson"):
+        return "jsonl"
+    return "csv"
+
+
+def read_chunks(path, chunk_size=DEFAULT_SCORE_CHUNK_SIZE, fmt=None):
+    """Yield DataFrames of at most ``chunk_size`` rows from a CSV or JSONL file.
+
+    The format follows the extension unless ``fmt`` is given; ``-`` reads
+    standard input.
+    """
+    source = sys.stdin if path == "-" else path
+    if _format(path, fmt) == "jsonl":
+        reader = pd.read_json(source, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        reader = pd.read_csv(source, chunksize=chunk_size)
+    with reader:
+        yield from reader
+
+
+def _write_chunk(frame, file, fmt, first):
+    if fmt == "jsonl":
+        frame.to_json(file, orient="records", lines=True, force_ascii=False)
+    else:
+        frame.to_csv(file, header=first, index=False)
+    file.flush()
+
+
+def score_file(model, input_path, output_path, chunk_size=DEFAULT_SCORE_CHUNK_SIZE,
+               text_column=TEXT_COLUMN, proba=False, input_format=None, output_format=None):
+    """Predict every tweet of ``input_path`` and write the rows to ``output_path``.
+
+    Every output row is the input row plus a ``Predicted Label`` column and,
+    with ``proba``, one ``P(<class>)`` column per class. ``-`` writes to
+    standard output. Returns the number of tweets scored.
+    """
+    output_format = _format(output_path, output_format)
+    file = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8", newline="")
+    n_tweets = 0
+    try:
+        for chunk in read_chunks(input_path, chunk_size, input_format):
+            if text_column not in chunk:
+                raise ValueError("{} has no {!r} column".format(input_path, text_column))
+            tweets = chunk[text_column].fillna("").astype(str)
+            if proba:
+                chunk[PREDICTION_COLUMN], probabilities = model.predict_with_proba(tweets)
+                for i, label in enumerate(model.classes):
+                    chunk["P({})".format(label)] = probabilities[:, i]
+            else:
+                chunk[PREDICTION_COLUMN] = model.predict(tweets)
+            _write_chunk(chunk, file, output_format, first=n_tweets == 0)
+            n_tweets += len(chunk)
+    finally:
+        if file is not sys.stdout:
+            file.close()
+    return n_tweets
+
+
+def _fit(args):
+    data = pd.read_csv(args.train)
+    params = dict(k=args.k, seed=args.seed, dtype=args.dtype, weights=args.weights)
+    if args.metric is not None:
+        params["metric"] = args.metric
+    cls = MODEL_TYPES[args.mode]
+    if args.dtype not in cls.dtypes:
+        raise SystemExit("--dtype {} is not available with --mode {}, use one of {}".format(
+            args.dtype, args.mode, ", ".join(cls.dtypes)))
+    if args.mode == "word2vec":
+        if args.store is None:
+            raise SystemExit("--store is required with --mode word2vec")
+        if args.index == "ivf" and params.get("metric", "euclidean") not in IVFIndex.metrics:
+            raise SystemExit("--index ivf supports --metric {}".format(" or ".join(IVFIndex.metrics)))
+        index_params = {"n_lists": args.n_lists, "n_probe": args.n_probe, "pq_subspaces": args.pq_subspaces}
+        model = Word2vecKNNClassifier(args.store, index_type=args.index,
+                                      index_params=index_params if args.index == "ivf" else None, **params)
+    elif args.mode == "hashing":
+        model = HashingKNNClassifier(n_buckets=args.buckets, signed=not args.unsigned, **params)
+    else:
+        model = cls(min_count=args.min_count, max_size=args.max_vocab, **params)
+    start = time.perf_counter()
+    model.fit(data[args.text_column].fillna("").astype(str), data[args.label_column])
+    model.save(args.model)
+    print("Fitted a {} model on {} tweets in {:.2f} s and wrote it to {}".format(
+        args.mode, len(model.label_codes), time.perf_counter() - start, args.model), file=sys.stderr)
+
+
+def _score(args):
+    model = _load_model(args)
+    start = time.perf_counter()
+    if args.jobs == 1:
+        n_tweets = score_file(model, args.input, args.output, chunk_size=args.chunk_size,
+                              text_column=args.text_column, proba=args.proba,
+                              input_format=args.input_format, output_format=args.output_format)
+    else:
+        with ParallelScorer(model, n_jobs=args.jobs) as scorer:
+            n_tweets = score_file(scorer, args.input, args.output, chunk_size=args.chunk_size,
+                                  text_column=args.text_column, proba=args.proba,
+                                  input_format=args.input_format, output_format=args.output_format)
+    elapsed = time.perf_counter() - start
+    print("Scored {} tweets in {:.2f} s ({:.0f} tweets/sec)".format(
+        n_tweets, elapsed, n_tweets / elapsed if elapsed else 0.0), file=sys.stderr)
+
+
+def _load_model(args):
+    kwargs = {"store": EmbeddingStore.load(args.store)} if args.store else {}
+    model = KNNClassifier.load(args.model, **kwargs)
+    if args.k is not None:
+        model.k = args.k
+    return model
+
+
+def _serve(args):
+    model = _load_model(args)
+    print("Serving {} on http://{}:{} (max batch {}, max wait {} ms)".format(
+        args.model, args.host, args.port, args.max_batch_size, args.max_wait_ms), file=sys.stderr)
+    serve(model, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+
+
+def _loadgen(args):
+    tweets = []
+    for chunk in read_chunks(args.input, fmt=args.input_format):
+        tweets.extend(chunk[args.text_column].fillna("").astype(str))
+    report = asyncio.run(run_load(args.host, args.port, tweets, args.requests, args.concurrency))
+    print(json.dumps(report, indent=2))
+
+
+def _convert(args):
+    keep = corpus_words(*args.prune) if args.prune else None
+    store = convert_word2vec(args.source, args.directory, keep=keep, binary=not args.text)
+    print("Wrote {} vectors of size {} to {}".format(len(store), store.vector_size, args.directory))
+
+
+def _select(args):
+    data = pd.read_csv(args.train)
+    start = time.perf_counter()
+    report = grid_search(data[args.text_column].fillna("").astype(str), data[args.label_column],
+                         ks=args.k, metrics=args.metrics, weights=args.weights, features=args.features,
+                         n_folds=args.folds, store=args.store, n_jobs=args.jobs, seed=args.seed)
+    print(format_grid(report, args.top))
+    print("Cross-validated {} settings with {} folds in {:.2f} s".format(
+        len(report), args.folds, time.perf_counter() - start), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m knn_sentiment",
+                                     description="KNN sentiment classification of tweets.")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the time spent in every pipeline stage when done")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="write per-stage stats, a cProfile profile and tracemalloc allocations to DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fit = commands.add_parser("fit", help="fit a classifier on a labelled CSV and save it")
+    fit.add_argument("train", help="training CSV with raw tweets and their labels")
+    fit.add_argument("model", help="output .npz file")
+    fit.add_argument("--mode", choices=("bow", "tfidf", "hashing", "word2vec"), default="bow")
+    fit.add_argument("--store", help="EmbeddingStore directory (word2vec mode)")
+    fit.add_argument("--k", type=int, default=10, help="number of neighbours that vote")
+    fit.add_argument("--metric", choices=METRICS, help="default: cosine for tfidf, euclidean otherwise")
+    fit.add_argument("--seed", type=int, default=0, help="seed for breaking voting ties")
+    fit.add_argument("--weights", choices=WEIGHTS, default="uniform",
+                     help="count every neighbour's vote once, or weigh it by its inverse distance")
+    fit.add_argument("--dtype", choices=sorted(set(BoWKNNClassifier.dtypes + TfidfKNNClassifier.dtypes
+                                                   + HashingKNNClassifier.dtypes + Word2vecKNNClassifier.dtypes)),
+                     default="float64", help="storage type of the training rows: uint16 or uint8 (bow), "
+                                             "float32 (tfidf, hashing, word2vec) or int8 (word2vec)")
+    fit.add_argument("--min-count", type=int, default=1,
+                     help="leave out words seen fewer times than this (bow and tfidf modes)")
+    fit.add_argument("--max-vocab", type=int,
+                     help="keep at most this many of the most frequent words (bow and tfidf modes)")
+    fit.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS,
+                     help="number of hashed feature columns (hashing mode)")
+    fit.add_argument("--unsigned", action="store_true",
+                     help="add +1 for every word instead of a hashed sign (hashing mode)")
+    fit.add_argument("--index", choices=Word2vecKNNClassifier.index_types, default="brute",
+                     help="exact search, or an approximate IVF index (word2vec mode)")
+    fit.add_argument("--n-lists", type=int, default=256, help="number of IVF lists (--index ivf)")
+    fit.add_argument("--n-probe", type=int, default=8, help="IVF lists scanned per query (--index ivf)")
+    fit.add_argument("--pq-subspaces", type=int,
+                     help="store the rows as this many bytes with product quantization (--index ivf)")
+    fit.add_argument("--text-column", default=TEXT_COLUMN)
+    fit.add_argument("--label-column", default=LABEL_COLUMN)
+    fit.set_defaults(func=_fit)
+
+    score = commands.add_parser("score", help="stream tweets through a saved model")
+    score.add_argument("model", help=".npz file written by fit")
+    score.add_argument("input", help="CSV or JSONL file of tweets, or - for stdin")
+    score.add_argument("output", help="CSV or JSONL output file, or - for stdout")
+    score.add_argument("--chunk-size", type=int, default=DEFAULT_SCORE_CHUNK_SIZE,
+                       help="tweets read, scored and written at a time")
+    score.add_argument("--text-column", default=TEXT_COLUMN)
+    score.add_argument("--k", type=int, help="override the number of neighbours of the model")
+    score.add_argument("--jobs", type=int, default=1,
+                       help="worker processes sharing the memory-mapped model; 0 for one per CPU")
+    score.add_argument("--proba", action="store_true", help="also write the class probabilities")
+    score.add_argument("--store", help="use this EmbeddingStore directory instead of the saved one")
+    score.add_argument("--input-format", choices=FORMATS, help="default: from the file extension")
+    score.add_argument("--output-format", choices=FORMATS, help="default: from the file extension")
+    score.set_defaults(func=_score)
+
+    server = commands.add_parser("serve", help="answer predictions over HTTP with micro-batching")
+    server.add_argument("model", help=".npz file written by fit")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8000)
+    server.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help="most tweets scored together")
+    server.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT * 1000,
+                        help="longest a tweet waits for others to join its batch")
+    server.add_argument("--k", type=int, help="override the number of neighbours of the model")
+    server.add_argument("--store", help="use this EmbeddingStore directory instead of the saved one")
+    server.set_defaults(func=_serve)
+
+    loadgen = commands.add_parser("loadgen", help="send concurrent requests to a running server")
+    loadgen.add_argument("input", help="CSV or JSONL file of tweets to send")
+    loadgen.add_argument("--host", default="127.0.0.1")
+    loadgen.add_argument("--port", type=int, default=8000)
+    loadgen.add_argument("--requests", type=int, default=10000, help="total number of requests")
+    loadgen.add_argument("--concurrency", type=int, default=64, help="concurrent connections")
+    loadgen.add_argument("--text-column", default=TEXT_COLUMN)
+    loadgen.add_argument("--input-format", choices=FORMATS, help="default: from the file extension")
+    loadgen.set_defaults(func=_loadgen)
+
+    convert = commands.add_parser("convert-word2vec",
+                                  help="convert word2vec vectors into a memory-mappable store")
+    convert.add_argument("source", help="word2vec file, e.g. GoogleNews-vectors-negative300.bin.gz")
+    convert.add_argument("directory", help="output directory")
+    convert.add_argument("--prune", nargs="+", metavar="CSV",
+                         help="only keep the words that occur in these preprocessed CSV files")
+    convert.add_argument("--text", action="store_true", help="the source is in word2vec text format")
+    convert.set_defaults(func=_convert)
+
+    select = commands.add_parser("select", help="cross-validate the settings of the classifier")
+    select.add_argument("train", help="training CSV with raw tweets and their labels")
+    select.add_argument("--folds", type=int, default=5, help="number of stratified folds")
+    select.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS), help="numbers of neighbours to try")
+    select.add_argument("--metrics", nargs="+", choices=METRICS, default=list(METRICS))
+    select.add_argument("--weights", nargs="+", choices=WEIGHTS, default=list(WEIGHTS))
+    select.add_argument("--features", nargs="+", choices=FEATURES,
+                        help="default: all of them, word2vec only with --store")
+    select.add_argument("--store", help="EmbeddingStore directory (word2vec features)")
+    select.add_argument("--jobs", type=int, default=0, help="worker processes running folds; 0 for one per CPU")
+    select.add_argument("--seed", type=int, default=0, help="seed for the folds and for breaking voting ties")
+    select.add_argument("--top", type=int, default=20, help="number of settings to print, best first")
+    select.add_argument("--output", help="also write every setting with its per-fold scores to this JSON file")
+    select.add_argument("--text-column", default=TEXT_COLUMN)
+    select.add_argument("--label-column", default=LABEL_COLUMN)
+    select.set_defaults(func=_select)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        with instrument.profile(args.profile) as run_dir:
+            args.func(args)
+        print(instrument.format_report(), file=sys.stderr)
+        print("Wrote the profile to {}".format(run_dir), file=sys.stderr)
+    elif args.stats:
+        instrument.enable()
+        args.func(args)
+        print(instrument.format_report(), file=sys.stderr)
+    else:
+        args.func(args)
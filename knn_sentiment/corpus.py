@@ -0,0 +1,136 @@
+"""Preprocessed tweet corpora with an on-disk cache.
+
+``load_corpus`` reads a CSV of ``Sentiment,Tweet`` rows, normalizes every
+tweet and stores the result as an ``.npz`` file: the corpus vocabulary, the
+tokens of all tweets as one array of word ids with row offsets, and the
+label codes. The cache file name contains a hash of the CSV, the stopword
+files and ``NORMALIZER_VERSION``, so changing any of them makes a new entry
+and repeated runs only pay for reading the arrays back.
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .scoring import encode_labels
+from .stopwords import DEFAULT_STOPWORDS_PATH, load_stopwords
+from .text import NORMALIZER_VERSION, TweetNormalizer
+
+DEFAULT_CACHE_DIR = os.environ.get("KNN_SENTIMENT_CACHE", os.path.join(".cache", "knn_sentiment"))
+LABEL_COLUMN = "Sentiment"
+TEXT_COLUMN = "Tweet"
+
+
+@dataclass
+class Corpus:
+    """Tokens and labels of a preprocessed dataset.
+
+    The tokens of tweet i are ``vocab[token_ids[offsets[i]:offsets[i + 1]]]``
+    and its label is ``classes[label_codes[i]]``.
+    """
+
+    vocab: np.ndarray
+    token_ids: np.ndarray
+    offsets: np.ndarray
+    classes: np.ndarray
+    label_codes: np.ndarray
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def labels(self):
+        return self.classes[self.label_codes]
+
+    def token_lists(self):
+        """Tokens of every tweet as a list of lists of str."""
+        words = self.vocab.tolist()
+        ids = self.token_ids.tolist()
+        bounds = self.offsets.tolist()
+        return [[words[j] for j in ids[bounds[i]:bounds[i + 1]]] for i in range(len(self))]
+
+    def texts(self):
+        """Preprocessed text of every tweet (its tokens joined by spaces)."""
+        return [" ".join(tokens) for tokens in self.token_lists()]
+
+    def to_frame(self):
+        """The corpus as a DataFrame with the same columns as the CSV."""
+        return pd.DataFrame({LABEL_COLUMN: self.labels, TEXT_COLUMN: self.texts()})
+
+    @classmethod
+    def from_tokens(cls, token_lists, labels):
+        """Build a corpus from tokenized tweets and their labels."""
+        word_ids = {}
+        ids = []
+        offsets = [0]
+        for tokens in token_lists:
+            for token in tokens:
+                ids.append(word_ids.setdefault(token, len(word_ids)))
+            offsets.append(len(ids))
+
+        # Renumber the words in sorted order so the file does not depend on tweet order.
+        vocab = np.array(sorted(word_ids), dtype=str)
+        remap = np.empty(len(word_ids), dtype=np.int32)
+        remap[[word_ids[w] for w in vocab.tolist()]] = np.arange(len(word_ids), dtype=np.int32)
+        classes, codes = encode_labels(labels)
+        return cls(vocab=vocab,
+                   token_ids=remap[np.asarray(ids, dtype=np.int64)],
+                   offsets=np.asarray(offsets, dtype=np.int64),
+                   classes=classes.astype(str),
+                   label_codes=codes.astype(np.int16))
+
+    def save(self, path):
+        # Written to a temporary file first so readers never see half a file.
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, vocab=self.vocab, token_ids=self.token_ids, offsets=self.offsets,
+                 classes=self.classes, label_codes=self.label_codes)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+
+def _file_hash(path, h):
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            h.update(block)
+
+
+def cache_key(csv_path, stopword_paths):
+    """Hex digest identifying a CSV preprocessed with the given stopwords."""
+    h = hashlib.sha256()
+    _file_hash(csv_path, h)
+    for path in stopword_paths:
+        _file_hash(path, h)
+    h.update("normalizer-{}".format(NORMALIZER_VERSION).encode())
+    return h.hexdigest()
+
+
+def load_corpus(csv_path, stopword_paths=(DEFAULT_STOPWORDS_PATH,), cache_dir=DEFAULT_CACHE_DIR):
+    """Read and preprocess ``csv_path``, or load the cached result.
+
+    Pass ``cache_dir=None`` to always preprocess and never write a cache file.
+    """
+    if isinstance(stopword_paths, str):
+        stopword_paths = (stopword_paths,)
+    cache_path = None
+    if cache_dir is not None:
+        name = "{}-{}.npz".format(os.path.splitext(os.path.basename(csv_path))[0],
+                                  cache_key(csv_path, stopword_paths)[:20])
+        cache_path = os.path.join(cache_dir, name)
+        if os.path.exists(cache_path):
+            return Corpus.load(cache_path)
+
+    frame = pd.read_csv(csv_path)
+    normalizer = TweetNormalizer(load_stopwords(*stopword_paths))
+    corpus = Corpus.from_tokens(normalizer.tokenize_many(frame[TEXT_COLUMN]), frame[LABEL_COLUMN])
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        corpus.save(cache_path)
+    return corpus
@@ -0,0 +1,161 @@
+"""Pairwise distances for dense arrays and sparse CSR feature matrices.
+
+Distances are computed from dot products instead of explicit differences:
+
+    ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+    cos(a, b)   = 1 - a.b / (||a|| ||b||)
+
+so a sparse BoW matrix never has to be turned into a dense one. Manhattan
+distances of sparse rows start from the L1 norms and correct them only
+where two rows share a column:
+
+    |a - b|_1 = |a|_1 + |b|_1 + sum over shared i of (|a_i - b_i| - |a_i| - |b_i|)
+
+Compact training rows are used as they are stored: dense float32 rows are
+multiplied in float32 and int8 ``QuantizedMatrix`` rows block by block in
+float32. Sparse integer counts (uint8/uint16) are never widened as a whole:
+``sparse_dot`` only widens the columns the queries use, to an integer type
+when the queries are counts too. Norms and distances are always float64.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial.distance import cdist
+
+from .quantization import BLOCK_SIZE, QuantizedMatrix
+
+METRICS = ("euclidean", "cosine", "manhattan")
+
+
+def row_norms_sq(X):
+    """Squared L2 norm of every row of a dense, sparse or quantized matrix, as float64."""
+    if isinstance(X, QuantizedMatrix):
+        return X.row_norms_sq()
+    if sp.issparse(X):
+        X = sp.csr_matrix(X)
+        data = X.data.astype(np.float64)
+        squares = sp.csr_matrix((data * data, X.indices, X.indptr), shape=X.shape)
+        return np.asarray(squares.sum(axis=1), dtype=np.float64).ravel()
+    X = np.asarray(X)
+    return np.einsum("ij,ij->i", X, X, dtype=np.float64)
+
+
+def as_rows(X):
+    """Rows in the form the distance kernels use them.
+
+    Sparse and quantized matrices are returned as they are, float32 arrays
+    stay float32 and any other array becomes float64.
+    """
+    if sp.issparse(X) or isinstance(X, QuantizedMatrix):
+        return X
+    X = np.asarray(X)
+    return X if X.dtype == np.float32 else X.astype(np.float64, copy=False)
+
+
+def sparse_dot(A, postings):
+    """``A @ postings`` for sparse query rows and a sparse (columns x rows) matrix.
+
+    With integer ``postings`` (e.g. uint8 counts, transposed) only the rows
+    for the columns ``A`` uses are widened, instead of the whole matrix
+    on every call: to int32 (int64 if a sum could overflow) when ``A``
+    holds whole numbers, such as word counts, and to float64 otherwise.
+    Returns a CSR matrix.
+    """
+    A = sp.csr_matrix(A)
+    if postings.dtype.kind not in "iu":
+        return sp.csr_matrix(A @ postings)
+    postings = sp.csr_matrix(postings)
+    used, columns = np.unique(A.indices, return_inverse=True)
+    A = sp.csr_matrix((A.data, columns.ravel().astype(np.int32), A.indptr), shape=(A.shape[0], len(used)))
+    postings = postings[used]
+    if not np.array_equal(A.data, np.rint(A.data)):
+        return sp.csr_matrix(A @ postings.astype(np.float64))
+    # The largest possible sum: the largest row of |A| times the largest stored value.
+    bound = np.abs(A).sum(axis=1).max() * postings.data.max() if A.nnz and postings.nnz else 0
+    dtype = np.int32 if bound < np.iinfo(np.int32).max else np.int64
+    return sp.csr_matrix(A.astype(dtype) @ postings.astype(dtype))
+
+
+def _dot(A, B):
+    # A.B^T as a dense float64 array, whatever the input types are.
+    if isinstance(B, QuantizedMatrix):
+        prod = B.dot(A.toarray() if sp.issparse(A) else A)
+    elif sp.issparse(A) and sp.issparse(B) and B.dtype.kind in "iu":
+        prod = sparse_dot(A, B.T)
+    else:
+        if sp.issparse(A) and A.dtype.kind in "iu":
+            A = A.astype(np.float64)
+        elif not sp.issparse(A) and not sp.issparse(B):
+            A = A.astype(B.dtype, copy=False)  # float32 rows are multiplied in float32
+        prod = A @ B.T
+    if sp.issparse(prod):
+        prod = prod.toarray()
+    return np.asarray(prod, dtype=np.float64)
+
+
+def _sparse_manhattan(A, B):
+    A = sp.csr_matrix(A, dtype=np.float64)
+    columns = sp.csc_matrix(B, dtype=np.float64)  # Column i lists the rows of B using column i
+    out = np.add.outer(np.asarray(abs(A).sum(axis=1)).ravel(), np.asarray(abs(columns).sum(axis=1)).ravel())
+    # One entry per (nonzero a_i of A, row of B with a nonzero b_i in the same column).
+    starts = columns.indptr[A.indices]
+    lengths = columns.indptr[A.indices + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    a = np.repeat(A.data, lengths)
+    b = columns.data[offsets]
+    a_rows = np.repeat(np.repeat(np.arange(A.shape[0]), np.diff(A.indptr)), lengths)
+    flat = a_rows * B.shape[0] + columns.indices[offsets]
+    out += np.bincount(flat, weights=np.abs(a - b) - np.abs(a) - np.abs(b),
+                       minlength=out.size).reshape(out.shape)
+    return np.maximum(out, 0, out=out)  # Rounding can leave tiny negatives
+
+
+def _manhattan(A, B):
+    if sp.issparse(A) or sp.issparse(B):
+        return _sparse_manhattan(A, B)
+    if isinstance(B, QuantizedMatrix):
+        out = np.empty((A.shape[0], len(B)))
+        for start in range(0, len(B), BLOCK_SIZE):
+            out[:, start:start + BLOCK_SIZE] = cdist(A, B[start:start + BLOCK_SIZE].toarray(), "cityblock")
+        return out
+    return cdist(A.astype(np.float64, copy=False), B.astype(np.float64, copy=False), "cityblock")
+
+
+def pairwise_distances(A, B, metric="euclidean", A_norms=None, B_norms=None):
+    """Distances between every row of ``A`` and every row of ``B``.
+
+    Gives the same values as ``scipy.spatial.distance.cdist`` for the
+    supported metrics (manhattan is cdist's ``cityblock``), up to floating
+    point rounding. ``A_norms`` and ``B_norms`` are the squared row norms
+    from ``row_norms_sq``; passing them in avoids recomputing the training
+    norms for every call (manhattan does not use them).
+    Rows with no words have a cosine distance of 1 to everything (cdist
+    would return nan for them).
+    """
+    if metric not in METRICS:
+        raise ValueError("Unsupported metric {!r}, expected one of {}".format(metric, METRICS))
+    A = as_rows(A)
+    B = as_rows(B)
+    if metric == "manhattan":
+        return _manhattan(A, B)
+    if A_norms is None:
+        A_norms = row_norms_sq(A)
+    if B_norms is None:
+        B_norms = row_norms_sq(B)
+
+    dots = _dot(A, B)
+
+    if metric == "euclidean":
+        dots *= -2
+        dots += A_norms[:, None]
+        dots += B_norms[None, :]
+        np.maximum(dots, 0, out=dots)  # Rounding can leave tiny negatives
+        return np.sqrt(dots, out=dots)
+
+    denom = np.sqrt(A_norms)[:, None] * np.sqrt(B_norms)[None, :]
+    zero = denom == 0
+    denom[zero] = 1
+    dots /= denom
+    dots[zero] = 0
+    np.subtract(1, dots, out=dots)
+    return np.clip(dots, 0, 2, out=dots)
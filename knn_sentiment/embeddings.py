@@ -0,0 +1,161 @@
+"""Memory-mapped word2vec vectors.
+
+Parsing GoogleNews-vectors-negative300.bin.gz takes minutes and several GB
+of RAM per process. ``convert_word2vec`` does it once and writes a
+directory with
+
+* ``vectors.npy`` -- a float32 matrix with one row per word,
+* ``vocab.txt``   -- the words, one per line, in row order.
+
+``EmbeddingStore.load`` memory-maps the matrix, so startup only reads the
+vocabulary and processes using the same store share its pages through the
+OS page cache. The store can be pruned to the words that actually occur in
+the datasets, which makes it a few MB instead of 3.6 GB.
+
+Run ``python -m knn_sentiment convert-word2vec SOURCE DIRECTORY --prune
+train.csv test.csv`` to convert.
+"""
+
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from . import instrument
+from .corpus import load_corpus
+
+VECTORS_FILE = "vectors.npy"
+VOCAB_FILE = "vocab.txt"
+
+
+class EmbeddingStore:
+    """Word vectors as a float32 matrix plus a word -> row dict.
+
+    Supports the parts of gensim's ``KeyedVectors`` the scripts use:
+    ``word in store``, ``store[word]``, ``store[list_of_words]``,
+    ``key_to_index`` and ``index_to_key``. ``path`` is the directory the
+    store was loaded from, if any.
+    """
+
+    def __init__(self, vectors, words, path=None):
+        self.vectors = vectors
+        self.path = path
+        self.index_to_key = list(words)
+        self.key_to_index = {w: i for i, w in enumerate(self.index_to_key)}
+
+    @property
+    def vector_size(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.index_to_key)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def __getitem__(self, words):
+        if isinstance(words, str):
+            return self.vectors[self.key_to_index[words]]
+        return self.vectors[[self.key_to_index[w] for w in words]]
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILE), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as file:
+            file.write("\n".join(self.index_to_key))
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a converted store; with ``mmap`` the vectors stay on disk until used."""
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as file:
+            text = file.read()
+        words = text.split("\n") if text else []
+        if len(words) != len(vectors):
+            raise ValueError("{} has {} words for {} vectors".format(directory, len(words), len(vectors)))
+        return cls(vectors, words, path=os.path.abspath(directory))
+
+
+def convert_word2vec(source, directory, keep=None, binary=True):
+    """Convert a word2vec file (e.g. the GoogleNews .bin.gz) into a store.
+
+    ``keep`` is an optional collection of words; when given, only those
+    words are written. Returns the new store.
+    """
+    from gensim.models import KeyedVectors
+
+    kv = KeyedVectors.load_word2vec_format(source, binary=binary)
+    words, vectors = kv.index_to_key, kv.vectors
+    if keep is not None:
+        keep = set(keep)
+        rows = [i for i, w in enumerate(words) if w in keep]
+        words, vectors = [words[i] for i in rows], vectors[rows]
+    store = EmbeddingStore(np.asarray(vectors, dtype=np.float32), words, path=os.path.abspath(directory))
+    store.save(directory)
+    return store
+
+
+@instrument.timed("features.embed", items=lambda result: len(result[1]))
+def embed_tokens(token_lists, store):
+    """Mean word vector of every tokenized tweet, computed for all tweets at once.
+
+    Every token is looked up once in the store's hash index. The means are
+    then a single sparse product: a (tweets x used words) matrix holding
+    ``1 / n_known_words`` per token, times the vectors of the used words.
+    Returns ``(embeddings, keep)``: a C-contiguous float32 array with one row
+    per tweet, and a boolean mask that is False for tweets with no known
+    word (their rows are all zeros).
+    """
+    key_to_index = store.key_to_index
+    ids = []
+    offsets = [0]
+    for tokens in token_lists:
+        for token in tokens:
+            i = key_to_index.get(token)
+            if i is not None:
+                ids.append(i)
+        offsets.append(len(ids))
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    keep = lengths > 0
+    used, columns = np.unique(np.asarray(ids, dtype=np.int64), return_inverse=True)
+    weights = np.repeat(1 / np.maximum(lengths, 1), lengths).astype(np.float32)
+    means = sp.csr_matrix((weights, columns.ravel(), offsets), shape=(len(lengths), len(used)))
+    vectors = np.asarray(store.vectors[used], dtype=np.float32)
+    embeddings = np.ascontiguousarray(means @ vectors, dtype=np.float32)
+    if instrument.is_enabled():
+        instrument.count("features.no_embedding", int((~keep).sum()))
+    return embeddings, keep
+
+
+def embed_tweets(tweets, store):
+    """``embed_tokens`` for preprocessed tweet texts (split on whitespace)."""
+    return embed_tokens((tweet.split() for tweet in tweets), store)
+
+
+def drop_empty(embeddings, keep, *aligned):
+    """Keep only the rows of tweets that have an embedding.
+
+    ``aligned`` are other per-tweet arrays, Series or DataFrames (labels,
+    the dataset itself, ...); they are filtered with the same ``keep`` mask
+    in one step, and pandas objects get a fresh 0..n-1 index. Returns the
+    filtered embeddings followed by the filtered ``aligned`` objects.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    out = [embeddings[keep]]
+    for obj in aligned:
+        if hasattr(obj, "iloc"):
+            out.append(obj.iloc[keep].reset_index(drop=True))
+        else:
+            out.append(np.asarray(obj)[keep])
+    return tuple(out)
+
+
+def corpus_words(*csv_paths):
+    """All words of the preprocessed CSVs, for pruning a store."""
+    words = set()
+    for path in csv_paths:
+        words.update(load_corpus(path).vocab.tolist())
+    return words
+
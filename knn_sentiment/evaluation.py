@@ -0,0 +1,69 @@
+"""Evaluating the KNN classifier for several values of k at once.
+
+The k nearest neighbours for a smaller k are a prefix of the neighbours for
+a larger one, so the search only has to run once, for the largest k.
+
+``compare_dtypes`` measures what compact storage of the training rows
+(uint8 counts, float32 or int8 vectors) costs in accuracy against the
+float64 baseline.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from .quantization import QuantizedMatrix
+from .scoring import confusion_counts, encode_labels, macro_scores
+from .search import DEFAULT_CHUNK_SIZE, kneighbors
+
+
+def knn_label_matrix(Q, X, train_labels, ks, metric="euclidean",
+                     chunk_size=DEFAULT_CHUNK_SIZE, X_norms=None):
+    """Labels of the ``max(ks)`` nearest training rows of every query.
+
+    Row i lists the labels of query i's neighbours, nearest first; the
+    labels for any smaller k are the first k columns.
+    """
+    _, indices = kneighbors(Q, X, max(ks), metric=metric,
+                            chunk_size=chunk_size, X_norms=X_norms)
+    return np.asarray(train_labels)[indices]
+
+
+def sweep_k(label_matrix, ks):
+    """Yield ``(k, labels of the k nearest neighbours)`` for every k in ``ks``."""
+    for k in ks:
+        yield k, label_matrix[:, :k]
+
+
+def feature_nbytes(X):
+    """Bytes taken by a dense, sparse or quantized feature matrix."""
+    if sp.issparse(X):
+        X = sp.csr_matrix(X)
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    if isinstance(X, QuantizedMatrix):
+        return X.nbytes
+    return np.asarray(X).nbytes
+
+
+def compare_dtypes(make_model, train_tweets, train_labels, test_tweets, test_labels, dtypes):
+    """Fit and score one model per storage dtype, against the first one.
+
+    ``make_model(dtype)`` returns an unfitted classifier; ``dtypes`` should
+    start with the baseline, e.g. ``model_class.dtypes``. Returns one dict
+    per dtype with the bytes of the training rows, the accuracy and macro
+    F1, their change from the baseline and the fraction of test
+    predictions that agree with the baseline's.
+    """
+    report = []
+    for dtype in dtypes:
+        model = make_model(dtype).fit(train_tweets, train_labels)
+        predicted = model.predict(test_tweets)
+        classes, gold = encode_labels(test_labels, model.classes)
+        scores = macro_scores(confusion_counts(gold, encode_labels(predicted, classes)[1], len(classes)))
+        if not report:
+            baseline, baseline_predicted = scores, predicted
+        report.append({"dtype": dtype, "nbytes": feature_nbytes(model.X),
+                       "accuracy": float(scores["accuracy"]), "f1": float(scores["f1"]),
+                       "accuracy_change": float(scores["accuracy"] - baseline["accuracy"]),
+                       "f1_change": float(scores["f1"] - baseline["f1"]),
+                       "agreement": float(np.mean(predicted == baseline_predicted))})
+    return report
@@ -0,0 +1,231 @@
+"""Bag-of-words, TF-IDF and hashed feature extraction on sparse CSR matrices.
+
+TF-IDF rows are word counts times the smoothed inverse document frequency
+of every word (``idf_weights``), scaled to unit L2 norm. The document
+frequencies come from the ``Vocabulary`` pass, so fitting needs no extra
+pass over the tweets, and the cosine distance of two unit rows is simply
+``1 - q . x``.
+
+``hash_matrix`` needs no vocabulary at all: words are mapped to a fixed
+number of columns by their crc32 hash, so memory does not grow with the
+corpus and words never seen in training still count.
+"""
+
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+from . import instrument
+from .distance import row_norms_sq
+
+WORD_RE = re.compile(r"\w+")
+DEFAULT_BUCKETS = 2 ** 18
+
+
+class Vocabulary:
+    """Word -> column id mapping, built by counting the words in one pass.
+
+    Words are found the same way as ``train_unique`` in the scripts
+    (``\\w+`` matches). ``fit`` counts every word and the number of tweets
+    it occurs in with a ``Counter`` -- linear in the corpus size -- then
+    keeps the words seen at least ``min_count`` times, at most ``max_size``
+    of them. Ids are ordered by decreasing count, then alphabetically, so
+    they are the same on every run and ``max_size`` keeps the most frequent
+    words.
+
+    ``update`` counts more tweets without changing existing ids: words that
+    now qualify get the next ids. Lookups work like a dict
+    (``vocabulary[word]``, ``word in vocabulary``, ``len``, iteration in
+    id order).
+    """
+
+    def __init__(self, min_count=1, max_size=None):
+        self.min_count = min_count
+        self.max_size = max_size
+        self.ids = {}
+        self.tokens = []
+        self.n_docs = 0
+        self._counts = Counter()
+        self._doc_freq = Counter()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __contains__(self, word):
+        return word in self.ids
+
+    def __getitem__(self, word):
+        return self.ids[word]
+
+    def get(self, word, default=None):
+        return self.ids.get(word, default)
+
+    @property
+    def counts(self):
+        """Number of occurrences of every word, by id."""
+        return np.array([self._counts[t] for t in self.tokens], dtype=np.int64)
+
+    @property
+    def document_frequencies(self):
+        """Number of tweets containing every word, by id (out of ``n_docs``)."""
+        return self.document_frequencies_from(0)
+
+    def document_frequencies_from(self, start):
+        """``document_frequencies[start:]``, without looking up the words before ``start``."""
+        return np.array([self._doc_freq[t] for t in self.tokens[start:]], dtype=np.int64)
+
+    def _count(self, tweets):
+        # Returns the set of words seen in these tweets.
+        counts, doc_freq = self._counts, self._doc_freq
+        seen = set()
+        for sentence in tweets:
+            words = WORD_RE.findall(sentence)
+            counts.update(words)
+            unique = set(words)
+            doc_freq.update(unique)
+            seen |= unique
+            self.n_docs += 1
+        return seen
+
+    def _add(self, candidates):
+        new = sorted((t for t in candidates if t not in self.ids and self._counts[t] >= self.min_count),
+                     key=lambda t: (-self._counts[t], t))
+        if self.max_size is not None:
+            new = new[:max(self.max_size - len(self.tokens), 0)]
+        self.ids.update(zip(new, range(len(self.tokens), len(self.tokens) + len(new))))
+        self.tokens.extend(new)
+        return new
+
+    def fit(self, tweets):
+        self.ids, self.tokens, self.n_docs = {}, [], 0
+        self._counts, self._doc_freq = Counter(), Counter()
+        self._add(self._count(tweets))
+        return self
+
+    def update(self, tweets):
+        """Count more tweets; returns the words that got new ids."""
+        return self._add(self._count(tweets))
+
+    def to_state(self):
+        """Parameters, words and counts as a dict of arrays (pruned words included)."""
+        counted = list(self._counts)
+        return {"min_count": self.min_count, "max_size": -1 if self.max_size is None else self.max_size,
+                "n_docs": self.n_docs, "tokens": np.array(self.tokens, dtype=str),
+                "counted": np.array(counted, dtype=str),
+                "counts": np.array([self._counts[t] for t in counted], dtype=np.int64),
+                "doc_freq": np.array([self._doc_freq[t] for t in counted], dtype=np.int64)}
+
+    @classmethod
+    def from_state(cls, state):
+        max_size = int(state["max_size"])
+        vocabulary = cls(int(state["min_count"]), None if max_size < 0 else max_size)
+        vocabulary.n_docs = int(state["n_docs"])
+        vocabulary.tokens = state["tokens"].tolist()
+        vocabulary.ids = {t: i for i, t in enumerate(vocabulary.tokens)}
+        counted = state["counted"].tolist()
+        vocabulary._counts = Counter(dict(zip(counted, state["counts"].tolist())))
+        vocabulary._doc_freq = Counter(dict(zip(counted, state["doc_freq"].tolist())))
+        return vocabulary
+
+
+@instrument.timed("features.bow", items=lambda matrix: matrix.shape[0])
+def bow_matrix(tweets, vocabulary, dtype=np.float64):
+    """Build a CSR matrix of word counts in one pass over the tokens.
+
+    Row i holds, for every vocabulary word, how many times it appears in
+    ``tweets[i].split()`` -- the same values the old ``word.count(w)`` loop
+    produced. Words outside ``vocabulary`` (a ``Vocabulary`` or a plain
+    word -> column dict) are ignored, so the training vocabulary can be
+    reused for the test set and live traffic. ``dtype`` can be a compact
+    integer type (uint8, uint16); a count that does not fit raises a
+    ``ValueError`` instead of wrapping around.
+    """
+    lookup = vocabulary.ids.get if isinstance(vocabulary, Vocabulary) else vocabulary.get
+    indptr = [0]
+    indices = []
+    for sentence in tweets:
+        for w in sentence.split():
+            col = lookup(w)
+            if col is not None:
+                indices.append(col)
+        indptr.append(len(indices))
+
+    indices = np.asarray(indices, dtype=np.int32)
+    dtype = np.dtype(dtype)
+    # Small integer types are summed in int32 and narrowed afterwards.
+    count_dtype = np.int32 if dtype.kind in "iu" and dtype.itemsize < 4 else dtype
+    data = np.ones(len(indices), dtype=count_dtype)
+    matrix = sp.csr_matrix((data, indices, np.asarray(indptr, dtype=np.int64)),
+                           shape=(len(indptr) - 1, len(vocabulary)))
+    matrix.sum_duplicates()  # Repeated words collapse into a single count
+    if count_dtype != dtype:
+        if matrix.nnz and matrix.data.max() > np.iinfo(dtype).max:
+            raise ValueError("A word count of {} does not fit in {}".format(matrix.data.max(), dtype))
+        matrix.data = matrix.data.astype(dtype)
+    return matrix
+
+
+def idf_weights(document_frequencies, n_docs):
+    """Smoothed inverse document frequencies, ``log((1 + n_docs) / (1 + df)) + 1``.
+
+    The same weights as scikit-learn's ``TfidfTransformer``: a word that
+    occurs in every tweet still gets weight 1 rather than 0.
+    """
+    df = np.asarray(document_frequencies, dtype=np.float64)
+    return np.log((1 + n_docs) / (1 + df)) + 1
+
+
+def normalize_rows(X):
+    """Scale the rows of a sparse matrix to unit L2 norm, in place; all-zero rows stay zero."""
+    norms = np.sqrt(row_norms_sq(X))
+    norms[norms == 0] = 1
+    X.data /= np.repeat(norms, np.diff(X.indptr)).astype(X.dtype)
+    return X
+
+
+@instrument.timed("features.tfidf", items=lambda matrix: matrix.shape[0])
+def tfidf_matrix(tweets, vocabulary, idf, dtype=np.float64):
+    """CSR matrix of L2-normalized TF-IDF rows, with the columns of ``vocabulary``.
+
+    ``idf`` holds one weight per vocabulary word, e.g. ``idf_weights`` of
+    the training ``Vocabulary``'s document frequencies. Like
+    ``bow_matrix``, words outside the vocabulary are ignored; a tweet
+    without any known word gets an all-zero row. ``dtype`` is float64 or
+    float32.
+    """
+    matrix = bow_matrix(tweets, vocabulary)
+    matrix.data *= np.asarray(idf, dtype=np.float64)[matrix.indices]
+    return normalize_rows(matrix.astype(dtype))
+
+
+@instrument.timed("features.hash", items=lambda matrix: matrix.shape[0])
+def hash_matrix(tweets, n_buckets=DEFAULT_BUCKETS, signed=True, dtype=np.float64):
+    """CSR matrix of hashed word counts with ``n_buckets`` columns, built without a vocabulary.
+
+    Every word of ``tweet.split()`` adds to column ``crc32(word) % n_buckets``.
+    With ``signed`` it adds -1 instead of 1 when bit 31 of the hash is set,
+    so words sharing a bucket cancel out on average instead of piling up.
+    crc32 gives the same columns in every process and on every run (unlike
+    ``hash``), so tweets can be featurized anywhere without fitting
+    anything first.
+    """
+    if not 1 <= n_buckets <= 2 ** 31:
+        raise ValueError("Expected 1 <= n_buckets <= 2**31, got {}".format(n_buckets))
+    indptr = [0]
+    hashes = []
+    for sentence in tweets:
+        hashes.extend(zlib.crc32(w.encode("utf-8")) for w in sentence.split())
+        indptr.append(len(hashes))
+    hashes = np.asarray(hashes, dtype=np.uint32)
+    data = np.where(hashes >> 31, -1, 1) if signed else np.ones(len(hashes))
+    matrix = sp.csr_matrix((data.astype(dtype), (hashes % n_buckets).astype(np.int32),
+                            np.asarray(indptr, dtype=np.int64)), shape=(len(indptr) - 1, n_buckets))
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()  # Words of opposite signs can cancel out
+    return matrix
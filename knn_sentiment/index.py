@@ -0,0 +1,659 @@
+"""Nearest-neighbour indexes over tweet feature matrices.
+
+Every index has the same small interface:
+
+* ``build(X)`` -- index the training rows, returns the index,
+* ``query(Q, k)`` -- ``(distances, indices)`` of the k nearest rows per query,
+* ``save(path)`` / ``NeighbourIndex.load(path)`` -- one ``.npz`` file.
+
+``BruteForceIndex`` is exact. ``InvertedIndex`` is also exact, for sparse
+BoW matrices: it only scores training rows that share a word with the
+query. ``IVFIndex`` is an approximate inverted-file index over dense
+embeddings: training rows are grouped around k-means centroids and a query only
+scans the rows of its ``n_probe`` nearest groups. With ``pq_subspaces`` the
+rows are also product-quantized to one byte per subspace and distances are
+computed from lookup tables. ``recall_at_k`` and ``compare_indexes`` measure
+what that costs in accuracy against the exact backend. ``IncrementalIndex``
+wraps an exact index so rows can be added and removed without a full
+rebuild every time.
+"""
+
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from . import instrument
+from .buffers import QuantizedRowBuffer, RowBuffer, SparseRowBuffer
+from .distance import METRICS, as_rows, pairwise_distances, row_norms_sq, sparse_dot
+from .quantization import QuantizedMatrix
+from .search import DEFAULT_CHUNK_SIZE, check_k, kneighbors, top_k
+
+INDEX_TYPES = {}
+
+
+def _register(cls):
+    INDEX_TYPES[cls.kind] = cls
+    return cls
+
+
+class NeighbourIndex:
+    """Base class of the indexes; subclasses set ``kind`` and implement the methods."""
+
+    kind = None
+
+    def build(self, X):
+        raise NotImplementedError
+
+    def query(self, Q, k):
+        raise NotImplementedError
+
+    def resize_features(self, n_features):
+        """Accept queries with more feature columns (e.g. a grown BoW vocabulary).
+
+        The new columns are zero in every indexed row.
+        """
+        raise NotImplementedError("{} cannot add feature columns".format(type(self).__name__))
+
+    def _state(self):
+        # Arrays and parameters that are written by save().
+        raise NotImplementedError
+
+    def _restore(self, state):
+        raise NotImplementedError
+
+    def to_state(self):
+        """Parameters and arrays of the built index, as a dict of arrays."""
+        return dict(kind=self.kind, **self._state())
+
+    @staticmethod
+    def from_state(state):
+        """Rebuild an index from ``to_state``, whatever its type."""
+        cls = INDEX_TYPES[str(state["kind"])]
+        index = cls.__new__(cls)
+        index._restore(state)
+        return index
+
+    def save(self, path):
+        np.savez(path, **self.to_state())
+
+    @staticmethod
+    def load(path):
+        """Load an index written by ``save``, whatever its type."""
+        with np.load(path, allow_pickle=False) as data:
+            return NeighbourIndex.from_state({name: data[name] for name in data.files})
+
+
+def _widen(X, n_features):
+    # The same CSR rows with more (all-zero) columns; no data is copied.
+    X = sp.csr_matrix(X)
+    return sp.csr_matrix((X.data, X.indices, X.indptr), shape=(X.shape[0], n_features))
+
+
+@_register
+class BruteForceIndex(NeighbourIndex):
+    """Exact search: every query is compared with every training row.
+
+    The rows are kept as given: dense float32 or float64, sparse, or a
+    ``QuantizedMatrix``.
+    """
+
+    kind = "brute"
+
+    def __init__(self, metric="euclidean", chunk_size=DEFAULT_CHUNK_SIZE):
+        if metric not in METRICS:
+            raise ValueError("Unsupported metric {!r}, expected one of {}".format(metric, METRICS))
+        self.metric = metric
+        self.chunk_size = chunk_size
+        self.X = None
+        self.norms = None
+
+    def build(self, X):
+        self.X = as_rows(X)
+        self.norms = row_norms_sq(self.X)
+        return self
+
+    def query(self, Q, k):
+        return kneighbors(Q, self.X, k, metric=self.metric,
+                          chunk_size=self.chunk_size, X_norms=self.norms)
+
+    def resize_features(self, n_features):
+        if not sp.issparse(self.X):
+            raise ValueError("Dense rows cannot add feature columns")
+        self.X = _widen(self.X, n_features)
+
+    def _state(self):
+        state = {"metric": self.metric, "chunk_size": self.chunk_size, "norms": self.norms}
+        if sp.issparse(self.X):
+            X = sp.csr_matrix(self.X)
+            state.update(data=X.data, indices=X.indices, indptr=X.indptr, shape=np.array(X.shape))
+        elif isinstance(self.X, QuantizedMatrix):
+            state.update(codes=self.X.codes, scales=self.X.scales)
+        else:
+            state["X"] = self.X
+        return state
+
+    def _restore(self, state):
+        self.metric = str(state["metric"])
+        self.chunk_size = int(state["chunk_size"])
+        if "X" in state:
+            X = state["X"]
+        elif "codes" in state:
+            X = QuantizedMatrix(state["codes"], state["scales"])
+        else:
+            X = sp.csr_matrix((state["data"], state["indices"], state["indptr"]),
+                              shape=tuple(state["shape"]))
+        self.X = X
+        self.norms = state["norms"]
+
+
+@_register
+class InvertedIndex(NeighbourIndex):
+    """Exact search over sparse BoW rows using posting lists.
+
+    Tweets are short, so a query shares words with few training tweets.
+    Dot products are computed only for those candidates by multiplying the
+    query with the posting lists (word -> training rows). Every other row
+    has a dot product of 0, so its distance follows from the norms alone:
+    ``||q||^2 + ||x||^2`` for euclidean and exactly 1 for cosine. The best
+    of those come from the training rows sorted by norm once at build time.
+    Results equal ``BruteForceIndex``; tied distances are ordered by index.
+    The rows and posting lists keep the dtype of ``X``, so integer counts
+    (uint8, uint16) are stored compactly, and queries only widen the posting
+    lists of their own words (see ``sparse_dot``).
+
+    ``unit_norm=True`` promises that the training and query rows have unit
+    L2 norm (or are all zero), like TF-IDF rows; the cosine distance of a
+    candidate is then ``1 - q . x``, with no norm terms.
+    """
+
+    kind = "inverted"
+    metrics = ("euclidean", "cosine")
+
+    def __init__(self, metric="euclidean", chunk_size=DEFAULT_CHUNK_SIZE, unit_norm=False):
+        if metric not in self.metrics:
+            raise ValueError("Unsupported metric {!r}, expected one of {}".format(metric, self.metrics))
+        self.metric = metric
+        self.chunk_size = chunk_size
+        self.unit_norm = unit_norm
+
+    def build(self, X):
+        self.X = sp.csr_matrix(X)
+        self.norms = row_norms_sq(self.X)
+        self.postings = self.X.T.tocsr()  # Row w lists the training rows containing word w
+        self.norm_order = np.argsort(self.norms, kind="stable")
+        return self
+
+    @instrument.timed("search.inverted", items=lambda result: len(result[0]))
+    def query(self, Q, k):
+        check_k(k)
+        Q = sp.csr_matrix(Q, dtype=np.float64)
+        k = min(k, self.X.shape[0])
+        q_norms = row_norms_sq(Q)
+        distances = np.empty((Q.shape[0], k), dtype=np.float64)
+        indices = np.empty((Q.shape[0], k), dtype=np.intp)
+        is_candidate = np.zeros(self.X.shape[0], dtype=bool)
+        for start in range(0, Q.shape[0], self.chunk_size):
+            dots = sparse_dot(Q[start:start + self.chunk_size], self.postings)
+            for row in range(dots.shape[0]):
+                lo, hi = dots.indptr[row], dots.indptr[row + 1]
+                cand = dots.indices[lo:hi]
+                is_candidate[cand] = True
+                d, i = self._row(q_norms[start + row], cand, dots.data[lo:hi], k, is_candidate)
+                is_candidate[cand] = False
+                distances[start + row], indices[start + row] = d, i
+        return distances, indices
+
+    def resize_features(self, n_features):
+        self.X = _widen(self.X, n_features)
+        # New words have empty posting lists.
+        extra = n_features - self.postings.shape[0]
+        indptr = np.concatenate((self.postings.indptr, np.full(extra, self.postings.indptr[-1])))
+        self.postings = sp.csr_matrix((self.postings.data, self.postings.indices, indptr),
+                                      shape=(n_features, self.postings.shape[1]))
+
+    def _row(self, q_norm, cand, dots, k, is_candidate):
+        # The k best rows without a shared word: at most len(cand) of the
+        # first k + len(cand) rows (by norm, or by index for cosine) are candidates.
+        if self.metric == "euclidean":
+            cand_dists = q_norm + self.norms[cand] - 2 * dots
+            pool = self.norm_order[:k + len(cand)]
+            pool = pool[~is_candidate[pool]][:k]
+            pool_dists = q_norm + self.norms[pool]
+        else:
+            cand_dists = 1 - (dots if self.unit_norm else dots / (np.sqrt(q_norm) * np.sqrt(self.norms[cand])))
+            pool = np.arange(min(k + len(cand), len(self.norms)))
+            pool = pool[~is_candidate[pool]][:k]
+            pool_dists = np.ones(len(pool))
+        all_dists = np.concatenate((cand_dists, pool_dists))
+        all_ids = np.concatenate((cand, pool))
+        if len(all_dists) > k:
+            # Keep everything below the k-th distance, then the lowest ids among its ties.
+            kth = np.partition(all_dists, k - 1)[k - 1]
+            below = np.flatnonzero(all_dists < kth)
+            tied = np.flatnonzero(all_dists == kth)
+            tied = tied[np.argsort(all_ids[tied], kind="stable")[:k - len(below)]]
+            keep = np.concatenate((below, tied))
+            all_dists, all_ids = all_dists[keep], all_ids[keep]
+        best = np.lexsort((all_ids, all_dists))
+        if self.metric == "euclidean":
+            return np.sqrt(np.maximum(all_dists[best], 0)), all_ids[best]
+        return np.clip(all_dists[best], 0, 2), all_ids[best]
+
+    def _state(self):
+        # The derived arrays are saved too, so restoring (e.g. from memory-mapped
+        # files in every worker process) does not compute a private copy of them.
+        return {"metric": self.metric, "chunk_size": self.chunk_size, "unit_norm": self.unit_norm,
+                "data": self.X.data,
+                "indices": self.X.indices, "indptr": self.X.indptr, "shape": np.array(self.X.shape),
+                "norms": self.norms, "norm_order": self.norm_order, "postings_data": self.postings.data,
+                "postings_indices": self.postings.indices, "postings_indptr": self.postings.indptr}
+
+    def _restore(self, state):
+        self.metric = str(state["metric"])
+        self.chunk_size = int(state["chunk_size"])
+        self.unit_norm = bool(state.get("unit_norm", False))
+        shape = tuple(state["shape"])
+        self.X = sp.csr_matrix((state["data"], state["indices"], state["indptr"]), shape=shape)
+        self.norms = state["norms"]
+        self.norm_order = state["norm_order"]
+        self.postings = sp.csr_matrix((state["postings_data"], state["postings_indices"],
+                                       state["postings_indptr"]), shape=shape[::-1])
+
+
+def kmeans(X, n_clusters, n_iter=10, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lloyd's k-means on the rows of ``X``; returns ``(centroids, assignment)``."""
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    n_clusters = min(n_clusters, len(X))
+    centroids = X[rng.choice(len(X), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = _nearest(X, centroids, chunk_size)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        members = sp.csr_matrix((np.ones(len(X), dtype=np.float32), (assignment, np.arange(len(X)))),
+                                shape=(n_clusters, len(X)))
+        sums = members @ X
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Empty clusters restart from random rows.
+        centroids[empty] = X[rng.choice(len(X), empty.sum())]
+    return centroids, _nearest(X, centroids, chunk_size)
+
+
+def _nearest(X, centroids, chunk_size):
+    centroid_norms = row_norms_sq(centroids)
+    nearest = np.empty(len(X), dtype=np.intp)
+    for start in range(0, len(X), chunk_size):
+        block = X[start:start + chunk_size]
+        nearest[start:start + len(block)] = pairwise_distances(
+            block, centroids, B_norms=centroid_norms).argmin(axis=1)
+    return nearest
+
+
+def _normalize(X):
+    X = np.array(X, dtype=np.float32)
+    norms = np.sqrt(row_norms_sq(X))
+    norms[norms == 0] = 1
+    X /= norms[:, None].astype(np.float32)
+    return X
+
+
+@_register
+class IVFIndex(NeighbourIndex):
+    """Approximate inverted-file index, optionally with product quantization.
+
+    ``n_lists`` k-means groups are built at ``build`` time; ``query`` scans
+    the ``n_probe`` groups nearest to each query. Raising ``n_probe`` trades
+    speed for recall. With ``pq_subspaces=m`` every row is stored as m bytes
+    (the residual from its group centroid, quantized per subspace of
+    ``dim / m`` values, so m must divide ``dim``) instead of ``dim`` floats. Cosine distance is
+    handled by indexing L2-normalized rows.
+
+    The rows are also kept as given in ``X``, like ``BruteForceIndex``, so
+    ``IncrementalIndex`` can rebuild over them. A query whose probed groups
+    hold fewer than k rows probes twice as many groups until they do.
+    """
+
+    kind = "ivf"
+    metrics = ("euclidean", "cosine")
+
+    def __init__(self, n_lists=256, n_probe=8, pq_subspaces=None, metric="euclidean",
+                 n_iter=10, seed=0):
+        if metric not in self.metrics:
+            raise ValueError("Unsupported metric {!r}, expected one of {}".format(metric, self.metrics))
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.pq_subspaces = pq_subspaces
+        self.metric = metric
+        self.n_iter = n_iter
+        self.seed = seed
+        self.X = None
+
+    def _prepare(self, X):
+        if self.metric == "cosine":
+            return _normalize(X)
+        return np.asarray(X, dtype=np.float32)
+
+    def build(self, X):
+        self.X = as_rows(X)
+        X = self._prepare(self.X)
+        self.centroids, _ = kmeans(self._sample(X, self.n_lists), self.n_lists, self.n_iter, self.seed)
+        assignment = _nearest(X, self.centroids, DEFAULT_CHUNK_SIZE)
+
+        # Rows are stored grouped by list; list i is ids[offsets[i]:offsets[i + 1]].
+        self.ids = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))))
+        X = X[self.ids]
+        if self.pq_subspaces:
+            residuals = X - self.centroids[assignment[self.ids]]
+            self._train_pq(residuals)
+            self.vectors = None
+        else:
+            self.vectors = X
+            self.vector_norms = row_norms_sq(X)
+        return self
+
+    def _sample(self, X, n_clusters):
+        # k-means only needs a sample of the rows; 64 rows per cluster is plenty.
+        if len(X) <= 64 * n_clusters:
+            return X
+        rng = np.random.default_rng(self.seed)
+        return X[np.sort(rng.choice(len(X), 64 * n_clusters, replace=False))]
+
+    def _split(self, X):
+        # (n, dim) -> (n, m, dim / m)
+        return X.reshape(len(X), self.pq_subspaces, -1)
+
+    def _train_pq(self, residuals):
+        if residuals.shape[1] % self.pq_subspaces:
+            raise ValueError("pq_subspaces={} does not divide the {} dimensions".format(
+                self.pq_subspaces, residuals.shape[1]))
+        codebooks = []
+        codes = []
+        for i in range(self.pq_subspaces):
+            part = np.ascontiguousarray(self._split(residuals)[:, i])
+            codebook, _ = kmeans(self._sample(part, 256), 256, self.n_iter, self.seed + i)
+            codebooks.append(codebook)
+            codes.append(_nearest(part, codebook, DEFAULT_CHUNK_SIZE).astype(np.uint8))
+        self.codebooks = np.stack(codebooks)  # (m, 256, dim / m)
+        self.codebook_norms = np.einsum("mcd,mcd->mc", self.codebooks, self.codebooks)
+        self.codes = np.stack(codes, axis=1)
+
+    @instrument.timed("search.ivf", items=lambda result: len(result[0]))
+    def query(self, Q, k):
+        check_k(k)
+        Q = self._prepare(Q)
+        k = min(k, len(self.ids))
+        distances = np.empty((len(Q), k))
+        indices = np.empty((len(Q), k), dtype=np.intp)
+        for start in range(0, len(Q), DEFAULT_CHUNK_SIZE):
+            block = Q[start:start + DEFAULT_CHUNK_SIZE]
+            lists = np.argsort(pairwise_distances(block, self.centroids), axis=1, kind="stable")
+            n_probe = min(self.n_probe, len(self.centroids))
+            dists, positions, found = self._search(block, lists[:, :n_probe], k)
+            # Queries whose probed lists hold fewer than k rows probe twice as many lists.
+            short = np.flatnonzero(found < k)
+            while len(short):
+                n_probe = min(2 * n_probe, len(self.centroids))
+                dists[short], positions[short], found = self._search(block[short], lists[short, :n_probe], k)
+                short = short[found < k]
+            distances[start:start + len(block)] = dists
+            indices[start:start + len(block)] = self.ids[positions]
+        np.maximum(distances, 0, out=distances)
+        if self.metric == "cosine":
+            return distances / 2, indices  # ||a - b||^2 = 2 - 2 cos(a, b) for unit rows
+        return np.sqrt(distances), indices
+
+    def _search(self, Q, probes, k):
+        # Squared distances and storage positions of the k best rows of the
+        # probed lists of every query, and how many rows those lists hold.
+        # Every list is scored once, against all the queries probing it.
+        sizes = np.diff(self.offsets)[probes]
+        found = sizes.sum(axis=1)
+        starts = (np.cumsum(sizes, axis=1) - sizes).ravel()  # Column of every probed list in a query's row
+        dists = np.full((len(Q), max(found.max(), k)), np.inf)
+        positions = np.zeros(dists.shape, dtype=np.intp)
+        q_norms = row_norms_sq(Q)
+        flat = probes.ravel()
+        order = np.argsort(flat, kind="stable")
+        bounds = np.searchsorted(flat[order], np.arange(len(self.centroids) + 1))
+        for i in np.unique(flat):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            if lo == hi:
+                continue
+            pairs = order[bounds[i]:bounds[i + 1]]
+            rows = pairs // probes.shape[1]
+            columns = starts[pairs][:, None] + np.arange(hi - lo)
+            dists[rows[:, None], columns] = self._list_distances(Q[rows], q_norms[rows], i)
+            positions[rows[:, None], columns] = np.arange(lo, hi)
+        best_dists, best = top_k(dists, k)
+        return best_dists, np.take_along_axis(positions, best, axis=1), found
+
+    def _list_distances(self, Q, q_norms, i):
+        # Squared distances from the queries to the rows of list i, which are
+        # stored contiguously, so this is one matrix product over a slice.
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        if not self.pq_subspaces:
+            return q_norms[:, None] + self.vector_norms[None, lo:hi] - 2 * (Q @ self.vectors[lo:hi].T)
+        # Lookup tables of squared distances between every query's residual
+        # and every codeword: tables[j, q, c] for subspace j.
+        residuals = self._split(Q - self.centroids[i]).transpose(1, 0, 2)  # (m, n_queries, dim / m)
+        tables = (np.einsum("mqd,mqd->mq", residuals, residuals)[:, :, None]
+                  - 2 * (residuals @ self.codebooks.transpose(0, 2, 1))
+                  + self.codebook_norms[:, None, :])
+        codes = self.codes[lo:hi]
+        out = np.zeros((len(Q), hi - lo), dtype=tables.dtype)
+        for j in range(self.pq_subspaces):
+            out += tables[j][:, codes[:, j]]
+        return out
+
+    def _state(self):
+        state = {"n_lists": self.n_lists, "n_probe": self.n_probe, "pq_subspaces": self.pq_subspaces or 0,
+                 "metric": self.metric, "n_iter": self.n_iter, "seed": self.seed,
+                 "centroids": self.centroids, "ids": self.ids, "offsets": self.offsets}
+        if isinstance(self.X, QuantizedMatrix):
+            state.update(X_codes=self.X.codes, X_scales=self.X.scales)
+        else:
+            state["X"] = self.X
+        if self.pq_subspaces:
+            state["codes"] = self.codes
+            state["codebooks"] = self.codebooks
+        return state
+
+    def _restore(self, state):
+        self.n_lists = int(state["n_lists"])
+        self.n_probe = int(state["n_probe"])
+        self.pq_subspaces = int(state["pq_subspaces"]) or None
+        self.metric = str(state["metric"])
+        self.n_iter = int(state["n_iter"])
+        self.seed = int(state["seed"])
+        self.centroids = state["centroids"]
+        self.ids = state["ids"]
+        self.offsets = state["offsets"]
+        self.X = QuantizedMatrix(state["X_codes"], state["X_scales"]) if "X_codes" in state else state["X"]
+        if self.pq_subspaces:
+            self.codes = state["codes"]
+            self.codebooks = state["codebooks"]
+            self.codebook_norms = np.einsum("mcd,mcd->mc", self.codebooks, self.codebooks)
+            self.vectors = None
+        else:
+            # The list-ordered copy is not saved; it follows from X.
+            self.vectors = self._prepare(self.X)[self.ids]
+            self.vector_norms = row_norms_sq(self.vectors)
+
+
+@_register
+class IncrementalIndex(NeighbourIndex):
+    """Lets rows be added to and removed from another index without rebuilding it each time.
+
+    ``main`` is an unbuilt index that keeps its rows in ``X``
+    (``BruteForceIndex``, ``InvertedIndex`` or ``IVFIndex``, whose results
+    stay approximate for the rows in ``main``). Added rows go to a tail,
+    which lives in growable buffers and is searched by brute force. ``main``
+    is rebuilt over all rows only once the tail holds more than
+    ``rebuild_fraction`` of the rows in ``main``, so adding rows costs
+    amortized O(1) rebuild work per row. Removed rows are tombstoned: they
+    keep their position but are never returned, and ``compact`` drops them.
+    Positions count every row, in the order it was added.
+    """
+
+    kind = "incremental"
+
+    def __init__(self, main, rebuild_fraction=0.25):
+        self.main = main
+        self.rebuild_fraction = rebuild_fraction
+
+    def build(self, X):
+        self.main.build(X)
+        self.n_main = X.shape[0]
+        self._reset_tail()
+        self._deleted = RowBuffer(np.zeros(self.n_main, dtype=bool))
+        self.n_deleted = self.n_deleted_main = 0
+        return self
+
+    def _reset_tail(self):
+        X = self.main.X
+        self.sparse = sp.issparse(X)
+        self.quantized = isinstance(X, QuantizedMatrix)
+        if self.sparse:
+            self._tail = SparseRowBuffer(X.shape[1], dtype=X.dtype)
+        elif self.quantized:
+            self._tail = QuantizedRowBuffer(X.shape[1])
+        else:
+            self._tail = RowBuffer(np.empty((0,) + X.shape[1:], dtype=X.dtype))
+        self._tail_norms = RowBuffer(np.empty(0))
+
+    @property
+    def n_rows(self):
+        return self.n_main + len(self._tail)
+
+    @property
+    def deleted(self):
+        """Boolean mask of the removed rows, by position."""
+        return self._deleted.view
+
+    def _tail_rows(self):
+        return self._tail.matrix if self.sparse else self._tail.view
+
+    @property
+    def X(self):
+        """All rows, removed ones included, in position order."""
+        if not len(self._tail):
+            return self.main.X
+        if self.sparse:
+            tail = self._tail.matrix
+            return sp.vstack([_widen(self.main.X, tail.shape[1]), tail], format="csr")
+        if self.quantized:
+            return QuantizedMatrix.concatenate((self.main.X, self._tail.view))
+        return np.concatenate((self.main.X, self._tail.view))
+
+    def add(self, X):
+        """Index new rows after the existing ones; returns their positions."""
+        start = self.n_rows
+        if self.sparse and X.shape[1] > self.main.X.shape[1]:
+            self.main.resize_features(X.shape[1])
+        self._tail.extend(X)
+        self._tail_norms.extend(row_norms_sq(X))
+        self._deleted.extend(np.zeros(X.shape[0], dtype=bool))
+        if len(self._tail) > self.rebuild_fraction * self.n_main:
+            self.main.build(self.X)
+            self.n_main = self.main.X.shape[0]
+            self.n_deleted_main = self.n_deleted
+            self._reset_tail()
+        return np.arange(start, self.n_rows)
+
+    def remove(self, positions):
+        """Tombstone rows by position; already removed rows are ignored."""
+        positions = np.unique(np.asarray(positions, dtype=np.intp))
+        positions = positions[~self._deleted.view[positions]]
+        self._deleted.view[positions] = True
+        self.n_deleted += len(positions)
+        self.n_deleted_main += int((positions < self.n_main).sum())
+
+    def compact(self):
+        """Drop the removed rows and rebuild; returns the boolean mask of the kept rows."""
+        keep = ~self._deleted.view
+        self.build(self.X[keep])
+        return keep
+
+    def query(self, Q, k):
+        check_k(k)
+        k = min(k, self.n_rows - self.n_deleted)
+        if self.sparse:
+            Q = sp.csr_matrix(Q)
+            if Q.shape[1] < self.main.X.shape[1]:
+                Q = _widen(Q, self.main.X.shape[1])
+        if k <= 0:
+            return np.empty((Q.shape[0], 0)), np.empty((Q.shape[0], 0), dtype=np.intp)
+        deleted = self._deleted.view
+        # Ask main for extra neighbours to make up for the removed ones among them.
+        distances, indices = self.main.query(Q, min(k + self.n_deleted_main, self.n_main))
+        if self.n_deleted_main:
+            distances = np.where(deleted[indices], np.inf, distances)
+        if len(self._tail):
+            tail_dists, tail_indices = kneighbors(Q, self._tail_rows(), k, metric=self.main.metric,
+                                                  X_norms=self._tail_norms.view, exclude=deleted[self.n_main:])
+            distances = np.concatenate((distances, tail_dists), axis=1)
+            indices = np.concatenate((indices, tail_indices + self.n_main), axis=1)
+        if distances.shape[1] == k:
+            return distances, indices
+        # Both parts are sorted by (distance, position) and main's positions come
+        # first, so ordering ties by column keeps them ordered by position.
+        distances, order = top_k(distances, k)
+        return distances, np.take_along_axis(indices, order, axis=1)
+
+    def _state(self):
+        state = {"rebuild_fraction": self.rebuild_fraction, "n_main": self.n_main,
+                 "deleted": self._deleted.view, "tail_norms": self._tail_norms.view}
+        if self.sparse:
+            tail = self._tail.matrix
+            state.update(tail_data=tail.data, tail_indices=tail.indices, tail_indptr=tail.indptr,
+                         tail_shape=np.array(tail.shape))
+        elif self.quantized:
+            state.update(tail_codes=self._tail.view.codes, tail_scales=self._tail.view.scales)
+        else:
+            state["tail_X"] = self._tail.view
+        state.update(("main." + name, value) for name, value in self.main.to_state().items())
+        return state
+
+    def _restore(self, state):
+        self.rebuild_fraction = float(state["rebuild_fraction"])
+        self.main = NeighbourIndex.from_state({name[len("main."):]: value for name, value in state.items()
+                                               if name.startswith("main.")})
+        self.n_main = int(state["n_main"])
+        self._reset_tail()
+        if self.sparse:
+            self._tail.extend(sp.csr_matrix((state["tail_data"], state["tail_indices"], state["tail_indptr"]),
+                                            shape=tuple(state["tail_shape"])))
+        elif self.quantized:
+            self._tail.extend(QuantizedMatrix(state["tail_codes"], state["tail_scales"]))
+        else:
+            self._tail.extend(state["tail_X"])
+        self._tail_norms.extend(state["tail_norms"])
+        self._deleted = RowBuffer(state["deleted"])
+        self.n_deleted = int(self._deleted.view.sum())
+        self.n_deleted_main = int(self._deleted.view[:self.n_main].sum())
+
+
+def recall_at_k(approx_indices, exact_indices):
+    """Fraction of the exact k nearest neighbours that the approximate search found."""
+    k = exact_indices.shape[1]
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx_indices, exact_indices))
+    return hits / (len(exact_indices) * k)
+
+
+def compare_indexes(index, reference, Q, k):
+    """Recall of ``index`` against ``reference`` and the query time of both.
+
+    Returns a dict with ``recall`` and ``ms_per_query`` / ``reference_ms_per_query``.
+    """
+    start = time.perf_counter()
+    _, approx = index.query(Q, k)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    _, exact = reference.query(Q, k)
+    reference_elapsed = time.perf_counter() - start
+    n = max(Q.shape[0], 1)
+    return {"recall": recall_at_k(approx, exact),
+            "ms_per_query": 1000 * elapsed / n,
+            "reference_ms_per_query": 1000 * reference_elapsed / n}
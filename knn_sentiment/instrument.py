@@ -0,0 +1,269 @@
+"""Per-stage counters, latency histograms and opt-in profiling.
+
+The pipeline stages (stopword removal, cleaning, feature extraction,
+distances, top-k, voting, ...) are wrapped with ``@timed(name)`` or
+``with stage(name, items):``. Instrumentation is off by default, and then
+both cost a single flag check per call; the wrapped functions work on
+whole batches, so that is nothing next to the work they do.
+
+``enable()`` turns recording on. Every stage then keeps its number of
+calls and items (tweets, queries, ...), the total and maximum time and a
+histogram of call latencies in power-of-two buckets of microseconds;
+``count(name)`` adds to plain counters. ``snapshot()`` returns all of it,
+with p50/p99 estimated from the histograms, and ``format_report`` turns
+that into a table.
+
+``profile(directory)`` also runs cProfile and tracemalloc and writes a
+report directory for the run: stages.json, profile.pstats, profile.txt
+(functions by cumulative time) and memory.txt (the peak traced memory and
+the biggest allocation sites still alive at the end of the run).
+
+Without changing any code, ``KNN_SENTIMENT_INSTRUMENT=1`` prints the stage
+table of a process to stderr when it exits and
+``KNN_SENTIMENT_PROFILE=DIR`` profiles the whole process into DIR. Stats
+are per process: ``ParallelScorer`` workers keep their own.
+"""
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+N_BUCKETS = 40  # Bucket b holds latencies in [2^(b-1), 2^b) microseconds; the last one everything above
+
+_enabled = False
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+
+
+class _StageStats:
+    __slots__ = ("calls", "items", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, seconds, items):
+        self.calls += 1
+        self.items += items
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[min(int(seconds * 1e6).bit_length(), N_BUCKETS - 1)] += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile, in seconds.
+        target = q * self.calls
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"calls": self.calls, "items": self.items, "total_s": round(self.total, 6),
+                "mean_ms": round(1000 * self.total / self.calls, 4) if self.calls else 0.0,
+                "p50_ms": round(1000 * self.quantile(0.5), 4), "p99_ms": round(1000 * self.quantile(0.99), 4),
+                "max_ms": round(1000 * self.max, 4),
+                "items_per_s": round(self.items / self.total, 1) if self.total else None,
+                "histogram_us": {str(2 ** b): n for b, n in enumerate(self.buckets) if n}}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def record(name, seconds, items=1):
+    """Add one call of ``seconds`` that processed ``items`` to stage ``name``."""
+    if not _enabled:
+        return
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = _StageStats()
+        stats.add(seconds, items)
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name``."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Stage:
+    __slots__ = ("name", "items", "start")
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start, self.items)
+        return False
+
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(name, items=1):
+    """Context manager timing a block as one call of stage ``name``."""
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, items)
+
+
+def timed(name, items=None):
+    """Decorator timing every call of a function as stage ``name``.
+
+    ``items`` is an optional function of the return value giving the
+    number of items processed (e.g. the rows of a matrix); by default
+    every call counts as one item.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            record(name, time.perf_counter() - start, 1 if items is None else items(result))
+            return result
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    """Stage stats and counters recorded so far, as a JSON-ready dict.
+
+    ``histogram_us`` maps the upper bound of every non-empty latency
+    bucket, in microseconds, to its number of calls.
+    """
+    with _lock:
+        return {"stages": {name: stats.to_dict() for name, stats in sorted(_stages.items())},
+                "counters": dict(sorted(_counters.items()))}
+
+
+def format_report(report=None):
+    """Table of the stage stats (and counters) of ``snapshot()``."""
+    report = snapshot() if report is None else report
+    lines = ["{:<22} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "stage", "calls", "items", "total s", "mean ms", "p50 ms", "p99 ms", "items/s")]
+    for name, s in report["stages"].items():
+        lines.append("{:<22} {:>8} {:>10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>12}".format(
+            name, s["calls"], s["items"], s["total_s"], s["mean_ms"], s["p50_ms"], s["p99_ms"],
+            "-" if s["items_per_s"] is None else "{:.0f}".format(s["items_per_s"])))
+    for name, value in report["counters"].items():
+        lines.append("{:<22} {:>8}".format(name, value))
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profile(directory, cpu=True, memory=True, top=40):
+    """Record stage stats, a cProfile profile and tracemalloc allocations for a block.
+
+    Yields the run's report directory, ``directory/run-<time>-<pid>``,
+    which is written when the block exits. Stage stats recorded before are
+    discarded, and recording is switched back off afterwards unless it was
+    already on.
+    """
+    run_dir = os.path.join(directory, "run-{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    was_enabled = _enabled
+    reset()
+    enable()
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield run_dir
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        allocations = tracemalloc.take_snapshot() if memory else None
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+        if not was_enabled:
+            disable()
+        _write_run(run_dir, elapsed, profiler, allocations, peak, top)
+
+
+def _write_run(run_dir, elapsed, profiler, allocations, peak, top):
+    os.makedirs(run_dir, exist_ok=True)
+    report = dict(snapshot(), wall_s=round(elapsed, 6), argv=sys.argv)
+    if peak is not None:
+        report["traced_peak_mb"] = round(peak / 2 ** 20, 3)
+    with open(os.path.join(run_dir, "stages.json"), "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(run_dir, "profile.pstats"))
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+        with open(os.path.join(run_dir, "profile.txt"), "w", encoding="utf-8") as file:
+            file.write(text.getvalue())
+    if allocations is not None:
+        with open(os.path.join(run_dir, "memory.txt"), "w", encoding="utf-8") as file:
+            file.write("Peak traced memory: {:.3f} MB\n\nLargest allocations alive at the end:\n".format(
+                peak / 2 ** 20))
+            for stat in allocations.statistics("lineno")[:top]:
+                file.write("{}\n".format(stat))
+
+
+def _print_at_exit():
+    print(format_report(), file=sys.stderr)
+
+
+def _finish_profile(session, run_dir):
+    session.__exit__(None, None, None)
+    print("Wrote the profile to {}".format(run_dir), file=sys.stderr)
+
+
+def _configure_from_environment():
+    directory = os.environ.get("KNN_SENTIMENT_PROFILE")
+    if directory:
+        session = profile(directory)
+        atexit.register(_finish_profile, session, session.__enter__())
+    elif os.environ.get("KNN_SENTIMENT_INSTRUMENT", "") not in ("", "0"):
+        enable()
+        atexit.register(_print_at_exit)
+
+
+_configure_from_environment()
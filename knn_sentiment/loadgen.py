@@ -0,0 +1,65 @@
+"""Load generator for the prediction server.
+
+Opens ``concurrency`` keep-alive connections to a running server, sends
+``n_requests`` single-tweet ``POST /predict`` requests in total (cycling
+through the given tweets) and reports the client-side throughput and
+latency percentiles together with the server's ``/metrics``.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+
+import numpy as np
+
+
+async def _request(reader, writer, method, path, payload=None):
+    body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+    writer.write("{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n"
+                 .format(method, path, len(body)).encode("ascii") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def _client(host, port, tweets, counter, n_requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while next(counter) < n_requests:
+            start = time.perf_counter()
+            status, _ = await _request(reader, writer, "POST", "/predict", {"tweet": next(tweets)})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, tweets, n_requests=10000, concurrency=64):
+    """Send the requests and return a report dict (client and server view)."""
+    tweets = itertools.cycle(tweets)
+    counter = itertools.count()
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, tweets, counter, n_requests, latencies, errors)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.asarray(latencies) * 1000
+    p50, p99 = np.percentile(latencies_ms, [50, 99]) if len(latencies_ms) else (0.0, 0.0)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        _, server_metrics = await _request(reader, writer, "GET", "/metrics")
+    finally:
+        writer.close()
+    return {"requests": len(latencies), "errors": len(errors), "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "latency_p50_ms": round(p50, 3), "latency_p99_ms": round(p99, 3), "server": server_metrics}
@@ -0,0 +1,502 @@
+"""KNN sentiment classifiers that are fitted once and reused.
+
+``BoWKNNClassifier``, ``TfidfKNNClassifier``, ``HashingKNNClassifier``
+and ``Word2vecKNNClassifier`` wrap the normalizer, the featurizer, a
+neighbour index and the label codes in one object with ``fit``,
+``predict``, ``predict_proba`` and ``kneighbors``. Inputs are raw tweets;
+pass ``normalize=False`` when they are already preprocessed (e.g. the
+``Tweet`` column of ``load_corpus(...).to_frame()``).
+
+A fitted model can be updated in place: ``append`` adds labelled tweets
+(growing the vocabulary and the training rows) and ``delete`` removes
+them by the row ids ``append`` returned; neither refits the model.
+
+``save`` writes everything the model needs to one ``.npz`` file and
+``KNNClassifier.load`` reads it back without refitting, so a server or a
+batch job can start scoring right away. A word2vec model stores the path of
+its ``EmbeddingStore`` instead of the word vectors; the store is memory
+mapped again on load.
+"""
+
+import os
+
+import numpy as np
+
+from . import instrument
+from .distance import METRICS
+from .embeddings import EmbeddingStore, embed_tweets
+from .buffers import RowBuffer
+from .features import DEFAULT_BUCKETS, Vocabulary, bow_matrix, hash_matrix, idf_weights, tfidf_matrix
+from .index import BruteForceIndex, IVFIndex, IncrementalIndex, InvertedIndex, NeighbourIndex
+from .quantization import QuantizedMatrix
+from .scoring import distance_weights, encode_labels, majority_vote, vote_counts
+from .search import check_k
+from .stopwords import load_stopwords
+from .text import TweetNormalizer
+
+MODEL_TYPES = {}
+
+
+def _register(cls):
+    MODEL_TYPES[cls.kind] = cls
+    return cls
+
+
+class KNNClassifier:
+    """Base class of the classifiers; subclasses turn tweets into feature rows.
+
+    ``k`` is the number of neighbours that vote. ``seed`` breaks voting
+    ties like ``majority_vote``; ``None`` gives ties to the smallest class.
+    ``stopwords`` defaults to the words of stop_words.txt and is saved with
+    the model, so a reloaded model cleans tweets exactly as it did in fit.
+    ``dtype`` is the storage type of the training rows, one of the
+    subclass's ``dtypes``; the first one is the exact float64 baseline.
+    ``weights="distance"`` weighs every vote by the inverse distance of its
+    neighbour (see ``distance_weights``) instead of counting them equally.
+    """
+
+    kind = None
+    dtypes = ("float64",)
+    weightings = ("uniform", "distance")
+    # Removed rows are dropped for good once they exceed this fraction of all rows.
+    max_deleted_fraction = 0.1
+
+    def __init__(self, k=10, metric="euclidean", normalize=True, stopwords=None, seed=0, dtype="float64",
+                 weights="uniform"):
+        if metric not in METRICS:
+            raise ValueError("Unsupported metric {!r}, expected one of {}".format(metric, METRICS))
+        if dtype not in self.dtypes:
+            raise ValueError("Unsupported dtype {!r}, expected one of {}".format(dtype, self.dtypes))
+        if weights not in self.weightings:
+            raise ValueError("Unsupported weights {!r}, expected one of {}".format(weights, self.weightings))
+        check_k(k)
+        self.k = k
+        self.dtype = dtype
+        self.metric = metric
+        self.weights = weights
+        self.normalize = normalize
+        self.seed = seed
+        self.normalizer = TweetNormalizer(load_stopwords() if stopwords is None else stopwords)
+        self.index = None
+        self.classes = None
+        self.label_codes = None
+        self.row_ids = None
+        self.next_id = 0
+        self._buffers = None
+
+    @property
+    def X(self):
+        """Training feature rows, by position (removed rows included until compaction)."""
+        return self.index.X
+
+    def clean(self, tweets):
+        """Preprocessed text of the tweets, or the tweets as given with ``normalize=False``."""
+        if self.normalize:
+            return self.normalizer.clean_many(tweets)
+        return list(tweets)
+
+    def transform(self, tweets):
+        """Feature rows of the tweets, in the columns of the fitted training data."""
+        raise NotImplementedError
+
+    def _fit_features(self, texts):
+        # Fit the featurizer; returns the training rows and a keep mask.
+        raise NotImplementedError
+
+    def _extend_features(self, texts):
+        # Like _fit_features, for new training tweets of a fitted model.
+        raise NotImplementedError
+
+    def _make_index(self):
+        raise NotImplementedError
+
+    def fit(self, tweets, labels):
+        X, keep = self._fit_features(self.clean(tweets))
+        self.classes, codes = encode_labels(np.asarray(labels)[keep])
+        self.label_codes = codes.astype(np.intp)
+        self.row_ids = np.arange(len(codes), dtype=np.int64)
+        self.next_id = len(codes)
+        self._buffers = None
+        self.index = IncrementalIndex(self._make_index()).build(X)
+        return self
+
+    def append(self, tweets, labels):
+        """Add labelled tweets to the fitted model; returns their row ids.
+
+        New words extend the vocabulary and new labels extend ``classes``
+        (which stays sorted; stored label codes are renumbered).
+        The rows are appended to the index without rebuilding it, so the
+        cost is amortized O(new tweets). Tweets without features (no known
+        word, for word2vec) are skipped and get no id.
+        """
+        X, keep = self._extend_features(self.clean(tweets))
+        labels = np.asarray(labels)[keep]
+        if self._buffers is None:
+            self._buffers = RowBuffer(self.label_codes), RowBuffer(self.row_ids)
+        codes, row_ids = self._buffers
+        new_classes = set(labels.tolist()).difference(self.classes.tolist())
+        if new_classes:
+            # classes stays sorted, as encode_labels expects; the stored codes follow.
+            classes = np.array(sorted(set(self.classes.tolist()) | new_classes))
+            codes.view[:] = np.searchsorted(classes, self.classes)[codes.view]
+            self.classes = classes
+        known = {label: code for code, label in enumerate(self.classes.tolist())}
+        ids = np.arange(self.next_id, self.next_id + len(labels), dtype=np.int64)
+        codes.extend([known[label] for label in labels.tolist()])
+        row_ids.extend(ids)
+        self.label_codes, self.row_ids = codes.view, row_ids.view
+        self.next_id += len(ids)
+        self.index.add(X)
+        return ids
+
+    def delete(self, ids):
+        """Remove training tweets by row id, as returned by ``append`` (or 0..n-1 after fit).
+
+        The rows are tombstoned and never returned as neighbours; they are
+        dropped for good by ``compact``, which runs automatically once
+        ``max_deleted_fraction`` of the rows are removed. Unknown or already
+        deleted ids raise a ``ValueError``. Words are never removed from a
+        BoW vocabulary; that shifts every distance of a query by the same
+        amount, so the neighbours are the same as after a refit.
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        positions = np.minimum(np.searchsorted(self.row_ids, ids), len(self.row_ids) - 1)
+        unknown = (self.row_ids[positions] != ids) | self.index.deleted[positions]
+        if unknown.any():
+            raise ValueError("Unknown or deleted row ids: {}".format(sorted(set(ids[unknown].tolist()))))
+        self.index.remove(positions)
+        if self.index.n_deleted > self.max_deleted_fraction * self.index.n_rows:
+            self.compact()
+
+    def compact(self):
+        """Drop the deleted rows from the index, the label codes and ``row_ids``."""
+        keep = self.index.compact()
+        self.label_codes = self.label_codes[keep]
+        self.row_ids = self.row_ids[keep]
+        self._buffers = None
+
+    @instrument.timed("model.kneighbors", items=lambda result: len(result[1]))
+    def kneighbors(self, tweets, k=None):
+        """``(distances, indices)`` of the k nearest training tweets, nearest first.
+
+        Indices are row positions; ``row_ids[indices]`` gives the row ids.
+        """
+        k = self.k if k is None else k
+        check_k(k)
+        return self.index.query(self.transform(tweets), k)
+
+    def predict_proba(self, tweets):
+        """Fraction of the k neighbours (or of their weight) in every class; columns follow ``classes``."""
+        return self._proba(*self.kneighbors(tweets))
+
+    def predict(self, tweets):
+        """Majority label of the k neighbours of every tweet.
+
+        Voting ties are broken at random with ``seed``, keyed on the nearest
+        neighbour, so a tweet gets the same label whatever batch it is in.
+        """
+        return self._vote(*self.kneighbors(tweets))
+
+    def predict_with_proba(self, tweets):
+        """``(predict(tweets), predict_proba(tweets))`` from a single neighbour search."""
+        distances, indices = self.kneighbors(tweets)
+        return self._vote(distances, indices), self._proba(distances, indices)
+
+    def _vote_weights(self, distances):
+        return distance_weights(distances) if self.weights == "distance" else None
+
+    def _vote(self, distances, indices):
+        keys = self.row_ids[indices[:, 0]] if indices.shape[1] else np.zeros(len(indices))
+        codes = majority_vote(self.label_codes[indices], len(self.classes), self._vote_weights(distances),
+                              seed=self.seed, row_keys=keys)
+        return self.classes[codes]
+
+    def _proba(self, distances, indices):
+        counts = vote_counts(self.label_codes[indices], len(self.classes), self._vote_weights(distances))
+        total = counts.sum(axis=1, keepdims=True)
+        return counts / np.where(total > 0, total, 1)
+
+    def _state(self):
+        # Featurizer arrays written by save(), besides the common ones.
+        raise NotImplementedError
+
+    def _restore(self, state, **kwargs):
+        # kwargs are the options of from_state; subclasses ignore the ones they do not use.
+        raise NotImplementedError
+
+    def to_state(self):
+        """Parameters and arrays of the fitted model, as a dict of arrays.
+
+        The training rows are stored once, as part of the index state
+        (``index.*`` entries); ``X`` is the index's matrix.
+        """
+        state = {
+            "kind": self.kind,
+            "k": self.k,
+            "metric": self.metric,
+            "weights": self.weights,
+            "normalize": self.normalize,
+            "seed": -1 if self.seed is None else self.seed,
+            "dtype": self.dtype,
+            "stopwords": np.array(sorted(self.normalizer.stopwords)),
+            "classes": self.classes.astype(str),
+            "label_codes": self.label_codes,
+            "row_ids": self.row_ids,
+            "next_id": self.next_id,
+        }
+        state.update(self._state())
+        state.update(("index." + name, value) for name, value in self.index.to_state().items())
+        return state
+
+    @staticmethod
+    def from_state(state, **kwargs):
+        """Rebuild a model from ``to_state``, whatever its type.
+
+        ``kwargs`` are passed to the subclass, e.g. ``store=`` to give a
+        word2vec model an already loaded ``EmbeddingStore``; other model
+        types ignore it. Arrays are used as given, so memory-mapped arrays
+        stay on disk and shared.
+        """
+        state = dict(state)
+        index_state = {name[len("index."):]: state.pop(name) for name in list(state) if name.startswith("index.")}
+        cls = MODEL_TYPES[str(state.pop("kind"))]
+        model = cls.__new__(cls)
+        seed = int(state.pop("seed"))
+        KNNClassifier.__init__(model, k=int(state.pop("k")), metric=str(state.pop("metric")),
+                               normalize=bool(state.pop("normalize")),
+                               stopwords=state.pop("stopwords").tolist(),
+                               seed=None if seed < 0 else seed, dtype=str(state.pop("dtype", "float64")),
+                               weights=str(state.pop("weights", "uniform")))
+        model.classes = state.pop("classes")
+        model.label_codes = np.asarray(state.pop("label_codes"), dtype=np.intp)
+        model.row_ids = state.pop("row_ids")
+        model.next_id = int(state.pop("next_id"))
+        model.index = NeighbourIndex.from_state(index_state)
+        model._restore(state, **kwargs)
+        return model
+
+    def save(self, path):
+        """Write the fitted model to one ``.npz`` file."""
+        # Written to a temporary file first so readers never see half a file.
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **self.to_state())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path, **kwargs):
+        """Load a model written by ``save``; ``kwargs`` are as for ``from_state``."""
+        with np.load(path, allow_pickle=False) as data:
+            return KNNClassifier.from_state({name: data[name] for name in data.files}, **kwargs)
+
+
+@_register
+class BoWKNNClassifier(KNNClassifier):
+    """KNN over bag-of-words counts, searched with an ``InvertedIndex``.
+
+    The inverted index only handles euclidean and cosine distances; with
+    ``metric="manhattan"`` the rows are searched with a ``BruteForceIndex``.
+
+    ``min_count`` and ``max_size`` prune the ``Vocabulary``: rare words
+    are left out of the feature columns. With ``dtype="uint8"`` or
+    ``"uint16"`` the training counts (and posting lists) take 1 or 2 bytes
+    instead of 8; distances are unchanged since counts are integers. A
+    training tweet with a word repeated more often than the type holds
+    raises a ``ValueError``. Query rows are always float64.
+    """
+
+    kind = "bow"
+    dtypes = ("float64", "uint16", "uint8")
+
+    def __init__(self, k=10, metric="euclidean", normalize=True, stopwords=None, seed=0,
+                 min_count=1, max_size=None, dtype="float64", weights="uniform"):
+        super().__init__(k, metric, normalize, stopwords, seed, dtype, weights)
+        self.vocabulary = Vocabulary(min_count, max_size)
+
+    def transform(self, tweets):
+        return bow_matrix(self.clean(tweets), self.vocabulary)
+
+    def _fit_features(self, texts):
+        self.vocabulary.fit(texts)
+        return bow_matrix(texts, self.vocabulary, self.dtype), np.ones(len(texts), dtype=bool)
+
+    def _extend_features(self, texts):
+        self.vocabulary.update(texts)
+        return bow_matrix(texts, self.vocabulary, self.dtype), np.ones(len(texts), dtype=bool)
+
+    def _make_index(self):
+        if self.metric in InvertedIndex.metrics:
+            return InvertedIndex(self.metric)
+        return BruteForceIndex(self.metric)
+
+    def _state(self):
+        return {"vocabulary." + name: value for name, value in self.vocabulary.to_state().items()}
+
+    def _restore(self, state, **kwargs):
+        self.vocabulary = Vocabulary.from_state({name[len("vocabulary."):]: value for name, value in state.items()
+                                                 if name.startswith("vocabulary.")})
+
+
+@_register
+class TfidfKNNClassifier(BoWKNNClassifier):
+    """KNN over L2-normalized TF-IDF rows, by cosine distance by default.
+
+    The inverse document frequencies are computed once in ``fit`` from
+    the ``Vocabulary`` counts and saved with the model. The rows have unit
+    norm, so the ``InvertedIndex`` scores cosine candidates with plain
+    sparse dot products. ``append`` keeps the weights of known words, so
+    the stored rows stay valid; words new to the vocabulary get weights
+    from the document frequencies at that point. ``dtype="float32"`` halves
+    the stored weights.
+    """
+
+    kind = "tfidf"
+    dtypes = ("float64", "float32")
+
+    def __init__(self, k=10, metric="cosine", normalize=True, stopwords=None, seed=0,
+                 min_count=1, max_size=None, dtype="float64", weights="uniform"):
+        super().__init__(k, metric, normalize, stopwords, seed, min_count, max_size, dtype, weights)
+        self.idf = None
+
+    def transform(self, tweets):
+        return tfidf_matrix(self.clean(tweets), self.vocabulary, self.idf)
+
+    def _fit_features(self, texts):
+        self.vocabulary.fit(texts)
+        self.idf = idf_weights(self.vocabulary.document_frequencies, self.vocabulary.n_docs)
+        return tfidf_matrix(texts, self.vocabulary, self.idf, self.dtype), np.ones(len(texts), dtype=bool)
+
+    def _extend_features(self, texts):
+        self.vocabulary.update(texts)
+        new_df = self.vocabulary.document_frequencies_from(len(self.idf))
+        self.idf = np.concatenate((self.idf, idf_weights(new_df, self.vocabulary.n_docs)))
+        return tfidf_matrix(texts, self.vocabulary, self.idf, self.dtype), np.ones(len(texts), dtype=bool)
+
+    def _make_index(self):
+        if self.metric in InvertedIndex.metrics:
+            return InvertedIndex(self.metric, unit_norm=True)
+        return BruteForceIndex(self.metric)
+
+    def _state(self):
+        return dict(super()._state(), idf=self.idf)
+
+    def _restore(self, state, **kwargs):
+        super()._restore(state)
+        self.idf = state["idf"]
+
+
+@_register
+class HashingKNNClassifier(KNNClassifier):
+    """KNN over hashed word counts (``hash_matrix``), searched with an ``InvertedIndex``.
+
+    There is no vocabulary: the rows always have ``n_buckets`` columns, so
+    memory does not grow with the number of distinct words, ``append``
+    never widens the index, and query words unseen in training still
+    count. Words that share a bucket are merged; ``signed`` hashing makes
+    them cancel out on average. With few collisions (many buckets) the
+    distances are those of ``BoWKNNClassifier``; the index keeps an 8-byte
+    posting list offset per bucket, so a few million buckets is the
+    practical limit.
+    """
+
+    kind = "hashing"
+    dtypes = ("float64", "float32")
+
+    def __init__(self, k=10, metric="euclidean", normalize=True, stopwords=None, seed=0,
+                 n_buckets=DEFAULT_BUCKETS, signed=True, dtype="float64", weights="uniform"):
+        super().__init__(k, metric, normalize, stopwords, seed, dtype, weights)
+        self.n_buckets = n_buckets
+        self.signed = signed
+
+    def transform(self, tweets):
+        return hash_matrix(self.clean(tweets), self.n_buckets, self.signed)
+
+    def _fit_features(self, texts):
+        return hash_matrix(texts, self.n_buckets, self.signed, self.dtype), np.ones(len(texts), dtype=bool)
+
+    def _extend_features(self, texts):
+        return self._fit_features(texts)
+
+    def _make_index(self):
+        if self.metric in InvertedIndex.metrics:
+            return InvertedIndex(self.metric)
+        return BruteForceIndex(self.metric)
+
+    def _state(self):
+        return {"n_buckets": self.n_buckets, "signed": self.signed}
+
+    def _restore(self, state, **kwargs):
+        self.n_buckets = int(state["n_buckets"])
+        self.signed = bool(state["signed"])
+
+
+@_register
+class Word2vecKNNClassifier(KNNClassifier):
+    """KNN over mean word2vec vectors, searched with a ``BruteForceIndex``.
+
+    ``store`` is an ``EmbeddingStore`` or the directory of one. Training
+    tweets without a known word are left out, like ``drop_empty`` does in
+    the scripts; such query tweets get an all-zero vector.
+
+    ``index_type="ivf"`` searches an ``IVFIndex`` instead (euclidean or
+    cosine only), built with the ``index_params`` options (``n_lists``,
+    ``n_probe``, ``pq_subspaces``, ...): faster on large training sets, but
+    the neighbours, and so the predictions, are approximate.
+
+    ``dtype="float32"`` stores the training vectors in half the space and
+    computes the dot products in float32; ``"int8"`` stores them as a
+    ``QuantizedMatrix`` (one byte per value plus a scale per row). Query
+    vectors are never quantized.
+    """
+
+    kind = "word2vec"
+    dtypes = ("float64", "float32", "int8")
+    index_types = ("brute", "ivf")
+
+    def __init__(self, store, k=10, metric="euclidean", normalize=True, stopwords=None, seed=0, dtype="float64",
+                 weights="uniform", index_type="brute", index_params=None):
+        super().__init__(k, metric, normalize, stopwords, seed, dtype, weights)
+        if index_type not in self.index_types:
+            raise ValueError("Unsupported index_type {!r}, expected one of {}".format(index_type, self.index_types))
+        if index_type == "ivf" and metric not in IVFIndex.metrics:
+            raise ValueError("Unsupported metric {!r} for an IVF index, expected one of {}".format(
+                metric, IVFIndex.metrics))
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        self._set_store(store)
+
+    def _set_store(self, store):
+        if isinstance(store, str):
+            store = EmbeddingStore.load(store)
+        self.store = store
+
+    def transform(self, tweets):
+        return embed_tweets(self.clean(tweets), self.store)[0]
+
+    def _fit_features(self, texts):
+        embeddings, keep = embed_tweets(texts, self.store)
+        if self.dtype == "int8":
+            return QuantizedMatrix.from_array(embeddings[keep]), keep
+        return embeddings[keep].astype(self.dtype), keep
+
+    def _extend_features(self, texts):
+        return self._fit_features(texts)
+
+    def _make_index(self):
+        if self.index_type == "ivf":
+            return IVFIndex(metric=self.metric, **self.index_params)
+        return BruteForceIndex(self.metric)
+
+    def _state(self):
+        if self.store.path is None:
+            raise ValueError("The embedding store was not loaded from a directory, so it cannot be referenced")
+        return {"store_path": self.store.path}
+
+    def _restore(self, state, store=None):
+        self._set_store(str(state["store_path"]) if store is None else store)
+        # The index options are saved with the index itself.
+        main = self.index.main
+        self.index_type = main.kind
+        self.index_params = {}
+        if main.kind == "ivf":
+            self.index_params = {"n_lists": main.n_lists, "n_probe": main.n_probe,
+                                 "pq_subspaces": main.pq_subspaces, "n_iter": main.n_iter, "seed": main.seed}
@@ -0,0 +1,104 @@
+"""Scoring tweets on several cores.
+
+``ParallelScorer`` splits the tweets into batches and predicts them in a
+pool of worker processes. The fitted model is not pickled to the workers:
+``share_model`` writes its arrays (training matrix, posting lists, label
+codes, ...) once as ``.npy`` files and every worker memory-maps them with
+``load_shared_model``, so all processes read the same pages of the OS page
+cache. Only the tweets of a batch and its predictions cross process
+boundaries. Word2vec vectors are shared the same way, through the
+memory-mapped ``EmbeddingStore``.
+"""
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .model import KNNClassifier
+
+DEFAULT_BATCH_SIZE = 500
+
+_worker_model = None
+
+
+def share_model(model, directory):
+    """Write the arrays of a fitted model as ``.npy`` files in ``directory``."""
+    os.makedirs(directory, exist_ok=True)
+    for name, value in model.to_state().items():
+        np.save(os.path.join(directory, name + ".npy"), np.asarray(value))
+
+
+def load_shared_model(directory, **kwargs):
+    """Load a model written by ``share_model`` with every array memory-mapped."""
+    state = {}
+    for file_name in os.listdir(directory):
+        if file_name.endswith(".npy"):
+            state[file_name[:-len(".npy")]] = np.load(os.path.join(directory, file_name), mmap_mode="r")
+    return KNNClassifier.from_state(state, **kwargs)
+
+
+def _init_worker(directory):
+    global _worker_model
+    _worker_model = load_shared_model(directory)
+
+
+def _predict_batch(tweets):
+    return _worker_model.predict(tweets)
+
+
+def _predict_batch_with_proba(tweets):
+    return _worker_model.predict_with_proba(tweets)
+
+
+class ParallelScorer:
+    """Predicts with a fitted model in ``n_jobs`` worker processes.
+
+    Offers ``predict``, ``predict_proba`` and ``predict_with_proba`` like the
+    model itself, with the same results, so it can be passed wherever a
+    model is used for scoring (e.g. ``score_file``). ``n_jobs`` defaults to
+    the number of CPUs. Use it as a context manager, or call ``close``, to
+    stop the workers and remove the shared files.
+    """
+
+    def __init__(self, model, n_jobs=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.classes = model.classes
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.directory = tempfile.mkdtemp(prefix="knn_sentiment-")
+        share_model(model, self.directory)
+        self.executor = ProcessPoolExecutor(self.n_jobs, initializer=_init_worker,
+                                            initargs=(self.directory,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _batches(self, tweets):
+        tweets = list(tweets)
+        # Small inputs are spread over all workers instead of filling one batch.
+        size = max(1, min(self.batch_size, -(-len(tweets) // self.n_jobs)))
+        return [tweets[i:i + size] for i in range(0, len(tweets), size)]
+
+    def predict(self, tweets):
+        results = list(self.executor.map(_predict_batch, self._batches(tweets)))
+        if not results:
+            return self.classes[:0]
+        return np.concatenate(results)
+
+    def predict_with_proba(self, tweets):
+        results = list(self.executor.map(_predict_batch_with_proba, self._batches(tweets)))
+        if not results:
+            return self.classes[:0], np.zeros((0, len(self.classes)))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def predict_proba(self, tweets):
+        return self.predict_with_proba(tweets)[1]
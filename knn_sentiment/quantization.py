@@ -0,0 +1,85 @@
+"""Int8 scalar quantization of dense feature rows.
+
+``QuantizedMatrix`` stores every row as int8 codes plus one float32 scale,
+``x ~ scale * codes`` with ``scale = max|x| / 127``, so a 300-dimensional
+word2vec row takes 304 bytes instead of 1200 (float32) or 2400 (float64).
+Every row has its own scale, so rows can be appended without requantizing
+the others.
+
+Distances are computed on the codes: ``q . x = scale * (q . codes)``. The
+queries are not quantized, and only ``BLOCK_SIZE`` rows of codes at a time
+are widened to float32 for the matrix product, so the full float matrix
+never exists in memory.
+"""
+
+import numpy as np
+
+BLOCK_SIZE = 4096
+
+
+class QuantizedMatrix:
+    """Rows of int8 ``codes`` (n, dim) with one float32 entry of ``scales`` (n,) each.
+
+    Supports row selection (``Q[mask]``, ``Q[start:stop]``), ``len``,
+    ``shape`` and ``np.asarray``, which dequantizes to float32.
+    """
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_array(cls, X):
+        """Quantize the rows of a float array."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2:
+            raise ValueError("Expected a 2-d array, got {} dimensions".format(X.ndim))
+        scales = np.abs(X).max(axis=1) / 127 if X.shape[1] else np.zeros(len(X), dtype=np.float32)
+        safe = np.where(scales > 0, scales, 1)
+        codes = np.clip(np.rint(X / safe[:, None]), -127, 127).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @staticmethod
+    def concatenate(parts):
+        return QuantizedMatrix(np.concatenate([p.codes for p in parts]),
+                               np.concatenate([p.scales for p in parts]))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        if np.ndim(rows) == 0 and not isinstance(rows, slice):
+            raise TypeError("Select rows with a slice, a mask or an array of positions")
+        return QuantizedMatrix(self.codes[rows], self.scales[rows])
+
+    def toarray(self, dtype=np.float32):
+        return self.codes.astype(dtype) * self.scales.astype(dtype)[:, None]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.toarray(np.float32 if dtype is None else dtype)
+
+    def dot(self, A):
+        """``A @ self.T`` for float rows ``A``, computed in float32 one block of codes at a time."""
+        A = np.asarray(A, dtype=np.float32)
+        out = np.empty((len(A), len(self)), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_SIZE):
+            block = self.codes[start:start + BLOCK_SIZE].astype(np.float32)
+            out[:, start:start + len(block)] = A @ block.T
+        out *= self.scales[None, :]
+        return out
+
+    def row_norms_sq(self):
+        """Squared L2 norm of every dequantized row, as float64."""
+        norms = np.empty(len(self), dtype=np.float64)
+        for start in range(0, len(self), BLOCK_SIZE):
+            block = self.codes[start:start + BLOCK_SIZE].astype(np.int32)
+            norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+        return norms * self.scales.astype(np.float64) ** 2
@@ -0,0 +1,127 @@
+"""Majority voting, confusion matrices and macroaveraged measures in NumPy.
+
+Labels are handled as integer codes (``0 .. n_classes - 1``), so voting and
+counting are single ``np.bincount`` calls instead of Python loops.
+"""
+
+import numpy as np
+
+from . import instrument
+
+
+def encode_labels(labels, classes=None):
+    """Turn labels into integer codes.
+
+    Returns ``(classes, codes)`` where ``classes[codes]`` gives the labels
+    back. Pass the training ``classes`` to encode test labels with the same
+    codes; labels that are not in ``classes`` raise a ``ValueError``.
+    """
+    labels = np.asarray(labels)
+    if classes is None:
+        return np.unique(labels, return_inverse=True)
+    classes = np.asarray(classes)
+    codes = np.searchsorted(classes, labels)
+    codes[codes == len(classes)] = 0
+    unknown = classes[codes] != labels
+    if unknown.any():
+        raise ValueError("Unknown labels: {}".format(sorted(set(labels[unknown].tolist()))))
+    return classes, codes
+
+
+def vote_counts(neighbour_codes, n_classes, weights=None):
+    """Number of (or total weight of) neighbours per class, one row per query."""
+    n_queries = neighbour_codes.shape[0]
+    rows = np.repeat(np.arange(n_queries) * n_classes, neighbour_codes.shape[1])
+    flat = rows + neighbour_codes.ravel()
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64).ravel()
+    counts = np.bincount(flat, weights=weights, minlength=n_queries * n_classes)
+    return counts.reshape(n_queries, n_classes)
+
+
+def distance_weights(distances):
+    """Inverse-distance vote weights, like ``weights="distance"`` in scikit-learn.
+
+    A row with neighbours at distance 0 gives those weight 1 and the others
+    weight 0, instead of dividing by zero.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        weights = 1 / distances
+    exact = distances == 0
+    has_exact = exact.any(axis=1)
+    weights[has_exact] = exact[has_exact]
+    return weights
+
+
+def _keyed_noise(row_keys, n_classes, seed):
+    # splitmix64 of (seed, key, class): uniform-looking values that only depend on the row's key.
+    x = np.asarray(row_keys, dtype=np.uint64)[:, None] * np.uint64(n_classes) + np.arange(n_classes, dtype=np.uint64)
+    x += np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+@instrument.timed("scoring.vote", items=len)
+def majority_vote(neighbour_codes, n_classes, weights=None, seed=0, row_keys=None):
+    """Most common class among every row of neighbour label codes.
+
+    Ties are broken at random, like the old ``get_mode``, but with a seeded
+    generator so runs are reproducible. With ``seed=None`` ties go to the
+    smallest code instead, which is what ``KNeighborsClassifier`` does.
+
+    By default the random draw of a row depends on the whole batch. Pass
+    ``row_keys`` (one integer per row, e.g. the index of its nearest
+    neighbour) to make it depend only on the row's key and ``seed``, so the
+    prediction for a tweet does not change with the batch it is scored in.
+    """
+    counts = vote_counts(neighbour_codes, n_classes, weights)
+    if seed is None:
+        return counts.argmax(axis=1)
+    is_max = counts == counts.max(axis=1, keepdims=True)
+    if row_keys is None:
+        noise = np.random.default_rng(seed).random(counts.shape)
+        return np.where(is_max, noise, -1).argmax(axis=1)
+    noise = _keyed_noise(row_keys, n_classes, seed)
+    return np.where(is_max, noise, 0).argmax(axis=1)
+
+
+@instrument.timed("scoring.confusion", items=lambda counts: int(counts.sum()))
+def confusion_counts(true_codes, pred_codes, n_classes):
+    """Counts of (gold class, predicted class) pairs; rows are gold classes.
+
+    Class pairs that never occur are simply zero.
+    """
+    flat = np.asarray(true_codes) * n_classes + np.asarray(pred_codes)
+    return np.bincount(flat, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+
+def _safe_divide(num, den):
+    out = np.zeros(len(num), dtype=np.float64)
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+
+def macro_scores(cmatrix):
+    """Accuracy and macroaveraged precision, recall and F1 from a confusion matrix.
+
+    ``cmatrix`` has gold classes on the rows, as returned by
+    ``confusion_counts``. Values are fractions between 0 and 1; a class
+    that is never predicted (or never present) scores 0 rather than nan.
+    """
+    cmatrix = np.asarray(cmatrix, dtype=np.float64)
+    tp = np.diag(cmatrix)
+    precision = _safe_divide(tp, cmatrix.sum(axis=0))
+    recall = _safe_divide(tp, cmatrix.sum(axis=1))
+    f1 = _safe_divide(2 * precision * recall, precision + recall)
+    total = cmatrix.sum()
+    return {
+        "accuracy": tp.sum() / total if total else 0.0,
+        "precision": precision.mean(),
+        "recall": recall.mean(),
+        "f1": f1.mean(),
+    }
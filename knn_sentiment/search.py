@@ -0,0 +1,90 @@
+"""Blocked k-nearest-neighbour search.
+
+Queries are processed ``chunk_size`` rows at a time and only the k best
+neighbours of each row are kept, so peak memory is bounded by
+``chunk_size * n_train`` distances instead of the full test x train matrix.
+"""
+
+import numpy as np
+
+from . import instrument
+from .distance import as_rows, pairwise_distances, row_norms_sq
+
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def check_k(k):
+    """Raise a ``ValueError`` unless ``k`` is an integer of at least 1."""
+    if isinstance(k, bool) or not isinstance(k, (int, np.integer)) or k < 1:
+        raise ValueError("Expected k to be an integer of at least 1, got {!r}".format(k))
+
+
+def top_k(dists, k):
+    """Values and indices of the k smallest entries of every row, ascending.
+
+    Uses ``np.argpartition`` so each row costs O(n) instead of a full sort;
+    only the k selected entries are sorted. Ties are ordered by index, and
+    when ties straddle the k-th place the lowest indices are kept, so the
+    result does not depend on how the partition happened to split them.
+    """
+    check_k(k)
+    k = min(k, dists.shape[1])
+    if k < dists.shape[1]:
+        # Partitioning at k also places the (k + 1)-th smallest value in column k:
+        # ties straddle the k-th place exactly when it equals the k-th value.
+        part = np.argpartition(dists, k, axis=1)[:, :k + 1]
+        next_dists = np.take_along_axis(dists, part[:, k:], axis=1)
+        part = part[:, :k]
+        part_dists = np.take_along_axis(dists, part, axis=1)
+        kth = part_dists.max(axis=1, keepdims=True)
+        ambiguous = np.flatnonzero(next_dists[:, 0] == kth[:, 0])
+        if len(ambiguous):
+            part[ambiguous] = _lowest_index_top_k(dists[ambiguous], kth[ambiguous], k)
+    else:
+        part = np.broadcast_to(np.arange(dists.shape[1]), dists.shape)
+    part_dists = np.take_along_axis(dists, part, axis=1)
+    order = np.lexsort((part, part_dists), axis=1)
+    indices = np.take_along_axis(part, order, axis=1)
+    return np.take_along_axis(part_dists, order, axis=1), indices
+
+
+def _lowest_index_top_k(dists, kth, k):
+    # Everything below the k-th value plus the lowest-index entries equal to it.
+    selected = dists < kth
+    room = k - selected.sum(axis=1)
+    rows, cols = np.nonzero(dists == kth)
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    take = rank < room[rows]
+    selected[rows[take], cols[take]] = True
+    return np.nonzero(selected)[1].reshape(len(dists), k)
+
+
+def kneighbors(Q, X, k, metric="euclidean", chunk_size=DEFAULT_CHUNK_SIZE, X_norms=None, exclude=None):
+    """Find the k nearest rows of ``X`` for every row of ``Q``.
+
+    ``Q`` and ``X`` can be dense arrays, sparse CSR matrices or, for ``X``,
+    a ``QuantizedMatrix``. Returns
+    ``(distances, indices)``, both of shape ``(n_queries, k)`` and sorted
+    from the nearest neighbour to the farthest. ``exclude`` is an optional
+    boolean mask of rows of ``X`` that are never returned (unless fewer
+    than k other rows exist; they then come last with distance inf).
+    """
+    check_k(k)
+    Q = as_rows(Q)
+    X = as_rows(X)
+    if X_norms is None:
+        X_norms = row_norms_sq(X)
+    n_queries = Q.shape[0]
+    k = min(k, X.shape[0])
+
+    distances = np.empty((n_queries, k), dtype=np.float64)
+    indices = np.empty((n_queries, k), dtype=np.intp)
+    for start in range(0, n_queries, chunk_size):
+        stop = min(start + chunk_size, n_queries)
+        with instrument.stage("search.distances", stop - start):
+            block = pairwise_distances(Q[start:stop], X, metric, B_norms=X_norms)
+        if exclude is not None:
+            block[:, exclude] = np.inf
+        with instrument.stage("search.top_k", stop - start):
+            distances[start:stop], indices[start:stop] = top_k(block, k)
+    return distances, indices
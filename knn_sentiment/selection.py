@@ -0,0 +1,190 @@
+"""Choosing k, the metric, the vote weighting and the features by cross-validation.
+
+``grid_search`` scores every combination of
+
+* ``features``: bag-of-words counts, TF-IDF weights or mean word2vec vectors,
+* ``metric``: euclidean, cosine or manhattan distance,
+* ``weights``: uniform or inverse-distance (``distance_weights``) votes,
+* ``k``: the number of neighbours that vote,
+
+with stratified k-fold cross-validation (``stratified_folds``). The
+expensive part, the neighbour search, runs once per fold, feature set and
+metric, for the largest k: the neighbours for a smaller k are a prefix of
+those, and the vote weights only need their distances, so every k and
+weighting is a cheap vote over the same neighbours. Folds run in a pool of
+worker processes; the tweets are cleaned once, before they are sent.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .distance import METRICS
+from .embeddings import EmbeddingStore, embed_tweets
+from .features import Vocabulary, bow_matrix, idf_weights, tfidf_matrix
+from .scoring import confusion_counts, distance_weights, encode_labels, macro_scores, majority_vote
+from .search import DEFAULT_CHUNK_SIZE, kneighbors
+from .stopwords import load_stopwords
+from .text import TweetNormalizer
+
+FEATURES = ("bow", "tfidf", "word2vec")
+WEIGHTS = ("uniform", "distance")
+DEFAULT_KS = (1, 3, 5, 7, 10)
+
+_fold_data = None
+
+
+def stratified_folds(labels, n_folds=5, seed=0):
+    """Fold number (``0 .. n_folds - 1``) of every sample, with the classes spread evenly.
+
+    The samples of every class are shuffled with ``seed`` and dealt to the
+    folds in turn, continuing where the previous class stopped, so every
+    fold gets the same share of each class (to within one sample) and the
+    fold sizes differ by at most one.
+    """
+    classes, codes = encode_labels(labels)
+    if not 2 <= n_folds <= len(codes):
+        raise ValueError("Expected 2 <= n_folds <= {} samples, got {}".format(len(codes), n_folds))
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(codes), dtype=np.intp)
+    dealt = 0
+    for code in range(len(classes)):
+        members = rng.permutation(np.flatnonzero(codes == code))
+        folds[members] = (dealt + np.arange(len(members))) % n_folds
+        dealt += len(members)
+    return folds
+
+
+def _init_fold_worker(texts, codes, n_classes, folds, store):
+    global _fold_data
+    _fold_data = {"texts": texts, "codes": codes, "n_classes": n_classes, "folds": folds,
+                  "store": store, "embeddings": None}
+
+
+def _embeddings():
+    # Mean word2vec vectors of all tweets, computed once per process.
+    if _fold_data["embeddings"] is None:
+        store = _fold_data["store"]
+        if isinstance(store, str):
+            store = EmbeddingStore.load(store)
+        embeddings, keep = embed_tweets(_fold_data["texts"], store)
+        _fold_data["embeddings"] = embeddings.astype(np.float64), keep
+    return _fold_data["embeddings"]
+
+
+def _fold_features(name, train, test):
+    # (training rows, their positions in the corpus, test rows) of one fold.
+    texts = _fold_data["texts"]
+    if name == "word2vec":
+        embeddings, keep = _embeddings()
+        train = train[keep[train]]
+        return embeddings[train], train, embeddings[test]
+    train_texts = [texts[i] for i in train]
+    test_texts = [texts[i] for i in test]
+    vocabulary = Vocabulary().fit(train_texts)
+    if name == "tfidf":
+        idf = idf_weights(vocabulary.document_frequencies, vocabulary.n_docs)
+        return tfidf_matrix(train_texts, vocabulary, idf), train, tfidf_matrix(test_texts, vocabulary, idf)
+    return bow_matrix(train_texts, vocabulary), train, bow_matrix(test_texts, vocabulary)
+
+
+def _score_fold(fold, features, metrics, weights, ks, seed, chunk_size):
+    # Confusion counts of every (features, metric, weights, k) setting on one fold.
+    codes, n_classes, folds = _fold_data["codes"], _fold_data["n_classes"], _fold_data["folds"]
+    train, test = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+    results = {}
+    for name in features:
+        X, train_rows, Q = _fold_features(name, train, test)
+        for metric in metrics:
+            distances, indices = kneighbors(Q, X, max(ks), metric=metric, chunk_size=chunk_size)
+            neighbour_codes = codes[train_rows][indices]
+            keys = train_rows[indices[:, 0]]
+            for weighting in weights:
+                vote_weights = distance_weights(distances) if weighting == "distance" else None
+                for k in ks:
+                    predicted = majority_vote(neighbour_codes[:, :k], n_classes,
+                                              None if vote_weights is None else vote_weights[:, :k],
+                                              seed=seed, row_keys=keys)
+                    results[name, metric, weighting, k] = confusion_counts(codes[test], predicted, n_classes)
+    return results
+
+
+def grid_search(tweets, labels, ks=DEFAULT_KS, metrics=METRICS, weights=WEIGHTS, features=None,
+                n_folds=5, store=None, n_jobs=None, seed=0, normalize=True, stopwords=None,
+                chunk_size=DEFAULT_CHUNK_SIZE):
+    """Cross-validated accuracy and macro F1 of every combination of the options.
+
+    ``features`` defaults to all of ``FEATURES`` when a word2vec ``store``
+    (an ``EmbeddingStore`` or its directory) is given, and to bow and tfidf
+    otherwise. Every fold fits its own vocabulary (and TF-IDF weights) on
+    its training tweets; training tweets without a known word are left out
+    of the word2vec rows, like ``Word2vecKNNClassifier`` does. ``seed``
+    splits the folds and breaks voting ties (keyed on the nearest
+    neighbour, as in the classifiers). Pass ``normalize=False`` for tweets
+    that are already preprocessed.
+
+    Folds run in ``n_jobs`` processes (default: one per CPU, at most one
+    per fold); ``n_jobs=1`` runs them in this process. Returns one dict per
+    setting -- features, metric, weights, k, mean and standard deviation of
+    accuracy and F1 over the folds, and the per-fold values -- best mean
+    F1 first.
+    """
+    if features is None:
+        features = FEATURES if store is not None else tuple(f for f in FEATURES if f != "word2vec")
+    for option, values, allowed in (("features", features, FEATURES), ("metric", metrics, METRICS),
+                                    ("weights", weights, WEIGHTS)):
+        for value in values:
+            if value not in allowed:
+                raise ValueError("Unsupported {} {!r}, expected one of {}".format(option, value, allowed))
+    if "word2vec" in features and store is None:
+        raise ValueError("word2vec features need an EmbeddingStore")
+    ks = sorted(set(ks))
+    if not ks or ks[0] < 1:
+        raise ValueError("Expected k values of at least 1, got {}".format(ks))
+
+    texts = list(tweets)
+    if normalize:
+        texts = TweetNormalizer(load_stopwords() if stopwords is None else stopwords).clean_many(texts)
+    classes, codes = encode_labels(np.asarray(labels))
+    folds = stratified_folds(codes, n_folds, seed)
+    args = (tuple(features), tuple(metrics), tuple(weights), ks, seed, chunk_size)
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, n_folds)
+    if n_jobs == 1:
+        _init_fold_worker(texts, codes, len(classes), folds, store)
+        try:
+            fold_results = [_score_fold(fold, *args) for fold in range(n_folds)]
+        finally:
+            _init_fold_worker(None, None, None, None, None)
+    else:
+        if isinstance(store, EmbeddingStore):
+            if store.path is None:
+                raise ValueError("The embedding store was not loaded from a directory, so workers cannot load it")
+            store = store.path
+        with ProcessPoolExecutor(n_jobs, initializer=_init_fold_worker,
+                                 initargs=(texts, codes, len(classes), folds, store)) as executor:
+            fold_results = list(executor.map(_score_fold, range(n_folds), *([arg] * n_folds for arg in args)))
+
+    report = []
+    for (name, metric, weighting, k) in fold_results[0]:
+        scores = [macro_scores(result[name, metric, weighting, k]) for result in fold_results]
+        accuracy = np.array([s["accuracy"] for s in scores])
+        f1 = np.array([s["f1"] for s in scores])
+        report.append({"features": name, "metric": metric, "weights": weighting, "k": k,
+                       "accuracy": accuracy.mean(), "accuracy_std": accuracy.std(),
+                       "f1": f1.mean(), "f1_std": f1.std(),
+                       "fold_accuracy": accuracy.tolist(), "fold_f1": f1.tolist()})
+    report.sort(key=lambda row: (-row["f1"], -row["accuracy"]))
+    return report
+
+
+def format_grid(report, top=None):
+    """Table of the settings of ``grid_search``, best first."""
+    lines = ["{:<9} {:<10} {:<9} {:>3} {:>17} {:>17}".format(
+        "features", "metric", "weights", "k", "accuracy", "macro F1")]
+    for row in report[:top]:
+        lines.append("{:<9} {:<10} {:<9} {:>3} {:>8.4f} +- {:.4f} {:>8.4f} +- {:.4f}".format(
+            row["features"], row["metric"], row["weights"], row["k"],
+            row["accuracy"], row["accuracy_std"], row["f1"], row["f1_std"]))
+    return "\n".join(lines)
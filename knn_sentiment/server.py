@@ -0,0 +1,252 @@
+"""Online inference over HTTP with micro-batching.
+
+``serve`` loads a fitted model once and answers on a local port:
+
+* ``POST /predict`` with ``{"tweet": "..."}`` returns
+  ``{"label": ..., "proba": {class: p, ...}}``,
+* ``GET /metrics`` returns request and batch counts, p50/p99 latency and
+  batch-size statistics, plus the per-stage stats of ``instrument`` when
+  it is enabled,
+* ``GET /health`` returns ``{"status": "ok"}``.
+
+Requests are not scored one by one. ``MicroBatcher`` queues them and a
+single batching task takes up to ``max_batch_size`` queued tweets, waiting
+at most ``max_wait`` seconds for more after the first one, then runs the
+vectorized featurize + top-k + vote path once for the whole batch in a
+worker thread. Under load the batches fill up and the per-tweet cost drops;
+when idle a tweet waits at most ``max_wait``.
+
+Only the standard library is used: the HTTP/1.1 handling is the small
+subset needed here (Content-Length bodies, keep-alive).
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from . import instrument
+
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT = 0.002
+METRICS_WINDOW = 10000
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            500: "Internal Server Error"}
+
+
+class ServingMetrics:
+    """Counters plus the latencies and batch sizes of the last ``window`` requests/batches."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def record_request(self, latency):
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        latencies = np.asarray(self.latencies) * 1000
+        sizes = np.asarray(self.batch_sizes)
+        uptime = time.perf_counter() - self.started
+        report = {"requests": self.requests, "batches": self.batches, "uptime_s": round(uptime, 3),
+                  "requests_per_s": round(self.requests / uptime, 1) if uptime else 0.0}
+        if len(latencies):
+            p50, p99 = np.percentile(latencies, [50, 99])
+            report.update(latency_p50_ms=round(p50, 3), latency_p99_ms=round(p99, 3),
+                          latency_max_ms=round(latencies.max(), 3))
+        if len(sizes):
+            report.update(batch_size_mean=round(sizes.mean(), 2), batch_size_p50=float(np.median(sizes)),
+                          batch_size_max=int(sizes.max()))
+        if instrument.is_enabled():
+            report["pipeline"] = instrument.snapshot()
+        return report
+
+
+class MicroBatcher:
+    """Groups concurrent ``predict`` calls into batches for one model.
+
+    Must be started with ``start()`` inside a running event loop. The model
+    runs in a worker thread, so the loop keeps accepting requests (and
+    filling the next batch) while a batch is being scored.
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT,
+                 metrics=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = ServingMetrics() if metrics is None else metrics
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def predict(self, tweet):
+        """``(label, {class: probability})`` of one tweet."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((tweet, future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            tweets = [tweet for tweet, _ in batch]
+            try:
+                labels, proba = await loop.run_in_executor(None, self.model.predict_with_proba, tweets)
+            except Exception as error:  # Fail the batch's requests, keep serving
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.metrics.record_batch(len(batch))
+            classes = [str(c) for c in self.model.classes]
+            for (_, future), label, row in zip(batch, labels, proba):
+                if not future.done():
+                    future.set_result((str(label), dict(zip(classes, row.tolist()))))
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload).encode("utf-8")
+    head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status, _REASONS[status], len(body), "keep-alive" if keep_alive else "close")
+    return head.encode("ascii") + body
+
+
+async def _read_request(reader):
+    # Returns (method, path, headers, body), or None when the client closed the connection.
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, version = line.decode("latin-1").split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    headers["_version"] = version
+    return method, path, headers, body
+
+
+class PredictionServer:
+    """HTTP front end of a ``MicroBatcher``."""
+
+    def __init__(self, model, host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT):
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(model, max_batch_size, max_wait)
+        self.server = None
+
+    @property
+    def metrics(self):
+        return self.batcher.metrics
+
+    async def start(self):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]  # The actual port when 0 was asked for
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_response(400, {"error": "malformed request"}, False))
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close" and headers["_version"] == "HTTP/1.1"
+                status, payload = await self._dispatch(method, path, body)
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            start = time.perf_counter()
+            try:
+                tweet = json.loads(body)["tweet"]
+                if not isinstance(tweet, str):
+                    raise TypeError
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": 'expected a JSON body {"tweet": "..."}'}
+            try:
+                label, proba = await self.batcher.predict(tweet)
+            except Exception as error:
+                return 500, {"error": str(error)}
+            self.metrics.record_request(time.perf_counter() - start)
+            return 200, {"label": label, "proba": proba}
+        if path == "/metrics":
+            return 200, self.metrics.snapshot()
+        if path == "/health":
+            return 200, {"status": "ok"}
+        return 404, {"error": "unknown path {}".format(path)}
+
+
+def serve(model, host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+    """Run a ``PredictionServer`` until interrupted."""
+    server = PredictionServer(model, host, port, max_batch_size, max_wait)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,53 @@
+"""Loading stopword lists and removing stopwords from tweets.
+
+Stopword files hold whitespace separated words (one per line in
+stop_words.txt). Every file is parsed once per process and kept as a
+frozenset, so checking a word is a hash lookup rather than a scan of a list.
+"""
+
+import functools
+import os
+
+from . import instrument
+
+# stop_words.txt at the root of the repository
+DEFAULT_STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "stop_words.txt")
+
+
+@functools.lru_cache(maxsize=None)
+def _read_stopwords(path, mtime):
+    # mtime is part of the cache key so an edited file is read again.
+    with open(path, "r", encoding="utf-8") as file:
+        return frozenset(file.read().split())
+
+
+def load_stopwords(*paths):
+    """Stopwords of the given files as one frozenset.
+
+    With no arguments stop_words.txt is loaded. Domain specific lists can be
+    added by passing more files, e.g. ``load_stopwords(DEFAULT_STOPWORDS_PATH,
+    "airline_stop_words.txt")``.
+    """
+    if not paths:
+        paths = (DEFAULT_STOPWORDS_PATH,)
+    sets = []
+    for path in paths:
+        path = os.path.abspath(path)
+        sets.append(_read_stopwords(path, os.stat(path).st_mtime_ns))
+    return sets[0] if len(sets) == 1 else frozenset().union(*sets)
+
+
+def remove_stopwords(text, stopwords=None):
+    """``text`` with its stopwords removed, words joined by single spaces."""
+    if stopwords is None:
+        stopwords = load_stopwords()
+    return " ".join(w for w in text.split() if w not in stopwords)
+
+
+@instrument.timed("text.stopwords", items=len)
+def remove_stopwords_many(texts, stopwords=None):
+    """``remove_stopwords`` for every text of an iterable, e.g. a DataFrame column."""
+    if stopwords is None:
+        stopwords = load_stopwords()
+    return [" ".join(w for w in text.split() if w not in stopwords) for text in texts]
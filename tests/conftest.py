@@ -0,0 +1,12 @@
+import os
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def train_frame():
+    """The first 2000 labelled tweets of train.csv."""
+    return pd.read_csv(os.path.join(ROOT, "train.csv"), nrows=2000)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from scipy.spatial.distance import cdist
+
+from knn_sentiment import QuantizedMatrix, pairwise_distances
+from knn_sentiment.distance import METRICS
+
+
+def _counts(n_rows, seed):
+    # Word counts with some empty rows, as dense float64.
+    rng = np.random.default_rng(seed)
+    X = rng.integers(1, 5, (n_rows, 25)) * (rng.random((n_rows, 25)) < 0.2)
+    X[::7] = 0
+    return X.astype(np.float64)
+
+
+QUERY_FORMATS = {
+    "dense": lambda X: X,
+    "csr": sp.csr_matrix,
+}
+
+TRAIN_FORMATS = {
+    "dense": lambda X: X,
+    "float32": lambda X: X.astype(np.float32),
+    "csr": sp.csr_matrix,
+    "csr-uint8": lambda X: sp.csr_matrix(X.astype(np.uint8)),
+    "csr-uint16": lambda X: sp.csr_matrix(X.astype(np.uint16)),
+    "quantized": QuantizedMatrix.from_array,
+}
+
+
+def _expected(A, B, metric):
+    expected = cdist(A, B, "cityblock" if metric == "manhattan" else metric)
+    if metric == "cosine":
+        # Rows with no words are at distance 1 from everything, instead of nan.
+        empty = (A == 0).all(axis=1)[:, None] | (B == 0).all(axis=1)[None, :]
+        assert np.isnan(expected[empty]).all()
+        expected[empty] = 1
+    return expected
+
+
+@pytest.mark.parametrize("metric", METRICS)
+@pytest.mark.parametrize("query_format", QUERY_FORMATS)
+@pytest.mark.parametrize("train_format", TRAIN_FORMATS)
+def test_pairwise_distances_equal_cdist(metric, query_format, train_format):
+    A, B = _counts(30, seed=1), _counts(60, seed=2)
+    B_stored = TRAIN_FORMATS[train_format](B)
+    # Compare with the values the stored rows stand for (int8 codes are rounded).
+    B_values = np.asarray(B_stored, dtype=np.float64) if train_format == "quantized" else B
+    distances = pairwise_distances(QUERY_FORMATS[query_format](A), B_stored, metric)
+    assert distances.dtype == np.float64
+    tolerance = 1e-4 if train_format in ("float32", "quantized") else 1e-9
+    np.testing.assert_allclose(distances, _expected(A, B_values, metric), rtol=tolerance, atol=tolerance)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from knn_sentiment import BoWKNNClassifier, BruteForceIndex, IncrementalIndex, InvertedIndex
+
+
+def _rows(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    return sp.random(n_rows, 40, density=0.1, format="csr", random_state=rng,
+                     data_rvs=lambda size: rng.integers(1, 4, size).astype(np.float64))
+
+
+@pytest.mark.parametrize("make_main", [lambda: BruteForceIndex(), lambda: InvertedIndex(),
+                                       lambda: InvertedIndex("cosine")])
+def test_incremental_index_after_add_and_remove_equals_rebuild(make_main):
+    X, Q = _rows(600, seed=1), _rows(50, seed=2)
+    main = make_main()
+    index = IncrementalIndex(main).build(X[:300])
+    for start in range(300, 600, 25):  # The tail is merged into main more than once
+        index.add(X[start:start + 25])
+    removed = np.r_[0:300:7, 590:600, 305]
+    index.remove(removed)
+    keep = np.ones(len(index.deleted), dtype=bool)
+    keep[removed] = False
+    expected_distances, expected = type(main)(main.metric).build(X[keep]).query(Q, 30)
+    for _ in range(2):
+        distances, indices = index.query(Q, 30)
+        np.testing.assert_array_equal(indices, np.flatnonzero(keep)[expected])
+        np.testing.assert_allclose(distances, expected_distances, atol=1e-12)
+        index.compact()
+        keep = np.ones(keep.sum(), dtype=bool)
+
+
+def test_model_after_append_and_delete_equals_refit(train_frame):
+    tweets, labels = train_frame["Tweet"].astype(str), train_frame["Sentiment"]
+    model = BoWKNNClassifier().fit(tweets[:1000], labels[:1000])
+    ids = np.concatenate([model.append(tweets[start:start + 200], labels[start:start + 200])
+                          for start in range(1000, 2000, 200)])
+    np.testing.assert_array_equal(ids, np.arange(1000, 2000))
+    kept = np.arange(2000)
+    # A few deletions are tombstoned; the second batch passes max_deleted_fraction and compacts.
+    for deleted in (np.r_[3:1000:40, 1500:1530], np.r_[1000:1400:2]):
+        model.delete(deleted)
+        kept = np.setdiff1d(kept, deleted)
+        refit = BoWKNNClassifier().fit(tweets[kept], labels[kept])
+
+        # Queries whose words are all in both vocabularies, so the distances match too.
+        queries = tweets[kept[::10]]
+        distances, indices = model.kneighbors(queries)
+        expected_distances, expected = refit.kneighbors(queries)
+        np.testing.assert_array_equal(model.row_ids[indices], kept[expected])
+        np.testing.assert_allclose(distances, expected_distances, atol=1e-12)
+        np.testing.assert_array_equal(model.classes[model.label_codes[indices]],
+                                      labels.to_numpy()[kept[expected]])
+    assert len(model.row_ids) == len(kept)
+
+
+def test_append_keeps_classes_sorted(train_frame):
+    tweets, labels = train_frame["Tweet"].astype(str), train_frame["Sentiment"].to_numpy()
+    model = BoWKNNClassifier().fit(tweets[:500], labels[:500])
+    model.append(["so so", "meh"], ["mixed", "angry"])
+    assert model.classes.tolist() == sorted(set(labels[:500].tolist()) | {"mixed", "angry"})
+    np.testing.assert_array_equal(model.classes[model.label_codes],
+                                  np.r_[labels[:500], ["mixed", "angry"]])
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from knn_sentiment import BruteForceIndex, InvertedIndex, TweetNormalizer, Vocabulary, bow_matrix
+
+
+def _counts(n_rows, n_words, seed):
+    # Small counts over few words, so many rows are duplicates or tie in distance.
+    rng = np.random.default_rng(seed)
+    X = sp.random(n_rows, n_words, density=0.08, format="csr", random_state=rng,
+                  data_rvs=lambda size: rng.integers(1, 4, size))
+    empty = np.arange(n_rows) % 17 == 0
+    return sp.csr_matrix(sp.diags((~empty).astype(X.dtype)) @ X)  # Some empty rows
+
+
+def _assert_same(index, X, Q, k, metric):
+    distances, indices = index.build(X).query(Q, k)
+    expected_distances, expected_indices = BruteForceIndex(metric).build(X).query(Q, k)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-12)
+
+
+@pytest.mark.parametrize("metric", InvertedIndex.metrics)
+@pytest.mark.parametrize("dtype", [np.float64, np.uint8])
+def test_inverted_index_equals_brute_force_with_ties(metric, dtype):
+    X = _counts(500, 30, seed=1).astype(dtype)
+    Q = _counts(80, 30, seed=2).astype(np.float64)
+    Q = sp.vstack([Q, X[:20].astype(np.float64)], format="csr")  # Queries equal to training rows
+    _assert_same(InvertedIndex(metric, chunk_size=16), X, Q, 25, metric)
+
+
+@pytest.mark.parametrize("metric", InvertedIndex.metrics)
+def test_inverted_index_more_neighbours_than_shared_words(metric):
+    # Most neighbours share no word with the query and come from the norm order.
+    X = _counts(300, 200, seed=3)
+    Q = _counts(40, 200, seed=4)
+    _assert_same(InvertedIndex(metric), X, Q, 100, metric)
+
+
+@pytest.mark.parametrize("metric", InvertedIndex.metrics)
+def test_inverted_index_equals_brute_force_on_tweets(train_frame, metric):
+    texts = TweetNormalizer().clean_many(train_frame["Tweet"].astype(str))
+    train, test = texts[:1600], texts[1600:]
+    vocabulary = Vocabulary().fit(train)
+    X = bow_matrix(train, vocabulary)
+    _assert_same(InvertedIndex(metric), X, bow_matrix(test, vocabulary), 10, metric)
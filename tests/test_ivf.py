@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from knn_sentiment import BruteForceIndex, IVFIndex, IncrementalIndex, NeighbourIndex, QuantizedMatrix, recall_at_k
+
+
+def _clusters(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(20, 16)) * 4
+    return (centres[rng.integers(0, 20, n_rows)] + rng.normal(size=(n_rows, 16))).astype(np.float32)
+
+
+@pytest.mark.parametrize("metric", IVFIndex.metrics)
+def test_probing_every_list_is_exact(metric):
+    X, Q = _clusters(2000, seed=1), _clusters(100, seed=2)
+    index = IVFIndex(n_lists=16, n_probe=16, metric=metric).build(X)
+    distances, indices = index.query(Q, 10)
+    expected_distances, expected = BruteForceIndex(metric).build(X).query(Q, 10)
+    assert recall_at_k(indices, expected) == 1.0
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("pq_subspaces", [None, 4])
+def test_small_lists_are_never_padded(pq_subspaces):
+    # With one probe and 64 lists over 300 rows, most probed lists hold fewer than k rows.
+    X, Q = _clusters(300, seed=3), _clusters(50, seed=4)
+    index = IVFIndex(n_lists=64, n_probe=1, pq_subspaces=pq_subspaces).build(X)
+    for k in (20, 300, 1000):
+        distances, indices = index.query(Q, k)
+        assert indices.shape == (len(Q), min(k, len(X)))
+        assert ((indices >= 0) & (indices < len(X))).all()
+        assert np.isfinite(distances).all()
+        assert all(len(np.unique(row)) == len(row) for row in indices)
+        assert (np.diff(distances, axis=1) >= 0).all()
+
+
+@pytest.mark.parametrize("rows", ["float32", "quantized"])
+@pytest.mark.parametrize("pq_subspaces", [None, 4])
+def test_save_and_load_round_trip(tmp_path, rows, pq_subspaces):
+    X, Q = _clusters(1000, seed=5), _clusters(50, seed=6)
+    if rows == "quantized":
+        X = QuantizedMatrix.from_array(X)
+    index = IVFIndex(n_lists=16, n_probe=4, pq_subspaces=pq_subspaces, metric="cosine").build(X)
+    index.save(str(tmp_path / "ivf.npz"))
+    loaded = NeighbourIndex.load(str(tmp_path / "ivf.npz"))
+    assert type(loaded.X) is type(index.X)
+    for result, expected in zip(loaded.query(Q, 10), index.query(Q, 10)):
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_incremental_index_over_ivf(tmp_path):
+    X, Q = _clusters(1200, seed=7), _clusters(50, seed=8)
+    index = IncrementalIndex(IVFIndex(n_lists=8, n_probe=8)).build(X[:800])
+    for start in range(800, 1200, 100):  # Merges the tail into a rebuilt IVF index
+        index.add(X[start:start + 100])
+    index.remove(np.arange(0, 1200, 3))
+    keep = ~index.deleted
+    _, expected = BruteForceIndex().build(X[keep]).query(Q, 10)
+    _, indices = index.query(Q, 10)
+    np.testing.assert_array_equal(indices, np.flatnonzero(keep)[expected])
+    index.save(str(tmp_path / "incremental.npz"))
+    np.testing.assert_array_equal(NeighbourIndex.load(str(tmp_path / "incremental.npz")).query(Q, 10)[1], indices)
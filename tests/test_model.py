@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from knn_sentiment import BoWKNNClassifier, kneighbors, top_k
+
+
+@pytest.mark.parametrize("k", [0, -1, 2.5, True])
+def test_k_must_be_a_positive_integer(train_frame, k):
+    with pytest.raises(ValueError):
+        BoWKNNClassifier(k=k)
+    model = BoWKNNClassifier(k=np.int64(3)).fit(train_frame["Tweet"][:200], train_frame["Sentiment"][:200])
+    with pytest.raises(ValueError):
+        model.kneighbors(train_frame["Tweet"][:2], k)
+    with pytest.raises(ValueError):
+        top_k(np.zeros((2, 5)), k)
+    with pytest.raises(ValueError):
+        kneighbors(np.zeros((2, 3)), np.zeros((5, 3)), k)
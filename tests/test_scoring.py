@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from knn_sentiment import confusion_counts, encode_labels, macro_scores
+
+metrics = pytest.importorskip("sklearn.metrics")
+
+CLASSES = ["negative", "neutral", "positive"]
+
+
+@pytest.mark.parametrize("gold, predicted", [
+    # "neutral" is never predicted
+    (["negative", "neutral", "positive", "neutral", "positive"],
+     ["negative", "negative", "positive", "positive", "positive"]),
+    # "negative" never occurs but is predicted
+    (["neutral", "positive", "positive", "neutral"],
+     ["negative", "positive", "neutral", "neutral"]),
+    # "positive" neither occurs nor is predicted, so many class pairs are missing
+    (["negative", "neutral", "negative"],
+     ["negative", "negative", "negative"]),
+])
+def test_scores_with_missing_classes_equal_sklearn(gold, predicted):
+    _, gold_codes = encode_labels(gold, CLASSES)
+    _, pred_codes = encode_labels(predicted, CLASSES)
+    cmatrix = confusion_counts(gold_codes, pred_codes, len(CLASSES))
+    np.testing.assert_array_equal(cmatrix, metrics.confusion_matrix(gold, predicted, labels=CLASSES))
+
+    scores = macro_scores(cmatrix)
+    precision, recall, f1, _ = metrics.precision_recall_fscore_support(
+        gold, predicted, labels=CLASSES, average="macro", zero_division=0)
+    assert scores["accuracy"] == pytest.approx(metrics.accuracy_score(gold, predicted))
+    assert scores["precision"] == pytest.approx(precision)
+    assert scores["recall"] == pytest.approx(recall)
+    assert scores["f1"] == pytest.approx(f1)
+
+
+def test_scores_of_an_empty_confusion_matrix_are_zero():
+    no_codes = np.array([], dtype=np.intp)
+    scores = macro_scores(confusion_counts(no_codes, no_codes, len(CLASSES)))
+    assert scores == {"accuracy": 0.0, "precision": 0.0, "recall": 0.0, "f1": 0.0}
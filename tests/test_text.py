@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from knn_sentiment import TweetNormalizer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The special characters as the scripts listed them, before TweetNormalizer.
+SPECIAL_CHARS = ["!", '"', "%", "&", "amp", "'", "(", ")", "*", "+", ",", "-", ".",
+                 "/", ":", ";", "<", "=", ">", "?", "[", "\\", "]", "^", "_",
+                 "`", "{", "|", "}", "~", "–", "@", "#", "$"]
+
+
+def _old_pipeline(tweets):
+    # The column-by-column preprocessing the scripts used to do.
+    with open(os.path.join(ROOT, "stop_words.txt"), "r") as file:
+        stopwords = file.read().split()
+    column = pd.Series(tweets, dtype=object).str.lower()
+    column = column.apply(lambda tweet: " ".join(word for word in tweet.split() if word not in stopwords))
+    for pattern in (r'http?://[^\s<>"]+|www\.[^\s<>"]+', "@[A-Za-z0-9]+", r"\B#\w*[a-zA-Z]+\w*", r"\d+"):
+        column = column.str.replace(pattern, "", regex=True)
+    for c in SPECIAL_CHARS:
+        column = column.str.replace(c, "", regex=False)
+    return column.tolist()
+
+
+def test_normalizer_equals_old_pipeline_on_tweets(train_frame):
+    tweets = train_frame["Tweet"].astype(str).tolist()
+    assert TweetNormalizer().clean_many(tweets) == _old_pipeline(tweets)
+
+
+def test_normalizer_equals_old_pipeline_on_edge_cases():
+    tweets = ["a&mp b", "a-mp", "&amp; Co", "#Tag2024 #123 x#y", "@User_1 hi @", "http://t.co/x www.a.b/c https://x",
+              "Flight 1620 at 6A", "The THE the", "", "   ", "–dash– and — em", "It's 100% (really)!!"]
+    assert TweetNormalizer().clean_many(tweets) == _old_pipeline(tweets)
+    assert [TweetNormalizer().clean(t) for t in tweets] == _old_pipeline(tweets)